@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Iterable, Optional, Tuple
+
+from constants import CacheConfig
+
+if TYPE_CHECKING:
+    from shared import SharedState
+
+
+@dataclass
+class SensorWindow:
+    """Readings from a single sensor that have not yet expired, with a running sum so the average is O(1)."""
+
+    entries: Deque[Tuple[float, float]] = field(default_factory=deque)
+    total: float = 0.0
+
+    def append(self, expires_at: float, sensor_reading: float):
+        self.entries.append((expires_at, sensor_reading))
+        self.total += sensor_reading
+
+    def evict(self, now: float):
+        """Drops readings whose expiration time has passed, mirroring the expire_in set on recent_readings_db."""
+        while self.entries and self.entries[0][0] <= now:
+            _, sensor_reading = self.entries.popleft()
+            self.total -= sensor_reading
+        if not self.entries:
+            # resets accumulated floating point drift whenever the window empties
+            self.total = 0.0
+
+
+@dataclass
+class SensorWindowAggregator:
+    """Time-windowed running average per sensor, replacing full scans of the recent_readings_db cache.
+    Readings are kept for expiration_seconds, the same duration used for the cache's expire_in.
+
+    Args:
+        expiration_seconds (int): Seconds a reading counts towards the average. Defaults to CacheConfig.EXPIRATION_TIME.
+        loader (Callable, optional): Returns the cached items used to warm the windows on first use.
+        state (SharedState, optional): Holds the windows instead of this process, so that every worker sharing it
+            sees the same averages. Defaults to windows.
+    """
+
+    expiration_seconds: int = CacheConfig.EXPIRATION_TIME.value
+    loader: Optional[Callable[[], Iterable[dict]]] = None
+    state: Optional["SharedState"] = None
+    windows: Dict[str, SensorWindow] = field(default_factory=dict)
+    warmed: bool = False
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def warm(self) -> int:
+        """Loads the readings currently held in the recent readings cache. Only runs once. With a shared state it
+        only runs if the shared windows hold no unexpired readings, e.g. on the first start or after every worker
+        was stopped for longer than expiration_seconds, and only in the first worker to claim it.
+
+        Returns:
+            int: Number of cached readings loaded into the windows
+        """
+        with self._lock:
+            if self.warmed:
+                return 0
+            self.warmed = True
+            if self.loader is None:
+                return 0
+            if self.state is not None:
+                # windows that still hold readings were kept by the state across the restart, and would be
+                # counted twice
+                now = time.time()
+                if self.state.has_readings(now) or not self.state.claim(
+                    "windows_warmed", now, self.expiration_seconds
+                ):
+                    return 0
+            items = sorted(
+                (
+                    (
+                        item.get(
+                            "__expires", item["datetime"] + self.expiration_seconds
+                        ),
+                        item["sensor_name"],
+                        item["sensor_reading"],
+                    )
+                    for item in self.loader()
+                ),
+                key=lambda i: i[0],
+            )
+            now = time.time()
+            self._append(
+                (sensor_name, expires_at, sensor_reading)
+                for expires_at, sensor_name, sensor_reading in items
+                if expires_at > now
+            )
+        logging.debug("warmed sensor windows with %s cached readings", len(items))
+        return len(items)
+
+    def add(
+        self,
+        sensor_name: str,
+        sensor_reading: float,
+        expires_at: Optional[float] = None,
+    ):
+        """Adds a reading to its sensor's window. Call alongside the insert into recent_readings_db.
+
+        Args:
+            sensor_name (str): Name of sensor as specified in the reading field of the event
+            sensor_reading (float): Sensor Reading passed in from Notebook event
+            expires_at (float, optional): Unix time the reading leaves the window. Defaults to now + expiration_seconds.
+        """
+        if not self.warmed:
+            self.warm()
+        if expires_at is None:
+            expires_at = time.time() + self.expiration_seconds
+        with self._lock:
+            self._append([(sensor_name, expires_at, sensor_reading)])
+
+    def _append(self, readings: Iterable[Tuple[str, float, float]]):
+        if self.state is not None:
+            self.state.add_readings(readings)
+            return
+        for sensor_name, expires_at, sensor_reading in readings:
+            self.windows.setdefault(sensor_name, SensorWindow()).append(
+                expires_at, sensor_reading
+            )
+
+    def recent_average(
+        self, sensor_name: str, sensor_reading: float, now: Optional[float] = None
+    ) -> float:
+        """Computes the average of the unexpired readings for a sensor together with the current reading.
+
+        Args:
+            sensor_name (str): Name of sensor as specified in the reading field of the event
+            sensor_reading (float): Current reading, included in the average but not added to the window
+            now (float, optional): Unix time used for eviction. Defaults to time.time().
+
+        Returns:
+            float: Average of the sensor's recent readings
+        """
+        if not self.warmed:
+            self.warm()
+        if now is None:
+            now = time.time()
+        if self.state is not None:
+            total, count = self.state.window(sensor_name, now)
+            return (total + sensor_reading) / (count + 1)
+        with self._lock:
+            window = self.windows.setdefault(sensor_name, SensorWindow())
+            window.evict(now)
+            return (window.total + sensor_reading) / (len(window.entries) + 1)
@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+import orjson
+
+import main
+import model as m
+from aggregator import SensorWindowAggregator
+from constants import CacheConfig, SensorTypes
+from dedup import SeenEvents
+from delivery import Channel, Deliverer, default_recipients
+from dispatch import BackgroundDispatcher
+from geo import GeoIndex
+from latest import LatestReadingIndex
+from outliers import HampelFilter
+from rollups import RollupIndex
+from scheduler import NotificationScheduler
+from shared import MemorySharedState
+from storage import InstrumentedStore, MemoryStore
+from trends import TrendTracker
+from writer import BatchWriter
+
+# environment for runs of the app against stand-ins, only set by the entry points so importing this module
+# doesn't change the configuration of the importing process
+STAND_IN_ENV = {
+    "TWILIO_ACCOUNT_SID": "benchmark",
+    "TWILIO_AUTH_TOKEN": "benchmark",
+    "STORAGE_BACKEND": "memory",
+}
+
+
+def use_stand_in_env():
+    """Fills in STAND_IN_ENV for config that is read on first use, where it isn't set already."""
+    for name, value in STAND_IN_ENV.items():
+        os.environ.setdefault(name, value)
+
+
+class FakeChannel(Channel):
+    """Records messages instead of sending them, waiting latency seconds per message."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent: List[str] = []
+
+    async def send(self, client, address, body):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append(body)
+
+
+@dataclass
+class BenchmarkResult:
+    sensors: int
+    readings_per_event: int
+    cache_size: int
+    events: int
+    p50_ms: float
+    p99_ms: float
+    events_per_second: float
+    round_trips_per_event: float
+    sms_sent: int
+
+
+def create_stand_ins(latency: float) -> Dict[str, Any]:
+    """Fresh in-memory stand-ins for model's stores, alert delivery and ingest state, by the name they replace.
+
+    Args:
+        latency (float): Simulated seconds per storage call and per SMS
+    """
+    shared_state = MemorySharedState()
+    db_writer = BatchWriter()
+    # instrumented like the stores from open_store, so that the cost of metrics is included
+    latest_readings_db = InstrumentedStore(MemoryStore("latest_readings", latency))
+    return {
+        "all_readings_db": InstrumentedStore(
+            MemoryStore("therm-all-readings", latency)
+        ),
+        "recent_readings_db": InstrumentedStore(
+            MemoryStore("recent_readings", latency)
+        ),
+        "latest_readings_db": latest_readings_db,
+        "deliverer": Deliverer(channels={"twilio": FakeChannel(latency)}),
+        "recipients": default_recipients(),
+        "shared_state": shared_state,
+        "recent_window": SensorWindowAggregator(
+            loader=m._fetch_recent_readings, state=shared_state
+        ),
+        "db_writer": db_writer,
+        "latest_readings": LatestReadingIndex(
+            store=latest_readings_db, writer=db_writer
+        ),
+        "rollups": RollupIndex(),
+        "recent_trends": TrendTracker(),
+        "recent_outliers": HampelFilter(),
+        "geo_index": GeoIndex(),
+        "notification_scheduler": NotificationScheduler(state=shared_state),
+        "dispatcher": BackgroundDispatcher(),
+        "seen_events": SeenEvents(),
+    }
+
+
+def install_stand_ins(latency: float) -> List[InstrumentedStore]:
+    """Replaces model's stores, alert delivery and ingest state with fresh in-memory stand-ins, see
+    create_stand_ins. They stay in place, use stand_ins to put model's own objects back afterwards.
+
+    Args:
+        latency (float): Simulated seconds per storage call and per SMS
+
+    Returns:
+        List[InstrumentedStore]: The stores, to count round trips
+    """
+    for name, value in create_stand_ins(latency).items():
+        setattr(m, name, value)
+    return [m.all_readings_db, m.recent_readings_db, m.latest_readings_db]
+
+
+@contextmanager
+def stand_ins(latency: float = 0.0) -> Iterator[List[InstrumentedStore]]:
+    """install_stand_ins for the duration of a with block. Model's own objects are put back when it exits, even
+    if the stand-ins were replaced again inside it, e.g. by run_scenario.
+
+    Yields:
+        List[InstrumentedStore]: The stores, to count round trips
+    """
+    saved = {name: getattr(m, name) for name in create_stand_ins(latency)}
+    try:
+        yield install_stand_ins(latency)
+    finally:
+        for name, value in saved.items():
+            setattr(m, name, value)
+
+
+def generate_events(
+    sensors: int, readings_per_event: int, events: int, seed: int = 0
+) -> List[dict]:
+    """Synthetic webhook payloads, one event a second from sensors reporting in turn. About 1% of readings spike."""
+    rng = random.Random(seed)
+    start = int(time.time())
+    payloads = []
+    for i in range(events):
+        readings = []
+        for j in range(readings_per_event):
+            sensor = (i * readings_per_event + j) % sensors
+            sensor_type = SensorTypes(sensor % len(SensorTypes) + 1)
+            spike = 40 if rng.random() < 0.01 else 0
+            readings.append(
+                {
+                    "sensor_name": f"sensor_{sensor}",
+                    "sensor_reading": rng.gauss(50, 5) + spike,
+                    "sensor_type": int(sensor_type),
+                }
+            )
+        payloads.append(
+            {
+                "datetime": start + i,
+                "event": f"benchmark-{i}",
+                "best_lat": 45.5728875,
+                "best_long": -122.66610937499999,
+                "readings": readings,
+            }
+        )
+    return payloads
+
+
+def fill_cache(sensors: int, cache_size: int):
+    """Puts cache_size readings into the recent readings cache, as if they had arrived just before the run."""
+    now = int(time.time())
+    m.recent_readings_db.put_many(
+        [
+            {
+                "datetime": now,
+                "event": "benchmark-cache",
+                "sensor_name": f"sensor_{i % sensors}",
+                "sensor_reading": 50.0,
+                "recent_average": 50.0,
+                "sensor_type": 1,
+            }
+            for i in range(cache_size)
+        ],
+        expire_in=CacheConfig.EXPIRATION_TIME.value,
+    )
+
+
+async def run_scenario(
+    sensors: int,
+    readings_per_event: int,
+    cache_size: int,
+    events: int,
+    latency: float = 0.0,
+) -> BenchmarkResult:
+    """Sends events one at a time through validation and sensor_event against fresh stand-ins, which are left in
+    place, see stand_ins. Latency is measured per event, throughput and round trips include draining the
+    background writes.
+    """
+    stores = install_stand_ins(latency)
+    fill_cache(sensors, cache_size)
+    for store in stores:
+        store.calls.clear()
+    payloads = generate_events(sensors, readings_per_event, events)
+
+    await m.dispatcher.start()
+    latencies = []
+    started = time.perf_counter()
+    for payload in payloads:
+        t = time.perf_counter()
+        await main.acknowledge(orjson.dumps(payload))
+        latencies.append(time.perf_counter() - t)
+    await main.send_digest(force=True)
+    await m.dispatcher.stop()
+    await asyncio.to_thread(m.db_writer.close)
+    elapsed = time.perf_counter() - started
+
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return BenchmarkResult(
+        sensors=sensors,
+        readings_per_event=readings_per_event,
+        cache_size=cache_size,
+        events=events,
+        p50_ms=round(float(p50), 3),
+        p99_ms=round(float(p99), 3),
+        events_per_second=round(events / elapsed, 1),
+        round_trips_per_event=round(
+            sum(sum(s.calls.values()) for s in stores) / events, 3
+        ),
+        sms_sent=len(m.deliverer.channels["twilio"].sent),
+    )
+
+
+# run in a fresh interpreter by measure_cold_start, printing seconds from importing main to the first response
+COLD_START = """
+import time
+from fastapi.testclient import TestClient
+started = time.perf_counter()
+import main
+client = TestClient(main.app)
+client.post("/", json={event})
+print(time.perf_counter() - started)
+"""
+
+
+def measure_cold_start(runs: int = 5) -> float:
+    """Median seconds from importing main to the response to its first webhook event, each run in a new process.
+    Uses the memory storage backend, so it measures the app's own start up rather than connecting to storage.
+    """
+    event = generate_events(sensors=1, readings_per_event=1, events=1)[0]
+    event["readings"][0]["sensor_reading"] = 50.0
+    code = COLD_START.format(event=repr(event))
+    timings = [
+        float(
+            subprocess.run(
+                [sys.executable, "-c", code],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env={**STAND_IN_ENV, **os.environ},
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        )
+        for _ in range(runs)
+    ]
+    return statistics.median(timings)
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the webhook ingest path offline against in-memory storage and Twilio stand-ins."
+    )
+    parser.add_argument("--sensors", type=_int_list, default=[10, 100, 500])
+    parser.add_argument("--readings", type=_int_list, default=[1, 10])
+    parser.add_argument("--cache", type=_int_list, default=[0, 1000])
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0.0,
+        help="simulated latency of each storage call and SMS",
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument(
+        "--cold-start",
+        action="store_true",
+        help="only measure the time from importing main to the first response",
+    )
+    args = parser.parse_args()
+    use_stand_in_env()
+
+    if args.cold_start:
+        print(f"cold start: {measure_cold_start() * 1000:.0f} ms")
+        raise SystemExit
+
+    results = [
+        asyncio.run(
+            run_scenario(sensors, readings, cache, args.events, args.latency_ms / 1000)
+        )
+        for sensors in args.sensors
+        for readings in args.readings
+        for cache in args.cache
+    ]
+    if args.json:
+        print(json.dumps([asdict(r) for r in results], indent=2))
+    else:
+        columns = list(asdict(results[0]))
+        print("  ".join(columns))
+        for result in results:
+            print(
+                "  ".join(
+                    f"{v:>{len(c)}}" for c, v in zip(columns, asdict(result).values())
+                )
+            )
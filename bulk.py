@@ -0,0 +1,86 @@
+import codecs
+import json
+from typing import AsyncIterable, AsyncIterator, List
+
+from constants import BulkConfig
+
+_decoder = json.JSONDecoder()
+
+
+async def iter_json_records(chunks: AsyncIterable[bytes]) -> AsyncIterator[dict]:
+    """Incrementally parses a request body holding either a JSON array of objects or NDJSON
+    (one object per line), yielding each object as soon as it is complete.
+
+    Args:
+        chunks (AsyncIterable[bytes]): Body chunks, e.g. Request.stream()
+
+    Raises:
+        ValueError: The body isn't a JSON array or NDJSON
+
+    Yields:
+        dict: Each record in the body
+    """
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    is_array = None
+    pos = 0
+    async for chunk in chunks:
+        buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+        if is_array is None:
+            stripped = buffer.lstrip()
+            if not stripped:
+                continue
+            is_array = stripped[0] == "["
+            if is_array:
+                pos = len(buffer) - len(stripped) + 1
+        if is_array:
+            while True:
+                pos = _skip_separators(buffer, pos)
+                if pos >= len(buffer) or buffer[pos] == "]":
+                    break
+                try:
+                    record, end = _decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # the record continues in the next chunk
+                    break
+                pos = end
+                yield record
+        else:
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+    buffer = buffer[pos:] + utf8.decode(b"", final=True)
+    if is_array:
+        if buffer.strip() != "]":
+            raise ValueError("body is not a complete JSON array")
+    elif buffer.strip():
+        yield json.loads(buffer)
+
+
+def _skip_separators(buffer: str, pos: int) -> int:
+    while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+        pos += 1
+    return pos
+
+
+async def iter_batches(
+    records: AsyncIterable[dict], size: int = BulkConfig.CHUNK_SIZE.value
+) -> AsyncIterator[List[dict]]:
+    """Groups records into lists of at most size records, sorted by their datetime.
+    Backfills are replayed in timestamp order within each batch, so records should arrive roughly in order.
+    """
+    batch: List[dict] = []
+    async for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield sorted(batch, key=_record_datetime)
+            batch = []
+    if batch:
+        yield sorted(batch, key=_record_datetime)
+
+
+def _record_datetime(record: dict):
+    datetime = record.get("datetime") if isinstance(record, dict) else None
+    return datetime if isinstance(datetime, (int, float)) else 0
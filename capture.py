@@ -0,0 +1,93 @@
+import os
+import struct
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+MAGIC = b"HTCAP001"
+# arrival time in unix seconds and body length, followed by the body as received
+RECORD_HEADER = struct.Struct("<dI")
+
+
+class CaptureWriter:
+    """Appends webhook bodies as they arrive to a capture file, for replay.py to replay. Each record is a 12 byte
+    header and the body bytes as received, so capturing costs one write per event and replays send exactly what
+    Notehub sent, invalid bodies included.
+
+    Several workers can capture to the same file. Each record is written with a single unbuffered write to a
+    file opened with O_APPEND, so records from different workers never interleave, and a new file is created
+    with its header already in place, so the header is written once.
+
+    Args:
+        path (str): Capture file, appended to if it exists
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        _create(path)
+        self._fd: Optional[int] = os.open(path, os.O_WRONLY | os.O_APPEND)
+        self._lock = threading.Lock()
+
+    def record(self, body: bytes, arrived: Optional[float] = None):
+        header = RECORD_HEADER.pack(
+            time.time() if arrived is None else arrived, len(body)
+        )
+        with self._lock:
+            if self._fd is not None:
+                os.write(self._fd, header + body)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def _create(path: str):
+    # the header is written to a file of this process and linked into place, which fails if the file exists,
+    # so no worker can append to a new capture before its header
+    staging = f"{path}.{os.getpid()}.tmp"
+    with open(staging, "wb") as f:
+        f.write(MAGIC)
+    try:
+        os.link(staging, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(staging)
+
+
+def write_capture(path: str, records: Iterable[Tuple[float, bytes]]) -> int:
+    """Writes (arrival time, body) records to a new capture file at path, e.g. to capture synthetic events.
+
+    Returns:
+        int: Number of records written
+    """
+    count = 0
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        for arrived, body in records:
+            f.write(RECORD_HEADER.pack(arrived, len(body)) + body)
+            count += 1
+    return count
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, bytes]]:
+    """Reads the (arrival time, body) records of a capture file in the order they arrived. A record cut short,
+    e.g. by the server stopping mid write, ends the capture.
+
+    Raises:
+        ValueError: path isn't a capture file
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} isn't a capture file")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            arrived, size = RECORD_HEADER.unpack(header)
+            body = f.read(size)
+            if len(body) < size:
+                return
+            yield arrived, body
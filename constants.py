@@ -1,5 +1,7 @@
 from enum import Enum, IntEnum
 from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping, Tuple
 
 
 class CacheConfig(IntEnum):
@@ -8,6 +10,10 @@ class CacheConfig(IntEnum):
 
 class AlertTiming(IntEnum):
     AVERAGE_ALERT_WINDOW = 300
+    # an alert for the same sensor and reason isn't repeated within the cooldown
+    NOTIFICATION_COOLDOWN = 1800
+    # alerts are merged into at most one SMS per digest interval
+    DIGEST_INTERVAL = 60
 
 
 class SensorTypes(IntEnum):
@@ -16,33 +22,84 @@ class SensorTypes(IntEnum):
     AIRQUALITY = 3
 
 
-@dataclass
-class SensorConfig:
-    sensor_type: SensorTypes
-    thresholds: dict[str, int] = field(init=False, default_factory=dict)
+# names of the thresholds of a sensor, in the column order used by evaluation.evaluate_batch
+THRESHOLD_NAMES = (
+    "average",
+    "single_reading",
+    "single_increase_change",
+    "average_increase_change",
+    "low_average",
+    "low_single_reading",
+    "single_decrease_change",
+    "outlier_change",
+)
 
-    def __post_init__(self):
-        if self.sensor_type == SensorTypes.TEMPERATURE:
-            self.thresholds = {
+# thresholds of each sensor type, unless changed in the rules file, see rules.py. Low thresholds are off
+# until set there, as what's too low depends on where a sensor is and the unit it reports in.
+DEFAULT_THRESHOLDS: Mapping[SensorTypes, Mapping[str, float]] = MappingProxyType(
+    {
+        SensorTypes.TEMPERATURE: MappingProxyType(
+            {
                 "average": 80,
                 "single_reading": 80,
                 "single_increase_change": 10,
                 "average_increase_change": 10,
+                "low_average": float("-inf"),
+                "low_single_reading": float("-inf"),
+                "single_decrease_change": 10,
+                "outlier_change": 15,
             }
-        elif self.sensor_type == SensorTypes.HUMIDITY:
-            self.thresholds = {
+        ),
+        SensorTypes.HUMIDITY: MappingProxyType(
+            {
                 "average": 80,
                 "single_reading": 90,
                 "single_increase_change": 20,
                 "average_increase_change": 20,
+                "low_average": float("-inf"),
+                "low_single_reading": float("-inf"),
+                "single_decrease_change": 20,
+                "outlier_change": 25,
             }
-        elif self.sensor_type == SensorTypes.AIRQUALITY:
-            self.thresholds = {
+        ),
+        SensorTypes.AIRQUALITY: MappingProxyType(
+            {
                 "average": 35,
                 "single_reading": 90,
                 "single_increase_change": 15,
                 "average_increase_change": 15,
+                "low_average": float("-inf"),
+                "low_single_reading": float("-inf"),
+                # falling air quality readings aren't a problem
+                "single_decrease_change": float("inf"),
+                "outlier_change": 30,
             }
+        ),
+    }
+)
+
+
+@dataclass(frozen=True)
+class SensorConfig:
+    """Thresholds of a sensor. Immutable, so one instance is shared by every reading it applies to.
+    The thresholds default to DEFAULT_THRESHOLDS for the sensor type.
+    """
+
+    sensor_type: SensorTypes
+    thresholds: Mapping[str, float] = None  # type: ignore
+    # thresholds in THRESHOLD_NAMES order
+    values: Tuple[float, ...] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        thresholds = (
+            DEFAULT_THRESHOLDS[self.sensor_type]
+            if self.thresholds is None
+            else MappingProxyType(dict(self.thresholds))
+        )
+        object.__setattr__(self, "thresholds", thresholds)
+        object.__setattr__(
+            self, "values", tuple(float(thresholds[n]) for n in THRESHOLD_NAMES)
+        )
 
 
 class NotificationType(Enum):
@@ -54,3 +111,120 @@ class NotificationType(Enum):
     TOO_LOW_AVERAGE = 6
     NOOP = 7
     RAPID_INCREASE_AVERAGE = 8
+
+
+# weight of each new reading in a sensor's exponentially weighted mean and variance, see trends.TrendTracker
+TREND_SMOOTHING = 0.2
+
+
+class TrendConfig(IntEnum):
+    # rate of change rules need this many readings, including the current one, in the sensor's window
+    MIN_READINGS = 3
+    # most readings per sensor the slope is fitted over, bounding memory for fast sensors
+    MAX_READINGS = 256
+    # a RAPID_DECREASE must also be this many standard deviations below the sensor's mean
+    DEVIATIONS = 3
+
+
+# scales a median absolute deviation to the standard deviation of normally distributed readings
+MAD_SCALE = 1.4826
+
+
+class OutlierConfig(IntEnum):
+    # readings per sensor the median and MAD of the Hampel filter are taken over, see outliers.HampelFilter
+    WINDOW_SIZE = 15
+    # a reading is an outlier if it's this many scaled MADs from the median
+    DEVIATIONS = 3
+    # readings a sensor needs before any are flagged as outliers
+    MIN_READINGS = 5
+
+
+# seconds before the first retry of a failed delivery, doubling after each, see delivery.Deliverer
+DELIVERY_BACKOFF = 0.5
+
+
+class DeliveryConfig(IntEnum):
+    # most alert messages in flight at once, also the size of the HTTP connection pool
+    CONCURRENCY = 10
+    # tries per message before it's given up on
+    ATTEMPTS = 4
+    # seconds per HTTP request
+    TIMEOUT = 10
+
+
+# seconds before the first retry of a failed batch write, doubling after each, see writer.BatchWriter
+WRITER_BACKOFF = 1.0
+
+
+class WriterConfig(IntEnum):
+    # Deta Base accepts at most 25 items per put_many
+    BATCH_SIZE = 25
+    FLUSH_INTERVAL = 2
+    SHUTDOWN_ATTEMPTS = 3
+    # tries per batch before its items are moved to the dead letter file
+    MAX_ATTEMPTS = 5
+    # most items buffered, the oldest batches are dead lettered beyond this while storage is failing
+    MAX_BUFFERED = 10000
+
+
+class DispatchConfig(IntEnum):
+    QUEUE_SIZE = 1000
+    STORAGE_WORKERS = 2
+    NOTIFICATION_WORKERS = 1
+    SHUTDOWN_TIMEOUT = 10
+
+
+class BulkConfig(IntEnum):
+    # events sorted and parsed together during a bulk ingest
+    CHUNK_SIZE = 500
+    # validation errors included in a bulk ingest response
+    MAX_REPORTED_ERRORS = 10
+
+
+class ExportConfig(IntEnum):
+    # items fetched from storage per page during an export
+    PAGE_SIZE = 1000
+    # rows encoded together into one chunk of the response body
+    ROWS_PER_CHUNK = 500
+
+
+class DedupConfig(IntEnum):
+    # (event, sensor_name) pairs remembered exactly
+    SEEN_LRU_SIZE = 10000
+    # pairs remembered by the Bloom filters behind the LRU
+    SEEN_FILTER_CAPACITY = 1000000
+
+
+# false positive rate of the two Bloom filter generations together, i.e. new readings wrongly dropped as retries
+SEEN_FILTER_ERROR_RATE = 0.0001
+
+
+class RulesConfig(IntEnum):
+    # seconds between checks of the rules file for changes
+    RELOAD_INTERVAL = 5
+
+
+class LogConfig(IntEnum):
+    # size at which the log file is rotated, and rotated files kept
+    MAX_BYTES = 10_000_000
+    BACKUP_COUNT = 5
+    # one in this many debug records is written per logging call site
+    SAMPLE_EVERY = 100
+
+
+# size in degrees of the cells of geo.GeoIndex, about 5.5 km north to south
+GEO_CELL_DEGREES = 0.05
+
+
+class RollupResolution(IntEnum):
+    MINUTE = 60
+    HOUR = 3600
+    DAY = 86400
+
+
+# number of buckets kept per sensor at each rollup resolution
+ROLLUP_RETENTION = {
+    RollupResolution.MINUTE: 2 * 24 * 60,
+    RollupResolution.HOUR: 90 * 24,
+    RollupResolution.DAY: 10 * 365,
+}
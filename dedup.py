@@ -0,0 +1,127 @@
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Set
+
+from constants import SEEN_FILTER_ERROR_RATE, DedupConfig
+
+
+class BloomFilter:
+    """Fixed size set membership test that may report false positives at about error_rate but never false negatives.
+
+    Args:
+        capacity (int): Number of keys it is sized for
+        error_rate (float): False positive rate once capacity keys have been added
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key: str) -> List[int]:
+        # double hashing, the k positions are h1 + i * h2 from one 128 bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._array[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class SeenEvents:
+    """Bounded index of the (event, sensor_name) pairs already ingested, to drop readings from retried webhooks.
+    The most recent lru_size keys are held exactly. Older keys fall through to two generations of Bloom filters
+    holding about filter_capacity keys between them, the oldest generation being discarded as a new one fills,
+    so memory stays fixed while retries are still recognised long after they've left the LRU. Every key that
+    isn't in the LRU, a new reading's included, is checked against both generations, so each is sized for
+    error_rate / 2 and a new reading is wrongly dropped as a duplicate at no more than about error_rate.
+
+    Keys are claimed before an event is processed and added once it has been, so a retry that arrives while
+    the first delivery is still being processed is dropped too. Claimed keys are released if processing fails.
+
+    Args:
+        lru_size (int, optional): Keys held exactly. Defaults to DedupConfig.SEEN_LRU_SIZE.
+        filter_capacity (int, optional): Keys held by the Bloom filters. Defaults to DedupConfig.SEEN_FILTER_CAPACITY.
+        error_rate (float, optional): False positive rate of the two generations together. Defaults to
+            SEEN_FILTER_ERROR_RATE.
+    """
+
+    def __init__(
+        self,
+        lru_size: int = DedupConfig.SEEN_LRU_SIZE.value,
+        filter_capacity: int = DedupConfig.SEEN_FILTER_CAPACITY.value,
+        error_rate: float = SEEN_FILTER_ERROR_RATE,
+    ):
+        self.lru_size = lru_size
+        self.error_rate = error_rate
+        self._generation_size = max(1, filter_capacity // 2)
+        # a key is a false positive if either generation reports it
+        self._generation_error_rate = error_rate / 2
+        self._recent: OrderedDict[str, None] = OrderedDict()
+        # claimed by an event that is still being processed
+        self._pending: Set[str] = set()
+        self._current = BloomFilter(self._generation_size, self._generation_error_rate)
+        self._previous = BloomFilter(self._generation_size, self._generation_error_rate)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(event: str, sensor_name: str) -> str:
+        return f"{event}\0{sensor_name}"
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._seen(key)
+
+    def _seen(self, key: str) -> bool:
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            return True
+        return key in self._pending or key in self._current or key in self._previous
+
+    def unseen(self, keys: Iterable[str]) -> List[str]:
+        """Returns the keys that haven't been added or claimed, without claiming them."""
+        return [key for key in keys if key not in self]
+
+    def claim(self, keys: Iterable[str]) -> List[str]:
+        """Returns the keys that haven't been added or claimed, and claims them until they're added or released."""
+        with self._lock:
+            claimed = []
+            for key in keys:
+                if not self._seen(key):
+                    self._pending.add(key)
+                    claimed.append(key)
+            return claimed
+
+    def release(self, keys: Iterable[str]):
+        """Gives up claims on keys that weren't ingested, so a retry of them isn't dropped."""
+        with self._lock:
+            self._pending.difference_update(keys)
+
+    def add(self, keys: Iterable[str]):
+        """Records keys as ingested."""
+        with self._lock:
+            for key in keys:
+                self._pending.discard(key)
+                self._recent[key] = None
+                self._recent.move_to_end(key)
+                if self._current.count >= self._generation_size:
+                    self._previous = self._current
+                    self._current = BloomFilter(
+                        self._generation_size, self._generation_error_rate
+                    )
+                self._current.add(key)
+            while len(self._recent) > self.lru_size:
+                self._recent.popitem(last=False)
@@ -0,0 +1,383 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import smtplib
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from dataclasses import dataclass
+from email.message import EmailMessage
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Optional, Tuple
+
+from decouple import config  # type: ignore
+
+import metrics
+from constants import DELIVERY_BACKOFF, DeliveryConfig, SensorTypes
+
+if TYPE_CHECKING:
+    from scheduler import PendingAlert
+
+# JSON file of recipients, see load_recipients. Without it alerts go by SMS to TWILIO_TO.
+RECIPIENTS_PATH = config("RECIPIENTS_PATH", default="recipients.json")
+TWILIO_FROM = config("TWILIO_FROM", default="+15405924574")
+TWILIO_TO = config("TWILIO_TO", default="+19739438803")
+# mail is handed to a local relay or stand-in such as `python -m aiosmtpd -n`
+SMTP_HOST = config("SMTP_HOST", default="localhost")
+SMTP_PORT = config("SMTP_PORT", default=1025, cast=int)
+SMTP_FROM = config("SMTP_FROM", default="hottoddy@localhost")
+
+
+class DeliveryError(Exception):
+    """A message couldn't be delivered. Retryable errors, e.g. rate limits and server errors, are retried with
+    backoff, others fail the message right away. maybe_delivered is set when the message may have been accepted
+    anyway, e.g. on a server error, so that it's only retried on idempotent channels."""
+
+    def __init__(
+        self, message: str, retryable: bool = False, maybe_delivered: bool = False
+    ):
+        super().__init__(message)
+        self.retryable = retryable
+        self.maybe_delivered = maybe_delivered
+
+
+@dataclass(frozen=True)
+class Recipient:
+    """Address of someone to alert on one channel, e.g. Recipient("twilio", "+15555550100")."""
+
+    channel: str
+    address: str
+
+
+class Channel(ABC):
+    """A way of delivering alerts. Channels share the pooled HTTP client of Deliverer.
+
+    A failed send is retried even if the message may have been accepted before the failure, e.g. on a read
+    timeout, so delivery is at least once, unless the channel isn't idempotent. Those are only retried when the
+    message certainly wasn't accepted, as for rate limits and failures to connect, and are at most once.
+    """
+
+    idempotent: bool = True
+
+    @abstractmethod
+    async def send(self, client: Any, address: str, body: str):
+        """Sends body to address.
+
+        Args:
+            client (httpx.AsyncClient): Pooled HTTP client
+            address (str): Recipient address on this channel
+            body (str): Message
+
+        Raises:
+            DeliveryError: The message wasn't delivered
+        """
+
+
+def _check(response) -> None:
+    if response.status_code == 429:
+        raise DeliveryError(f"{response.status_code} {response.text}", retryable=True)
+    if response.status_code >= 500:
+        raise DeliveryError(
+            f"{response.status_code} {response.text}",
+            retryable=True,
+            maybe_delivered=True,
+        )
+    if response.status_code >= 400:
+        raise DeliveryError(f"{response.status_code} {response.text}")
+
+
+class TwilioChannel(Channel):
+    """SMS through the Twilio Messages API. It takes no idempotency key, so a message that timed out may have been
+    sent, and isn't retried then.
+
+    Args:
+        from_ (str, optional): Sending number. Defaults to TWILIO_FROM.
+    """
+
+    idempotent = False
+
+    def __init__(self, from_: str = TWILIO_FROM):
+        self.from_ = from_
+
+    async def send(self, client, address, body):
+        # secrets are read on first send, like model.TWILIO_CLIENT_IDS
+        account_sid = config("TWILIO_ACCOUNT_SID")
+        response = await client.post(
+            f"https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Messages.json",
+            auth=(account_sid, config("TWILIO_AUTH_TOKEN")),
+            data={"From": self.from_, "To": address, "Body": body},
+        )
+        _check(response)
+
+
+class WebhookChannel(Channel):
+    """POSTs {"body": body} as JSON to the recipient's address, a URL."""
+
+    async def send(self, client, address, body):
+        _check(await client.post(address, json={"body": body}))
+
+
+class SmtpChannel(Channel):
+    """Email through an SMTP server, sent from a thread as smtplib blocks.
+
+    Args:
+        host (str, optional): SMTP server. Defaults to SMTP_HOST.
+        port (int, optional): SMTP port. Defaults to SMTP_PORT.
+        sender (str, optional): From address. Defaults to SMTP_FROM.
+    """
+
+    def __init__(
+        self, host: str = SMTP_HOST, port: int = SMTP_PORT, sender: str = SMTP_FROM
+    ):
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def _send(self, address: str, body: str):
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = address
+        message["Subject"] = "HotToddy alert"
+        message.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(message)
+
+    async def send(self, client, address, body):
+        await asyncio.to_thread(self._send, address, body)
+
+
+def default_channels() -> Dict[str, Channel]:
+    return {
+        "twilio": TwilioChannel(),
+        "webhook": WebhookChannel(),
+        "smtp": SmtpChannel(),
+    }
+
+
+@dataclass(frozen=True)
+class Recipients:
+    """Who is alerted about each sensor. A sensor's groups are those listed for its name, else for its type,
+    else the default groups. An empty list of groups mutes a sensor or type.
+    """
+
+    groups: Mapping[str, Tuple[Recipient, ...]]
+    default: Tuple[str, ...]
+    by_type: Mapping[SensorTypes, Tuple[str, ...]]
+    by_sensor: Mapping[str, Tuple[str, ...]]
+
+    def lookup(self, sensor_type: SensorTypes, sensor_name: str) -> List[Recipient]:
+        # an empty list mutes the sensor or type, so membership rather than emptiness picks the groups
+        if sensor_name in self.by_sensor:
+            names = self.by_sensor[sensor_name]
+        elif sensor_type in self.by_type:
+            names = self.by_type[sensor_type]
+        else:
+            names = self.default
+        # a recipient in several of the sensor's groups is alerted once
+        return list(dict.fromkeys(r for name in names for r in self.groups[name]))
+
+    def route(
+        self, alerts: List["PendingAlert"]
+    ) -> Dict[Recipient, List["PendingAlert"]]:
+        """Splits alerts by recipient, keeping their order.
+
+        Returns:
+            Dict[Recipient, List[PendingAlert]]: The alerts each recipient gets, as one digest
+        """
+        routed: Dict[Recipient, List["PendingAlert"]] = defaultdict(list)
+        for alert in alerts:
+            reading = alert.reading
+            for recipient in self.lookup(
+                reading.sensor_config.sensor_type, reading.sensor_name
+            ):
+                routed[recipient].append(alert)
+        return dict(routed)
+
+
+def compile_recipients(recipients: dict) -> Recipients:
+    """Compiles the contents of a recipients file, e.g.
+
+        {
+            "groups": {
+                "on-call": [{"channel": "twilio", "address": "+15555550100"}],
+                "facilities": [{"channel": "smtp", "address": "facilities@example.com"}]
+            },
+            "default": ["on-call"],
+            "types": {"airquality": ["facilities"]},
+            "sensors": {"arduino_1": ["on-call", "facilities"]}
+        }
+
+    Raises:
+        ValueError: The recipients aren't shaped as above, a group is missing or malformed, or a sensor type is
+            unknown
+
+    Returns:
+        Recipients: Compiled recipients
+    """
+    if not isinstance(recipients, dict):
+        raise ValueError("recipients must be an object")
+    for section in ("groups", "types", "sensors"):
+        if not isinstance(recipients.get(section, {}), dict):
+            raise ValueError(f"{section} must be an object")
+    groups = {}
+    for name, members in recipients.get("groups", {}).items():
+        if not isinstance(members, list):
+            raise ValueError(f"group {name!r} must be a list")
+        try:
+            groups[name] = tuple(
+                Recipient(str(r["channel"]), str(r["address"])) for r in members
+            )
+        except (KeyError, TypeError):
+            raise ValueError(f"recipients of group {name!r} need a channel and address")
+
+    def group_names(names) -> Tuple[str, ...]:
+        if not isinstance(names, list):
+            raise ValueError(f"groups must be a list, got {names!r}")
+        for name in names:
+            if name not in groups:
+                raise ValueError(f"unknown group {name!r}")
+        return tuple(names)
+
+    by_type = {}
+    for type_name, names in recipients.get("types", {}).items():
+        try:
+            sensor_type = SensorTypes[type_name.upper()]
+        except KeyError:
+            raise ValueError(f"unknown sensor type {type_name!r}")
+        by_type[sensor_type] = group_names(names)
+    return Recipients(
+        groups=groups,
+        default=group_names(recipients.get("default", [])),
+        by_type=by_type,
+        by_sensor={
+            name: group_names(names)
+            for name, names in recipients.get("sensors", {}).items()
+        },
+    )
+
+
+def default_recipients() -> Recipients:
+    """Alerts about every sensor go by SMS to TWILIO_TO."""
+    return Recipients(
+        groups={"default": (Recipient("twilio", TWILIO_TO),)},
+        default=("default",),
+        by_type={},
+        by_sensor={},
+    )
+
+
+def load_recipients(path: str = RECIPIENTS_PATH) -> Recipients:
+    """Loads the recipients file at path, or alerts TWILIO_TO by SMS if there isn't one. An invalid file is
+    logged and alerts go to TWILIO_TO too, rather than failing every digest and losing its alerts.
+    """
+    if not os.path.exists(path):
+        return default_recipients()
+    try:
+        with open(path) as f:
+            return compile_recipients(json.load(f))
+    except (OSError, ValueError) as e:
+        logging.error(
+            "alerting %s by SMS instead, %s is invalid: %s", TWILIO_TO, path, e
+        )
+        return default_recipients()
+
+
+class Deliverer:
+    """Sends messages concurrently over one pooled HTTP client, so alerting more recipients doesn't take longer.
+    At most concurrency messages are in flight, and retryable failures are retried up to attempts times with
+    exponential backoff and jitter.
+
+    Args:
+        channels (Dict[str, Channel], optional): Channels by name. Defaults to default_channels().
+        concurrency (int, optional): Most messages sent at once. Defaults to DeliveryConfig.CONCURRENCY.
+        attempts (int, optional): Tries per message. Defaults to DeliveryConfig.ATTEMPTS.
+        backoff (float, optional): Seconds before the first retry, doubling after each. Defaults to DELIVERY_BACKOFF.
+    """
+
+    def __init__(
+        self,
+        channels: Optional[Dict[str, Channel]] = None,
+        concurrency: int = DeliveryConfig.CONCURRENCY.value,
+        attempts: int = DeliveryConfig.ATTEMPTS.value,
+        backoff: float = DELIVERY_BACKOFF,
+    ):
+        self.channels = channels if channels is not None else default_channels()
+        self.concurrency = concurrency
+        self.attempts = attempts
+        self.backoff = backoff
+        self._client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            # httpx is imported on first delivery to keep it out of cold starts
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                timeout=DeliveryConfig.TIMEOUT.value,
+                limits=httpx.Limits(max_connections=self.concurrency),
+            )
+        return self._client
+
+    async def deliver(self, messages: Dict[Recipient, str]) -> Dict[Recipient, bool]:
+        """Sends each recipient its message.
+
+        Returns:
+            Dict[Recipient, bool]: Whether each message was delivered
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore, self._loop = asyncio.Semaphore(self.concurrency), loop
+        recipients = list(messages)
+        results = await asyncio.gather(
+            *(self._send(r, messages[r]) for r in recipients)
+        )
+        return dict(zip(recipients, results))
+
+    async def _send(self, recipient: Recipient, body: str) -> bool:
+        channel = self.channels.get(recipient.channel)
+        if channel is None:
+            logging.error("no channel %s for %s", recipient.channel, recipient.address)
+            metrics.DELIVERIES.labels(recipient.channel, "failed").inc()
+            return False
+        for attempt in range(self.attempts):
+            try:
+                async with self._semaphore:  # type: ignore
+                    await channel.send(self.client, recipient.address, body)
+                metrics.DELIVERIES.labels(recipient.channel, "sent").inc()
+                return True
+            except Exception as e:
+                if not self._retryable(channel, e) or attempt + 1 == self.attempts:
+                    logging.error(
+                        "failed to deliver to %s after %s attempts: %r",
+                        recipient,
+                        attempt + 1,
+                        e,
+                    )
+                    metrics.DELIVERIES.labels(recipient.channel, "failed").inc()
+                    return False
+                metrics.DELIVERIES.labels(recipient.channel, "retried").inc()
+                await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+        return False
+
+    @staticmethod
+    def _retryable(channel: Channel, error: Exception) -> bool:
+        if isinstance(error, DeliveryError):
+            return error.retryable and (channel.idempotent or not error.maybe_delivered)
+        import httpx
+
+        if not channel.idempotent:
+            # the request never reached the server
+            return isinstance(
+                error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+            )
+        # connection failures and timeouts, smtplib's errors are OSErrors too
+        return isinstance(error, (OSError, asyncio.TimeoutError, httpx.TransportError))
+
+    async def aclose(self):
+        """Closes the pooled HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+from constants import DispatchConfig
+
+
+class BackgroundDispatcher:
+    """Hands blocking work (storage writes, SMS sends) from async routes to asyncio worker tasks so webhook
+    responses don't wait on it. Each kind of job has its own bounded queue and workers; blocking jobs run in a
+    thread and coroutine functions are awaited on the event loop.
+    When the dispatcher isn't running, e.g. in scripts and tests, jobs run inline instead.
+
+    Args:
+        workers (dict, optional): Number of worker tasks per job kind. Defaults to DispatchConfig values.
+        queue_size (int, optional): Max jobs waiting per kind before submit waits. Defaults to DispatchConfig.QUEUE_SIZE.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[Dict[str, int]] = None,
+        queue_size: int = DispatchConfig.QUEUE_SIZE.value,
+    ):
+        self.workers = workers or {
+            "storage": DispatchConfig.STORAGE_WORKERS.value,
+            "notifications": DispatchConfig.NOTIFICATION_WORKERS.value,
+        }
+        self.queue_size = queue_size
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def queue_depth(self, kind: str) -> int:
+        """Number of jobs of kind waiting for a worker."""
+        queue = self.queues.get(kind)
+        return queue.qsize() if queue is not None else 0
+
+    async def start(self):
+        """Creates the queues and worker tasks on the running event loop."""
+        if self.running:
+            return
+        for kind, count in self.workers.items():
+            self.queues[kind] = asyncio.Queue(maxsize=self.queue_size)
+            self._tasks.extend(
+                asyncio.create_task(self._work(kind), name=f"{kind}-worker-{i}")
+                for i in range(count)
+            )
+
+    async def submit(self, kind: str, job: Callable, *args):
+        """Queues job(*args) for a worker, waiting for space if the queue is full.
+
+        Args:
+            kind (str): Job kind, one of the keys of workers
+            job (Callable): Blocking function or coroutine function to run
+        """
+        if not self.running:
+            if asyncio.iscoroutinefunction(job):
+                await self._run_async(kind, job, args)
+            else:
+                self._run(kind, job, args)
+            return
+        await self.queues[kind].put((job, args))
+
+    async def stop(self, timeout: float = DispatchConfig.SHUTDOWN_TIMEOUT.value):
+        """Waits up to timeout seconds for queued jobs to finish, then cancels the workers."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(q.join() for q in self.queues.values())), timeout
+            )
+        except asyncio.TimeoutError:
+            logging.error(
+                "dispatcher stopped with %s jobs left",
+                sum(q.qsize() for q in self.queues.values()),
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self.queues.clear()
+
+    async def _work(self, kind: str):
+        queue = self.queues[kind]
+        while True:
+            job, args = await queue.get()
+            try:
+                if asyncio.iscoroutinefunction(job):
+                    await self._run_async(kind, job, args)
+                else:
+                    await asyncio.to_thread(self._run, kind, job, args)
+            finally:
+                queue.task_done()
+
+    @staticmethod
+    def _run(kind: str, job: Callable, args: tuple):
+        try:
+            job(*args)
+        except Exception:
+            logging.exception("%s job %s failed", kind, job.__name__)
+
+    @staticmethod
+    async def _run_async(kind: str, job: Callable, args: tuple):
+        try:
+            await job(*args)
+        except Exception:
+            logging.exception("%s job %s failed", kind, job.__name__)
@@ -0,0 +1,115 @@
+from typing import TYPE_CHECKING, Callable, List, Sequence, Tuple
+
+import numpy as np
+
+from constants import THRESHOLD_NAMES, NotificationType, TrendConfig
+from trends import Trend
+
+if TYPE_CHECKING:
+    from model import ParsedReading
+
+NOTIFICATION_TYPES = {t.value: t for t in NotificationType}
+# readings without a trend, e.g. built outside of parse_event, never meet the rate of change rules
+NO_TREND = Trend(0.0, 0.0, 0.0, 0.0, 0)
+
+
+def _as_float_array(values: list) -> np.ndarray:
+    array = np.asarray(values)
+    if array.dtype.kind == "O" and all(isinstance(v, (int, float)) for v in values):
+        # ints too large for int64
+        array = array.astype(np.float64)
+    if array.dtype.kind not in "biuf":
+        raise TypeError(f"readings and averages must be numbers, got {array.dtype}")
+    return array.astype(np.float64, copy=False)
+
+
+def evaluate_batch(
+    parsed_readings: Sequence["ParsedReading"],
+    if_recent_reading: Callable[[], bool],
+) -> List[Tuple["ParsedReading", NotificationType]]:
+    """Evaluates a batch of readings for notifications in one vectorized pass. Gives the same result per reading as
+    Notifications._evaluate_for_notify_logic, in the same order of precedence: TOO_HIGH_AVERAGE, TOO_HIGH_SINGLE,
+    TOO_LOW_AVERAGE, TOO_LOW_SINGLE, RAPID_INCREASE, RAPID_DECREASE, then RAPID_INCREASE_AVERAGE. Rules on the single
+    reading don't apply to outliers.
+
+    Args:
+        parsed_readings (Sequence[ParsedReading]): Readings to evaluate
+        if_recent_reading (Callable[[], bool]): Check for RAPID_INCREASE, called at most once per batch and only if a reading needs it
+
+    Raises:
+        TypeError: A reading or average isn't a number
+
+    Returns:
+        List[Tuple[ParsedReading, NotificationType]]: Each reading with its notification reason, NOOP if none
+    """
+    if not parsed_readings:
+        return []
+    values = _as_float_array([r.sensor_reading for r in parsed_readings])
+    averages = _as_float_array([r.recent_average for r in parsed_readings])
+    # one row per reading in THRESHOLD_NAMES order, precomputed by each shared SensorConfig
+    thresholds = dict(
+        zip(
+            THRESHOLD_NAMES,
+            np.array(
+                [r.sensor_config.values for r in parsed_readings], dtype=np.float64
+            ).T,
+        )
+    )
+    inliers = ~np.array([r.outlier for r in parsed_readings], dtype=bool)
+    trends = [r.trend or NO_TREND for r in parsed_readings]
+    has_trend = np.array([t.count for t in trends]) >= TrendConfig.MIN_READINGS
+    means = np.array([t.mean for t in trends], dtype=np.float64)
+    deviations = np.array([t.deviation for t in trends], dtype=np.float64)
+    rises = np.array([t.rise for t in trends], dtype=np.float64)
+
+    too_high_average = averages >= thresholds["average"]
+    too_high_single = inliers & (values >= thresholds["single_reading"])
+    too_low_average = averages <= thresholds["low_average"]
+    too_low_single = inliers & (values <= thresholds["low_single_reading"])
+    rapid_increase = inliers & (
+        (values - averages) >= thresholds["single_increase_change"]
+    )
+    if (
+        rapid_increase
+        & ~too_high_average
+        & ~too_high_single
+        & ~too_low_average
+        & ~too_low_single
+    ).any():
+        rapid_increase &= bool(if_recent_reading())
+    drop = means - values
+    rapid_decrease = (
+        inliers
+        & has_trend
+        & (drop >= thresholds["single_decrease_change"])
+        & (drop >= TrendConfig.DEVIATIONS * deviations)
+    )
+    rapid_increase_average = has_trend & (
+        rises >= thresholds["average_increase_change"]
+    )
+
+    codes = np.select(
+        [
+            too_high_average,
+            too_high_single,
+            too_low_average,
+            too_low_single,
+            rapid_increase,
+            rapid_decrease,
+            rapid_increase_average,
+        ],
+        [
+            NotificationType.TOO_HIGH_AVERAGE.value,
+            NotificationType.TOO_HIGH_SINGLE.value,
+            NotificationType.TOO_LOW_AVERAGE.value,
+            NotificationType.TOO_LOW_SINGLE.value,
+            NotificationType.RAPID_INCREASE.value,
+            NotificationType.RAPID_DECREASE.value,
+            NotificationType.RAPID_INCREASE_AVERAGE.value,
+        ],
+        default=NotificationType.NOOP.value,
+    )
+    return [
+        (reading, NOTIFICATION_TYPES[code])
+        for reading, code in zip(parsed_readings, codes.tolist())
+    ]
@@ -0,0 +1,75 @@
+import csv
+import io
+import json
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from constants import ExportConfig, SensorTypes
+from storage import Query
+
+# columns of an export, in order. Other stored fields, e.g. key, are left out.
+EXPORT_FIELDS = (
+    "datetime",
+    "event",
+    "sensor_name",
+    "sensor_type",
+    "sensor_reading",
+    "recent_average",
+    "best_lat",
+    "best_long",
+)
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def export_query(
+    sensor_name: Optional[str] = None,
+    sensor_type: Optional[SensorTypes] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> Query:
+    """Builds a deta style query for readings of a sensor or sensor type with start <= datetime < end,
+    so that filtering happens in storage rather than after fetching. Filters that are None are left out.
+    """
+    query: dict = {}
+    if sensor_name is not None:
+        query["sensor_name"] = sensor_name
+    if sensor_type is not None:
+        query["sensor_type"] = int(sensor_type)
+    if start is not None:
+        query["datetime?gte"] = start
+    if end is not None:
+        query["datetime?lt"] = end
+    return query or None
+
+
+def _chunks(
+    rows: Iterable[dict], size: int = ExportConfig.ROWS_PER_CHUNK.value
+) -> Iterator[list]:
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def iter_csv(rows: Iterable[dict]) -> Iterator[str]:
+    """Encodes rows as CSV with a header of EXPORT_FIELDS, yielding the text a chunk of rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    yield buffer.getvalue()
+    for chunk in _chunks(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+
+def iter_ndjson(rows: Iterable[dict]) -> Iterator[str]:
+    """Encodes rows as NDJSON objects with the EXPORT_FIELDS keys, yielding the text a chunk of rows at a time."""
+    for chunk in _chunks(rows):
+        yield "".join(
+            json.dumps({f: row.get(f) for f in EXPORT_FIELDS}) + "\n" for row in chunk
+        )
+
+
+ENCODERS = {"csv": iter_csv, "ndjson": iter_ndjson}
@@ -0,0 +1,292 @@
+import math
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from constants import GEO_CELL_DEGREES, SensorTypes
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def distance_km(lat_1: float, long_1: float, lat_2: float, long_2: float) -> float:
+    """Great circle distance between two points, by the haversine formula."""
+    phi_1, phi_2 = math.radians(lat_1), math.radians(lat_2)
+    a = (
+        math.sin((phi_2 - phi_1) / 2) ** 2
+        + math.cos(phi_1)
+        * math.cos(phi_2)
+        * math.sin(math.radians(long_2 - long_1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def check_point(lat: float, long: float):
+    if not (-90 <= lat <= 90 and -180 <= long <= 180):
+        raise ValueError(f"({lat}, {long}) isn't a valid latitude and longitude")
+
+
+@dataclass(frozen=True, slots=True)
+class SensorPosition:
+    """Latest position and reading of a sensor."""
+
+    sensor_name: str
+    sensor_type: SensorTypes
+    best_lat: float
+    best_long: float
+    sensor_reading: float
+    datetime: int
+
+    def as_dict(self) -> dict:
+        return {
+            "sensor_name": self.sensor_name,
+            "sensor_type": self.sensor_type.name.lower(),
+            "best_lat": self.best_lat,
+            "best_long": self.best_long,
+            "sensor_reading": self.sensor_reading,
+            "datetime": self.datetime,
+        }
+
+
+@dataclass(frozen=True)
+class Region:
+    """An area given either as a bounding box or as a circle around center. A box with west > east crosses
+    the antimeridian.
+    """
+
+    box: Optional[Tuple[float, float, float, float]] = None
+    center: Optional[Tuple[float, float]] = None
+    radius_km: float = 0.0
+
+    def __post_init__(self):
+        if (self.box is None) == (self.center is None):
+            raise ValueError("a region needs either a box or a center and radius_km")
+        if self.box is not None:
+            if len(self.box) != 4:
+                raise ValueError(
+                    f"box must be [south, west, north, east], got {self.box}"
+                )
+            south, west, north, east = self.box
+            check_point(south, west)
+            check_point(north, east)
+            if south > north:
+                raise ValueError(f"south {south} is north of north {north}")
+        else:
+            if len(self.center) != 2:  # type: ignore
+                raise ValueError(f"center must be [lat, long], got {self.center}")
+            check_point(*self.center)  # type: ignore
+            if not self.radius_km > 0:
+                raise ValueError(f"radius_km must be positive, got {self.radius_km}")
+
+    def contains(self, lat: float, long: float) -> bool:
+        if self.box is not None:
+            south, west, north, east = self.box
+            if not south <= lat <= north:
+                return False
+            return (
+                west <= long <= east if west <= east else long >= west or long <= east
+            )
+        return distance_km(*self.center, lat, long) <= self.radius_km  # type: ignore
+
+
+@dataclass
+class GeoIndex:
+    """Latest position and reading of every sensor, bucketed into a grid of cell_degrees square cells so that
+    radius and bounding box queries only look at the sensors in cells overlapping the area.
+
+    Args:
+        cell_degrees (float, optional): Size of a grid cell. Defaults to GEO_CELL_DEGREES.
+    """
+
+    cell_degrees: float = GEO_CELL_DEGREES
+    positions: Dict[str, SensorPosition] = field(default_factory=dict)
+    cells: Dict[Tuple[int, int], Set[str]] = field(default_factory=dict)
+    rows: int = field(init=False, repr=False)
+    columns: int = field(init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self):
+        self.rows = int(math.ceil(180 / self.cell_degrees))
+        self.columns = int(math.ceil(360 / self.cell_degrees))
+
+    def _cell(self, lat: float, long: float) -> Tuple[int, int]:
+        # the north pole and the antimeridian at 180 go in the last row and column
+        return (
+            min(int((lat + 90) // self.cell_degrees), self.rows - 1),
+            min(int((long + 180) // self.cell_degrees), self.columns - 1),
+        )
+
+    def update(
+        self,
+        sensor_name: str,
+        sensor_type: SensorTypes,
+        best_lat: float,
+        best_long: float,
+        sensor_reading: float,
+        datetime: int,
+    ) -> bool:
+        """Records a sensor's reading and position, unless a newer one is already held.
+
+        Returns:
+            bool: True if the position was updated
+        """
+        if not (-90 <= best_lat <= 90 and -180 <= best_long <= 180):
+            return False
+        position = SensorPosition(
+            sensor_name, sensor_type, best_lat, best_long, sensor_reading, datetime
+        )
+        with self._lock:
+            previous = self.positions.get(sensor_name)
+            if previous is not None:
+                if previous.datetime > datetime:
+                    return False
+                # most sensors don't move, so their cell is only worked out again when they do
+                if previous.best_lat == best_lat and previous.best_long == best_long:
+                    self.positions[sensor_name] = position
+                    return True
+                previous_cell = self._cell(previous.best_lat, previous.best_long)
+                members = self.cells[previous_cell]
+                members.discard(sensor_name)
+                if not members:
+                    del self.cells[previous_cell]
+            self.positions[sensor_name] = position
+            self.cells.setdefault(self._cell(best_lat, best_long), set()).add(
+                sensor_name
+            )
+        return True
+
+    def load(self, records: Iterable[dict]) -> int:
+        """Adds the positions of stored readings, e.g. the records of LatestReadingIndex.
+
+        Returns:
+            int: Number of positions updated
+        """
+        return sum(
+            self.update(
+                r["sensor_name"],
+                SensorTypes(r["sensor_type"]),
+                r["best_lat"],
+                r["best_long"],
+                r["sensor_reading"],
+                r["datetime"],
+            )
+            for r in records
+        )
+
+    def _candidates(
+        self, south: float, west: float, north: float, east: float
+    ) -> List[SensorPosition]:
+        # sensors in the cells overlapping the box, or in every occupied cell if that's fewer cells
+        rows = range(self._cell(south, 0)[0], self._cell(north, 0)[0] + 1)
+        first, last = self._cell(0, west)[1], self._cell(0, east)[1]
+        if west <= east:
+            columns: Iterable[int] = range(first, last + 1)
+        else:
+            columns = [*range(first, self.columns), *range(0, last + 1)]
+        with self._lock:
+            if len(rows) * len(columns) > len(self.cells):  # type: ignore
+                cells = [
+                    members
+                    for (row, column), members in self.cells.items()
+                    if row in rows
+                    and (
+                        first <= column <= last
+                        if west <= east
+                        else column >= first or column <= last
+                    )
+                ]
+            else:
+                cells = [
+                    self.cells[row, column]
+                    for row in rows
+                    for column in columns
+                    if (row, column) in self.cells
+                ]
+            return [self.positions[name] for members in cells for name in members]
+
+    def within_box(
+        self,
+        south: float,
+        west: float,
+        north: float,
+        east: float,
+        sensor_type: Optional[SensorTypes] = None,
+    ) -> List[SensorPosition]:
+        """Sensors whose latest position is in the box. A box with west > east crosses the antimeridian.
+
+        Raises:
+            ValueError: The box isn't valid
+        """
+        region = Region(box=(south, west, north, east))
+        return [
+            p
+            for p in self._candidates(south, west, north, east)
+            if (sensor_type is None or p.sensor_type == sensor_type)
+            and region.contains(p.best_lat, p.best_long)
+        ]
+
+    def within_radius(
+        self,
+        lat: float,
+        long: float,
+        radius_km: float,
+        sensor_type: Optional[SensorTypes] = None,
+    ) -> List[Tuple[SensorPosition, float]]:
+        """Sensors whose latest position is within radius_km of (lat, long), nearest first.
+
+        Raises:
+            ValueError: The point or radius isn't valid
+
+        Returns:
+            List[Tuple[SensorPosition, float]]: Each sensor with its distance in km
+        """
+        # validates the point and radius
+        Region(center=(lat, long), radius_km=radius_km)
+        south = max(-90.0, lat - radius_km / KM_PER_DEGREE)
+        north = min(90.0, lat + radius_km / KM_PER_DEGREE)
+        # longitude degrees shrink towards the poles, so the box is widest at the latitude nearest a pole
+        widest = math.cos(math.radians(max(abs(south), abs(north))))
+        span = 180.0 if widest <= 0 else radius_km / (KM_PER_DEGREE * widest)
+        if span >= 180 or south == -90 or north == 90:
+            west, east = -180.0, 180.0
+        else:
+            west = (long - span + 180) % 360 - 180
+            east = (long + span + 180) % 360 - 180
+        found = []
+        for p in self._candidates(south, west, north, east):
+            if sensor_type is not None and p.sensor_type != sensor_type:
+                continue
+            distance = distance_km(lat, long, p.best_lat, p.best_long)
+            if distance <= radius_km:
+                found.append((p, distance))
+        found.sort(key=lambda f: f[1])
+        return found
+
+    def within(
+        self, region: Region, sensor_type: Optional[SensorTypes] = None
+    ) -> List[SensorPosition]:
+        """Sensors whose latest position is in region."""
+        if region.box is not None:
+            return self.within_box(*region.box, sensor_type=sensor_type)
+        return [
+            p
+            for p, _ in self.within_radius(
+                *region.center, region.radius_km, sensor_type=sensor_type  # type: ignore
+            )
+        ]
+
+
+def summarize(positions: Iterable[SensorPosition]) -> Dict[str, dict]:
+    """Count, mean, min and max of the latest readings per sensor type."""
+    by_type: Dict[SensorTypes, List[float]] = {}
+    for p in positions:
+        by_type.setdefault(p.sensor_type, []).append(p.sensor_reading)
+    return {
+        sensor_type.name.lower(): {
+            "count": len(readings),
+            "mean": sum(readings) / len(readings),
+            "min": min(readings),
+            "max": max(readings),
+        }
+        for sensor_type, readings in by_type.items()
+    }
@@ -0,0 +1,106 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set
+
+from constants import SensorTypes
+from storage import ReadingStore
+from writer import BatchWriter
+
+
+def sensor_key(sensor_name: str) -> str:
+    return f"sensor:{sensor_name}"
+
+
+def type_key(sensor_type: SensorTypes) -> str:
+    return f"type:{int(sensor_type)}"
+
+
+@dataclass
+class LatestReadingIndex:
+    """Latest stored reading per sensor and per SensorTypes value, kept up to date on every insert so that
+    "last" SMS commands don't scan reading history. Records are persisted to store, keyed by sensor_key/type_key,
+    through writer by persist() so they survive restarts.
+
+    Args:
+        store (ReadingStore, optional): Store holding one record per sensor and per sensor type
+        writer (BatchWriter, optional): Writer used to persist updated records. Records are only kept in memory without one.
+    """
+
+    store: Optional[ReadingStore] = None
+    writer: Optional[BatchWriter] = None
+    records: Dict[str, dict] = field(default_factory=dict)
+    # keys of records updated since the last persist
+    dirty: Set[str] = field(default_factory=set)
+    warmed: bool = False
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def warm(self) -> int:
+        """Loads persisted records from store. Only runs once, records updated since startup are kept if newer.
+
+        Returns:
+            int: Number of records loaded
+        """
+        with self._lock:
+            if self.warmed:
+                return 0
+            self.warmed = True
+        if self.store is None:
+            return 0
+        loaded = 0
+        resp = self.store.fetch()
+        while True:
+            with self._lock:
+                for item in resp.items:
+                    self._replace_if_newer(item.pop("key"), item)
+                    loaded += 1
+            if not resp.last:
+                break
+            resp = self.store.fetch(last=resp.last)
+        logging.debug("loaded %s latest reading records", loaded)
+        return loaded
+
+    def update(self, item: dict):
+        """Records item as the latest reading of its sensor and sensor type if nothing newer is known.
+
+        Args:
+            item (dict): Reading as returned by ParsedReading.parse_for_db_save()
+        """
+        if not self.warmed:
+            self.warm()
+        with self._lock:
+            for key in (sensor_key(item["sensor_name"]), type_key(item["sensor_type"])):
+                if self._replace_if_newer(key, item):
+                    self.dirty.add(key)
+
+    def persist(self) -> int:
+        """Hands records changed since the last call to writer. Several updates to a record between calls
+        are written once, so call this after storing each event or batch rather than per reading.
+
+        Returns:
+            int: Number of records written
+        """
+        with self._lock:
+            changed = {key: self.records[key] for key in self.dirty}
+            self.dirty.clear()
+        if self.writer is not None and self.store is not None:
+            for key, item in changed.items():
+                self.writer.put(self.store, dict(item, key=key))
+        return len(changed)
+
+    def for_sensor(self, sensor_name: str) -> Optional[dict]:
+        if not self.warmed:
+            self.warm()
+        return self.records.get(sensor_key(sensor_name))
+
+    def for_type(self, sensor_type: SensorTypes) -> Optional[dict]:
+        if not self.warmed:
+            self.warm()
+        return self.records.get(type_key(sensor_type))
+
+    def _replace_if_newer(self, key: str, item: dict) -> bool:
+        current = self.records.get(key)
+        if current is not None and current["datetime"] > item["datetime"]:
+            return False
+        self.records[key] = item
+        return True
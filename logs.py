@@ -0,0 +1,86 @@
+import atexit
+import logging
+import queue
+import threading
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+from decouple import config  # type: ignore
+
+from constants import LogConfig
+
+LOG_FILE = config("LOG_FILE", default="models.log")
+LOG_LEVEL = config("LOG_LEVEL", default="DEBUG")
+
+_listener: Optional[QueueListener] = None
+_handler: Optional[QueueHandler] = None
+
+
+class SamplingFilter(logging.Filter):
+    """Passes the first of every `every` debug records logged from the same line, so that each kind of debug
+    message is sampled on its own and rare ones still appear. Records above DEBUG always pass.
+
+    Args:
+        every (int, optional): Keep one in every this many records per message. Defaults to LogConfig.SAMPLE_EVERY.
+    """
+
+    def __init__(self, every: int = LogConfig.SAMPLE_EVERY.value):
+        super().__init__()
+        self.every = every
+        self.seen: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.every <= 1:
+            return True
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            count = self.seen[key]
+            self.seen[key] = count + 1
+        return count % self.every == 0
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queues records without formatting them, so that message arguments are only formatted by the listener
+    thread. Arguments must not be changed after logging them."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def configure_logging(path: str = LOG_FILE, level: str = LOG_LEVEL):
+    """Sends log records through a queue to a background thread that writes them to a rotating file at path,
+    keeping file writes and message formatting off the request. Debug records are sampled, see SamplingFilter.
+    Only configures logging once, later calls do nothing.
+    """
+    global _listener, _handler
+    if _listener is not None:
+        return
+    file_handler = RotatingFileHandler(
+        path,
+        maxBytes=LogConfig.MAX_BYTES.value,
+        backupCount=LogConfig.BACKUP_COUNT.value,
+        encoding="utf-8",
+    )
+    file_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+    )
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    _handler = DeferredQueueHandler(records)
+    _handler.addFilter(SamplingFilter())
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_handler)
+    _listener = QueueListener(records, file_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Writes out queued records and stops the background thread."""
+    global _listener, _handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_handler)
+        _listener.stop()
+        _listener = _handler = None
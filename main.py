@@ -1,77 +1,475 @@
+import asyncio
+import json
 import logging as logging
+from typing import Optional
 
-from fastapi import Form, Response
+from fastapi import APIRouter, FastAPI, Form, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
+import orjson
+from pydantic import ValidationError
+from pydantic.error_wrappers import ErrorWrapper
 from twilio.twiml.messaging_response import MessagingResponse  # type: ignore
 
+import bulk
+import export
+import geo
+import logs
+import metrics
 import model as m
-from model import app
-from constants import CacheConfig
+from aggregator import SensorWindowAggregator
+from constants import BulkConfig, CacheConfig, ExportConfig, RulesConfig, SensorTypes
+from outliers import HampelFilter
+from trends import TrendTracker
+
+router = APIRouter()
+
+
+def create_app() -> FastAPI:
+    """Builds the app. Storage and the Twilio client are created on first use, see model.LazyResource,
+    so nothing is read from or written to storage until a request or the startup hook needs it.
+    """
+    app = FastAPI()
+    app.include_router(router)
+    return app
+
+
+def __getattr__(name: str):
+    # `uvicorn main:app` and Deta look up app, which is built on first access
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # a POST route for webhook events to ingest readings, utilizes FastApi
-@app.post("/")
-def sensor_event(event: m.SensorLogEvent) -> m.SensorLogEvent:
-    logging.debug(f"event triggered at {event.datetime}")
+@router.post("/", status_code=202)
+async def receive_sensor_event(request: Request):
+    body = await request.body()
+    # captures every body as received, including invalid ones, when CAPTURE_PATH is set
+    if m.traffic_capture is not None:
+        m.traffic_capture.record(body)
+    return await acknowledge(body)
+
+
+async def acknowledge(body: bytes) -> Response:
+    """Decodes and ingests a webhook body, replying with a short acknowledgement instead of echoing the event.
+    Decoded here rather than by FastAPI to use the SensorLogEvent.decode fast path and to time validation
+    as its own stage. Invalid bodies get the same 422 as FastAPI's own validation.
+    """
+    try:
+        with metrics.stage(metrics.VALIDATION):
+            event = m.SensorLogEvent.decode(body)
+    except json.JSONDecodeError as e:
+        raise RequestValidationError([ErrorWrapper(e, ("body", e.pos))], body=e.doc)
+    except ValidationError as e:
+        raise RequestValidationError(e.raw_errors, body=body)
+    await sensor_event(event)
+    return Response(
+        content=orjson.dumps({"event": event.event, "status": "accepted"}),
+        status_code=202,
+        media_type="application/json",
+    )
+
+
+async def sensor_event(event: m.SensorLogEvent) -> m.SensorLogEvent:
+    new_readings = drop_seen_readings(event)
+    if not new_readings.readings:
+        # a retried delivery, every reading was already ingested
+        return event
+    try:
+        notification_event, parsed_readings = await process_event(new_readings)
+    except BaseException:
+        # cancelled or failed, so a retry of the event isn't dropped
+        release_seen(new_readings)
+        raise
+    mark_seen(new_readings)
+
+    # storage writes and SMS sends run on background workers so the webhook returns right away
+    await m.dispatcher.submit("storage", store_readings, parsed_readings)
+    await m.run_with_shared_state(
+        observe_alerts, parsed_readings, notification_event.get_notifications()
+    )
+    await send_digest()
+    return event
+
+
+def observe_alerts(parsed_readings: list, notifications: list):
+    # alert cooldowns are kept in the shared state, see NotificationScheduler
+    m.notification_scheduler.observe(parsed_readings, notifications)
+    m.notification_scheduler.observe(*m.evaluate_regions(parsed_readings))
+
+
+def drop_seen_readings(event: m.SensorLogEvent) -> m.SensorLogEvent:
+    """Returns event without the readings whose (event, sensor_name) was already ingested or is being ingested,
+    see dedup.SeenEvents. Notehub retries webhooks, so the same event can be delivered more than once, even
+    while the first delivery is still being processed. The readings returned are claimed, and have to be
+    passed to mark_seen once ingested or to release_seen if ingesting them fails.
+    """
+    keys = [m.seen_events.key(event.event, r.sensor_name) for r in event.readings]
+    unseen = set(m.seen_events.claim(keys))
+    if len(unseen) == len(keys):
+        return event
+    metrics.DUPLICATE_READINGS.inc(len(keys) - len(unseen))
+    logging.debug(
+        "dropped %s seen readings of %s", len(keys) - len(unseen), event.event
+    )
+    return event.copy(
+        update={
+            "readings": [r for r, key in zip(event.readings, keys) if key in unseen]
+        }
+    )
+
+
+def mark_seen(event: m.SensorLogEvent):
+    m.seen_events.add(
+        m.seen_events.key(event.event, r.sensor_name) for r in event.readings
+    )
+
+
+def release_seen(event: m.SensorLogEvent):
+    m.seen_events.release(
+        m.seen_events.key(event.event, r.sensor_name) for r in event.readings
+    )
+
+
+async def send_digest(force: bool = False):
+    # pending alerts are sent as one digest per recipient at most once per digest interval, see scheduler.NotificationScheduler
+    alerts = m.notification_scheduler.flush(force=force)
+    if alerts and await m.run_with_shared_state(m.is_armed):
+        await m.dispatcher.submit(
+            "notifications", m.Notifications.deliver_digest, alerts
+        )
+
+
+async def send_digests_periodically():
+    while True:
+        await asyncio.sleep(m.notification_scheduler.digest_interval)
+        await send_digest()
+
+
+async def reload_rules_periodically():
+    while True:
+        await asyncio.sleep(RulesConfig.RELOAD_INTERVAL)
+        try:
+            await asyncio.to_thread(m.sensor_rules.reload_if_changed)
+        except Exception:
+            # the previous rules stay in place and the next change is still picked up
+            logging.exception("failed to reload rules from %s", m.sensor_rules.path)
+
+
+async def process_event(event: m.SensorLogEvent) -> tuple[m.Notifications, list]:
+    """Parses an event into readings, updates the in-memory recent averages and latest readings
+    and evaluates each reading for notifications. Doesn't write to storage or send anything, and the one
+    storage read evaluation may need is made off the event loop, see Notifications.evaluate_batch_async.
+
+    Returns:
+        tuple[Notifications, list[ParsedReading]]: Notifications to send and the parsed readings to store
+    """
+    logging.debug("event triggered at %s", event.datetime)
     # instantiates empty "queue" for notifications
     notification_event = m.Notifications(queued_notifications=[])
 
-    parsed_readings = m.SensorLogEvent.parse_event(event)
+    # the recent averages are read from and added to the shared state
+    parsed_readings = await m.run_with_shared_state(parse_and_record, event)
+    await notification_event.evaluate_batch_async(parsed_readings)
+    return notification_event, parsed_readings
+
+
+def parse_and_record(event: m.SensorLogEvent) -> list:
+    with metrics.stage(metrics.PARSE_EVENT):
+        parsed_readings = m.SensorLogEvent.parse_event(event)
+    for reading in parsed_readings:
+        record_reading(reading)
+    return parsed_readings
+
 
+def record_reading(reading):
+    # the in-memory window and latest index are updated during the request so the next event sees this reading
+    # outliers are stored but left out of the recent average
+    if not reading.outlier:
+        m.recent_window.add(reading.sensor_name, reading.sensor_reading)
+    m.latest_readings.update(reading.parse_for_db_save())
+    m.rollups.add(reading.sensor_name, reading.datetime, reading.sensor_reading)
+    update_position(reading)
+
+
+def update_position(reading):
+    # the geo index holds each sensor's latest reading, so a replayed older reading doesn't move a sensor back
+    m.geo_index.update(
+        reading.sensor_name,
+        reading.sensor_config.sensor_type,
+        reading.best_lat,
+        reading.best_long,
+        reading.sensor_reading,
+        reading.datetime,
+    )
+
+
+def store_readings(parsed_readings):
     # inserts individual reading into a persistent database (all_readings_db) and a cache to support recent average calculation (recent_readings_db)
     for reading in parsed_readings:
-        logging.debug(f"{reading} into db")
+        logging.debug("%s into db", reading)
         insert_into_dbs(reading)
-        notification_event.evaluate_for_notify(reading)
+    m.latest_readings.persist()
+    archive_readings(parsed_readings)
 
-    # if any pending notifications are available, enqueues them to be sent
-    if len(notification_event.get_notifications()) >= 0:
-        if m.is_armed == True:
-            notification_event.construct_twilio_sms()
-    return event
+
+def store_history(parsed_readings):
+    # replayed readings only go to all_readings_db, they'd already have expired from the recent readings cache
+    for reading in parsed_readings:
+        m.db_writer.put(m.all_readings_db, reading.parse_for_db_save())
+    m.latest_readings.persist()
+    archive_readings(parsed_readings)
+
+
+def archive_readings(parsed_readings):
+    # appends to the segment file archive when SEGMENT_DIR is set, see segments.SegmentStore
+    if m.reading_archive is not None:
+        m.reading_archive.append(r.parse_for_db_save() for r in parsed_readings)
 
 
 def insert_into_dbs(reading):
-    reading.insert_parsed_reading_into_db(
-        database=m.all_readings_db,
+    # writes are buffered by db_writer and sent in batches, see writer.BatchWriter
+    # each database gets its own dict since deta adds the expiration to the item in place
+    # the insert stage is timed as the batches are written
+    m.db_writer.put(m.all_readings_db, reading.parse_for_db_save())
+    m.db_writer.put(
+        m.recent_readings_db,
+        reading.parse_for_db_save(),
+        expire_in=CacheConfig.EXPIRATION_TIME.value,
     )
-    reading.insert_parsed_reading_into_db(
-        database=m.recent_readings_db,
-        expiration_seconds=CacheConfig.EXPIRATION_TIME.value,
+
+
+background_tasks: list[asyncio.Task] = []
+
+
+@router.on_event("startup")
+async def start_background_work():
+    logs.configure_logging()
+    # an invalid recipients file is reported at startup rather than with the first digest
+    m.recipients.get()
+    m.recent_window.warm()
+    m.latest_readings.warm()
+    m.geo_index.load(
+        record
+        for key, record in m.latest_readings.records.items()
+        if key.startswith("sensor:") and "best_lat" in record
+    )
+    if m.reading_archive is not None:
+        await asyncio.to_thread(m.rollups.load_archive, m.reading_archive)
+    await m.dispatcher.start()
+    background_tasks.append(asyncio.create_task(send_digests_periodically()))
+    background_tasks.append(asyncio.create_task(reload_rules_periodically()))
+
+
+@router.on_event("shutdown")
+async def drain_background_work():
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await send_digest(force=True)
+    # queued jobs feed db_writer, so the dispatcher is drained before the writer's final flush
+    await m.dispatcher.stop()
+    await m.deliverer.aclose()
+    await asyncio.to_thread(m.db_writer.close)
+    if m.traffic_capture is not None and m.traffic_capture.created:
+        m.traffic_capture.close()
+    logs.stop_logging()
+
+
+@router.post("/bulk/")
+async def bulk_sensor_events(request: Request, alert: bool = False):
+    """Ingests many SensorLogEvents in one request, e.g. to backfill Notehub history after an outage.
+    The body is a JSON array or NDJSON and is parsed as it streams in. Recent averages and trends are computed over
+    the replayed events themselves in timestamp order, and readings are written to all_readings_db in batches.
+    Readings that were already ingested are skipped and counted as duplicates.
+    Notifications are only evaluated when alert is set.
+    """
+    window = SensorWindowAggregator()
+    trends = TrendTracker()
+    outliers = HampelFilter()
+    events = readings = duplicates = error_count = 0
+    errors: list[dict] = []
+    try:
+        async for batch in bulk.iter_batches(bulk.iter_json_records(request.stream())):
+            notification_event = m.Notifications(queued_notifications=[])
+            parsed_readings: list[m.ParsedReading] = []
+            for record in batch:
+                try:
+                    event = m.SensorLogEvent.parse_obj(record)
+                except ValidationError as e:
+                    error_count += 1
+                    if len(errors) < BulkConfig.MAX_REPORTED_ERRORS:
+                        errors.append(
+                            {
+                                # a record can be any JSON value, not only an object
+                                "event": (
+                                    record.get("event")
+                                    if isinstance(record, dict)
+                                    else None
+                                ),
+                                "detail": e.errors(),
+                            }
+                        )
+                    continue
+                new_readings = drop_seen_readings(event)
+                duplicates += len(event.readings) - len(new_readings.readings)
+                if not new_readings.readings:
+                    continue
+                try:
+                    event_readings = new_readings.parse_event(window, trends, outliers)
+                except BaseException:
+                    release_seen(new_readings)
+                    raise
+                mark_seen(new_readings)
+                for reading in event_readings:
+                    if not reading.outlier:
+                        window.add(
+                            reading.sensor_name,
+                            reading.sensor_reading,
+                            expires_at=reading.datetime + window.expiration_seconds,
+                        )
+                    m.latest_readings.update(reading.parse_for_db_save())
+                    m.rollups.add(
+                        reading.sensor_name, reading.datetime, reading.sensor_reading
+                    )
+                    update_position(reading)
+                parsed_readings.extend(event_readings)
+                events += 1
+
+            await m.dispatcher.submit("storage", store_history, parsed_readings)
+            readings += len(parsed_readings)
+            if alert:
+                await notification_event.evaluate_batch_async(parsed_readings)
+                await m.run_with_shared_state(
+                    observe_alerts,
+                    parsed_readings,
+                    notification_event.get_notifications(),
+                )
+                await send_digest()
+    except ValueError as e:
+        logging.debug("bulk ingest stopped after %s events: %s", events, e)
+        return JSONResponse(
+            status_code=400,
+            content={"events": events, "readings": readings, "detail": str(e)},
+        )
+    return {
+        "events": events,
+        "readings": readings,
+        "duplicates": duplicates,
+        "error_count": error_count,
+        "errors": errors,
+    }
+
+
+@router.get("/rollups/{sensor_name}")
+async def reading_rollups(
+    sensor_name: str, start: int, end: int, step: Optional[int] = None
+):
+    """Min, max, mean and count of a sensor's readings in [start, end), in buckets of step seconds
+    (one bucket for the whole range by default). Served from the coarsest rollup that fits the range.
+    """
+    try:
+        resolution, buckets = m.rollups.query(sensor_name, start, end, step)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "sensor_name": sensor_name,
+        "resolution": resolution,
+        "step": step or end - start,
+        "buckets": buckets,
+    }
+
+
+@router.get("/sensors/nearby/")
+async def sensors_nearby(
+    lat: float,
+    long: float,
+    radius_km: float,
+    sensor_type: Optional[SensorTypes] = None,
+):
+    """Sensors whose latest position is within radius_km of (lat, long), nearest first, with their latest
+    reading, and the count, mean, min and max of those readings per sensor type. Served from the geo index.
+    """
+    try:
+        found = m.geo_index.within_radius(lat, long, radius_km, sensor_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "sensors": [
+            {**position.as_dict(), "distance_km": round(distance, 3)}
+            for position, distance in found
+        ],
+        "summary": geo.summarize(position for position, _ in found),
+    }
+
+
+@router.get("/sensors/within/")
+async def sensors_within(
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    sensor_type: Optional[SensorTypes] = None,
+):
+    """Sensors whose latest position is in the bounding box, which crosses the antimeridian if west > east,
+    with their latest reading and the count, mean, min and max of those readings per sensor type.
+    """
+    try:
+        found = m.geo_index.within_box(south, west, north, east, sensor_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "sensors": [position.as_dict() for position in found],
+        "summary": geo.summarize(found),
+    }
+
+
+@router.get("/export/")
+async def export_readings(
+    format: str = "csv",
+    sensor_name: Optional[str] = None,
+    sensor_type: Optional[SensorTypes] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+):
+    """Streams reading history from all_readings_db as CSV or NDJSON, optionally filtered to a sensor or sensor
+    type and to start <= datetime < end. Storage is read one page at a time as the response is sent, on a worker
+    thread, so large exports run in constant memory alongside ingest. Rows are in storage order, not by datetime.
+    """
+    if format not in export.ENCODERS:
+        raise HTTPException(
+            status_code=400, detail=f"format must be one of {list(export.ENCODERS)}"
+        )
+    query = export.export_query(sensor_name, sensor_type, start, end)
+    rows = m.all_readings_db.scan(query, page_size=ExportConfig.PAGE_SIZE.value)
+    return StreamingResponse(
+        export.ENCODERS[format](rows),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=readings.{format}"},
     )
 
 
-@app.post("/activate/")
+@router.get("/metrics")
+async def prometheus_metrics():
+    """Stage latencies and storage call counts in the Prometheus text format, see metrics.py."""
+    content, media_type = metrics.render()
+    return Response(content=content, media_type=media_type)
+
+
+@router.post("/activate/")
 async def activate(Body: str = Form(...)):
     response = MessagingResponse()
     if (Body.lower()).rstrip() == "arm":
         return await m.set_arm_disarm_and_sms(response)
-    elif (Body.lower()).rstrip() == "last temp":
-        return await m.get_and_send_last_temp_reading(response)
+    elif (Body.lower()).strip().startswith("last"):
+        # "last" on its own replies with the last temperature, otherwise "last <sensor type|sensor name>"
+        return await m.get_and_send_last_reading(
+            response, Body.strip()[4:].strip() or "temp"
+        )
     else:
         response.message(
-            f"Nothing happened - 'Arm' to turn on alarm,'last' to get last reading."
+            f"Nothing happened - 'Arm' to turn on alarm,'last <sensor or type>' to get last reading."
         )
         return Response(content=str(response), media_type="application/xml")
-
-
-# below is used for testing
-
-readings1 = m.SensorLogReading(
-    sensor_name="arduino_1", sensor_reading=10, sensor_type=m.SensorTypes(1)
-)
-readings2 = m.SensorLogReading(
-    sensor_name="notecard", sensor_reading=10, sensor_type=m.SensorTypes(1)
-)
-readings3 = m.SensorLogReading(
-    sensor_name="notecard2", sensor_reading=10, sensor_type=m.SensorTypes(1)
-)
-
-testevent = m.SensorLogEvent(
-    datetime=1665021239,
-    event="f3ec6e7b-382b-472b-ad13-c52d7327cf76",
-    best_lat=45.5728875,
-    best_long=-122.66610937499999,
-    readings=[readings1, readings2, readings3],
-)
-
-sensor_event(testevent)
@@ -0,0 +1,88 @@
+from prometheus_client import (  # type: ignore
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+
+# stages of the webhook hot path, each a label of STAGE_SECONDS
+VALIDATION = "validation"
+PARSE_EVENT = "parse_event"
+AVERAGE = "average"
+INSERT = "insert"
+EVALUATE = "evaluate"
+SMS = "sms"
+
+# per-reading stages take microseconds, storage and SMS round trips take up to seconds
+STAGE_BUCKETS = (
+    0.00001,
+    0.00005,
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+)
+FETCH_SIZE_BUCKETS = (0, 1, 10, 50, 100, 250, 500, 1000)
+
+registry = CollectorRegistry()
+
+STAGE_SECONDS = Histogram(
+    "hottoddy_stage_seconds",
+    "Time spent in each stage of webhook ingest",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+    registry=registry,
+)
+STORAGE_SECONDS = Histogram(
+    "hottoddy_storage_seconds",
+    "Duration of storage calls",
+    ["store", "call"],
+    buckets=STAGE_BUCKETS,
+    registry=registry,
+)
+STORAGE_ITEMS = Counter(
+    "hottoddy_storage_items",
+    "Items written to or fetched from storage",
+    ["store", "call"],
+    registry=registry,
+)
+DUPLICATE_READINGS = Counter(
+    "hottoddy_duplicate_readings",
+    "Readings dropped because their (event, sensor_name) was already ingested",
+    registry=registry,
+)
+OUTLIER_READINGS = Counter(
+    "hottoddy_outlier_readings",
+    "Readings flagged as outliers by the Hampel filter",
+    registry=registry,
+)
+DELIVERIES = Counter(
+    "hottoddy_deliveries",
+    "Alert deliveries by channel and outcome (sent, retried or failed)",
+    ["channel", "outcome"],
+    registry=registry,
+)
+FETCH_SIZE = Histogram(
+    "hottoddy_storage_fetch_items",
+    "Items returned per storage fetch",
+    ["store"],
+    buckets=FETCH_SIZE_BUCKETS,
+    registry=registry,
+)
+
+
+def stage(name: str):
+    """Times a block or function as one of the stages above, e.g. `with metrics.stage(metrics.INSERT):`."""
+    return STAGE_SECONDS.labels(name).time()
+
+
+def render() -> tuple[bytes, str]:
+    """Returns every metric in the Prometheus text format and its content type."""
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,75 +1,231 @@
+import asyncio
 import logging
+import threading
 import time
 import datetime
-from dataclasses import dataclass
-from typing import List, Tuple
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Tuple
 
+import orjson
 from decouple import config  # type: ignore
-from deta import Deta  # type: ignore
-from fastapi import FastAPI, Response
+from fastapi import Response
 from pydantic import BaseModel
-from twilio.rest import Client  # type: ignore
 
-logging.basicConfig(filename="models.log", encoding="utf-8", level=logging.DEBUG)
+import metrics
+from constants import (
+    NotificationType,
+    SensorTypes,
+    SensorConfig,
+    AlertTiming,
+    TrendConfig,
+)
+from aggregator import SensorWindowAggregator
+from writer import BatchWriter
+from storage import open_store
+from latest import LatestReadingIndex
+from dispatch import BackgroundDispatcher
+from dedup import SeenEvents
+from scheduler import NotificationScheduler, PendingAlert
+from evaluation import evaluate_batch
+from segments import SegmentStore
+from rollups import RollupIndex
+from shared import open_shared_state
+from rules import SensorRules
+from trends import Trend, TrendTracker
+from outliers import HampelFilter
+from geo import GeoIndex
+from capture import CaptureWriter
+from delivery import TWILIO_FROM, TWILIO_TO, Deliverer, load_recipients
+
+# directory of the segment file archive of reading history, disabled when empty
+SEGMENT_DIR = config("SEGMENT_DIR", default="")
+# file webhook bodies are captured to for replay.py, disabled when empty
+CAPTURE_PATH = config("CAPTURE_PATH", default="")
+
+
+class LazyResource:
+    """Creates a client or store on first use and reuses it afterwards, so that importing this module doesn't
+    read secrets or open connections. Attributes are looked up on the created object.
+
+    Args:
+        factory (Callable[[], Any]): Creates the object
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._instance: Any = None
+        self._lock = threading.Lock()
+
+    @property
+    def created(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> Any:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name: str):
+        return getattr(self.get(), name)
+
+    def __repr__(self) -> str:
+        return (
+            repr(self._instance) if self.created else f"LazyResource({self._factory})"
+        )
 
 
-from constants import NotificationType, SensorTypes, SensorConfig, AlertTiming
+def _twilio_client():
+    # twilio.rest is slow to import and only needed once an SMS is sent. The client keeps one HTTP session,
+    # so connections are reused across messages.
+    from twilio.rest import Client  # type: ignore
 
-TWILIO_ACCOUNT_SID = config("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = config("TWILIO_AUTH_TOKEN")
-DETA_KEY = config("DETA_KEY")
+    return Client(config("TWILIO_ACCOUNT_SID"), config("TWILIO_AUTH_TOKEN"))
 
 
-TWILIO_CLIENT_IDS = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+TWILIO_CLIENT_IDS = LazyResource(_twilio_client)
 
-app = FastAPI()
-deta = Deta(DETA_KEY)  # type: ignore
+# backend is chosen with the STORAGE_BACKEND environment variable, see storage.open_store
+all_readings_db = LazyResource(lambda: open_store("therm-all-readings"))
+recent_readings_db = LazyResource(lambda: open_store("recent_readings"))
+latest_readings_db = LazyResource(lambda: open_store("latest_readings"))
+reading_archive = (
+    LazyResource(lambda: SegmentStore(SEGMENT_DIR)) if SEGMENT_DIR else None
+)
+traffic_capture = (
+    LazyResource(lambda: CaptureWriter(CAPTURE_PATH)) if CAPTURE_PATH else None
+)
 
-all_readings_db = deta.Base("therm-all-readings")
-recent_readings_db = deta.Base("recent_readings")
 
-last_averages: list[tuple[str, float]] = []
+def _fetch_recent_readings() -> list[dict]:
+    """Fetches every page of recent_readings_db, used once to warm recent_window."""
+    return list(recent_readings_db.scan())
 
-is_armed: bool = True
 
+# arm state, sensor windows and alert cooldowns shared by every worker, chosen with the SHARED_STATE environment variable
+shared_state = LazyResource(open_shared_state)
 
-def _if_recent_reading() -> int:
-    resp = recent_readings_db.fetch()
-    for i in range(1, len(resp.items)):
-        if resp.items[i]["datetime"] >= time.time() - AlertTiming.AVERAGE_ALERT_WINDOW:
-            return True
-    else:
-        return False
+# windows of readings still held in recent_readings_db, kept in memory so averages don't refetch the cache
+recent_window = SensorWindowAggregator(
+    loader=_fetch_recent_readings, state=shared_state
+)
+
+# buffers inserts into both databases and writes them in put_many batches off the request path
+db_writer = BatchWriter()
+
+# latest reading per sensor and per sensor type, updated on every insert for the "last" SMS command
+latest_readings = LatestReadingIndex(store=latest_readings_db, writer=db_writer)
+
+# minute, hour and day rollups per sensor for time range queries
+rollups = RollupIndex()
+
+# who is alerted about each sensor, from the recipients file, and the channels alerts are sent over
+recipients = LazyResource(load_recipients)
+deliverer = Deliverer()
+
+# EWMA and slope of each sensor's readings for the rate of change rules
+recent_trends = TrendTracker()
+
+# rolling median and MAD of each sensor's readings, to flag outliers before they're averaged or alerted on
+recent_outliers = HampelFilter()
+
+# latest position and reading of every sensor in a grid, for location queries and region rules
+geo_index = GeoIndex()
+
+# thresholds per sensor type and per sensor from the rules file, reloaded by main when the file changes
+sensor_rules = SensorRules()
+
+# worker tasks that take storage writes and SMS sends off the webhook request
+dispatcher = BackgroundDispatcher()
+
+# (event, sensor_name) of ingested readings, so that retried webhooks are acknowledged without doing the work again
+seen_events = SeenEvents()
+
+# tracks alerted conditions across events for cooldowns, recoveries and digests
+notification_scheduler = NotificationScheduler(state=shared_state)
+
+
+def _if_recent_reading() -> bool:
+    query = {"datetime?gte": time.time() - AlertTiming.AVERAGE_ALERT_WINDOW}
+    resp = recent_readings_db.fetch(query, limit=1)
+    # deta applies the limit before the query, so a page can be empty while a later one has a match
+    while not resp.items and resp.last:
+        resp = recent_readings_db.fetch(query, last=resp.last)
+    return resp.count > 0
+
+
+async def run_with_shared_state(func: Callable[..., Any], *args) -> Any:
+    """Calls func, which uses shared_state, in a thread if the state is blocking, e.g. SQLite, so that its commits
+    and lock waits don't hold up the event loop. With the in-process state func is called directly.
+    """
+    if shared_state.blocking:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+
+def is_armed() -> bool:
+    return shared_state.get_flag("armed", True)
 
 
 async def set_arm_state():
-    global is_armed
-    if is_armed == True:
-        is_armed = False
+    return await run_with_shared_state(shared_state.toggle_flag, "armed", True)
+
+
+# label and unit used when replying with a reading of each sensor type
+READING_LABELS = {
+    SensorTypes.TEMPERATURE: ("temperature", "F"),
+    SensorTypes.HUMIDITY: ("humidity", "%"),
+    SensorTypes.AIRQUALITY: ("air quality", ""),
+}
+
+# names accepted by the "last" SMS command in addition to the SensorTypes names
+SENSOR_TYPE_ALIASES = {
+    "temp": SensorTypes.TEMPERATURE,
+    "air": SensorTypes.AIRQUALITY,
+    "airquality": SensorTypes.AIRQUALITY,
+}
+
+
+def _sensor_type_from_name(name: str) -> Optional[SensorTypes]:
+    name = name.lower().strip()
+    if name in SENSOR_TYPE_ALIASES:
+        return SENSOR_TYPE_ALIASES[name]
+    return SensorTypes.__members__.get(name.upper())
+
+
+async def get_and_send_last_reading(response, target: str = "temp"):
+    """Replies with the latest reading of a sensor type or a single sensor, read from latest_readings in O(1).
+
+    Args:
+        response (MessagingResponse): Twilio response to add the message to
+        target (str, optional): Sensor type name (e.g. "temp", "humidity") or sensor name. Defaults to "temp".
+    """
+    sensor_type = _sensor_type_from_name(target)
+    if sensor_type is not None:
+        label, unit = READING_LABELS[sensor_type]
+        last = latest_readings.for_type(sensor_type)
     else:
-        is_armed = True
-    return is_armed
-
+        label, unit = target, ""
+        last = latest_readings.for_sensor(target)
+        if last is not None:
+            unit = READING_LABELS[SensorTypes(last["sensor_type"])][1]
 
-async def get_and_send_last_temp_reading(response):
-    all_readings_temp = all_readings_db.fetch(query={"sensor_type": 1})
-    last_temp = max(all_readings_temp.items, key=lambda d: d["datetime"])
-    last_temp_reading = last_temp["sensor_reading"]
-    last_temp_datetime = datetime.datetime.fromtimestamp(last_temp["datetime"])
-    try:
+    if last is None:
+        response.message(f"Last {label} not available")
+    else:
+        last_datetime = datetime.datetime.fromtimestamp(last["datetime"])
         response.message(
-            f"Last temperature = {last_temp_reading}F at {last_temp_datetime} utc"
-        )
-        return Response(
-            content=str(response),
-            media_type="application/xml",
-        )
-    except:
-        response.message(f"Last temp not available")
-        return Response(
-            content=str(response),
-            media_type="application/xml",
+            f"Last {label} = {last['sensor_reading']}{unit} at {last_datetime} utc"
         )
+    return Response(
+        content=str(response),
+        media_type="application/xml",
+    )
+
+
+async def get_and_send_last_temp_reading(response):
+    return await get_and_send_last_reading(response, "temp")
 
 
 async def set_arm_disarm_and_sms(response):
@@ -87,7 +243,7 @@ async def set_arm_disarm_and_sms(response):
         )
 
 
-@dataclass(repr=True)
+@dataclass(repr=True, slots=True)
 class ParsedReading:
     """An individual reading from a single sensor parsed from SensorLogging event."""
 
@@ -99,12 +255,16 @@ class ParsedReading:
     sensor_reading: float
     recent_average: float
     sensor_config: SensorConfig
+    # statistics of the sensor's readings as of this one, for the rate of change rules
+    trend: Optional[Trend] = field(default=None, compare=False)
+    # the reading is far from its sensor's recent median, see outliers.HampelFilter
+    outlier: bool = field(default=False, compare=False)
 
     def insert_parsed_reading_into_db(self, database, expiration_seconds=0) -> bool:
-        """Inserts into Deta.sh Database
+        """Inserts into a storage backend
 
         Args:
-            database (str): Deta database to insert
+            database (ReadingStore): Store to insert into
             reading (Reading): Reading class associated with event to be stored
             expiration_seconds (int, optional): Number of seconds before result is purged. Defaults to 0.
 
@@ -112,13 +272,14 @@ class ParsedReading:
             bool: Returns true if succesful, otherwise exception
         """
         try:
-            db_response = database.put(
-                self.parse_for_db_save(), expire_in=expiration_seconds
-            )
-            logging.debug(f"inserted {db_response} reading into {database}")
+            with metrics.stage(metrics.INSERT):
+                db_response = database.put(
+                    self.parse_for_db_save(), expire_in=expiration_seconds
+                )
+            logging.debug("inserted %s reading into %s", db_response, database)
             return True
         except:
-            logging.debug(f"failed to insert reading into {database}")
+            logging.debug("failed to insert reading into %s", database)
             raise MemoryError
 
     def parse_for_db_save(self):
@@ -143,6 +304,25 @@ class SensorLogReading(BaseModel):
     sensor_type: SensorTypes
 
 
+class ReadingRecord:
+    """A capture decoded by SensorLogEvent.decode, in place of a SensorLogReading when its fields already have the right types."""
+
+    __slots__ = ("sensor_name", "sensor_reading", "sensor_type")
+
+    def __init__(
+        self, sensor_name: str, sensor_reading: float, sensor_type: SensorTypes
+    ):
+        self.sensor_name = sensor_name
+        self.sensor_reading = sensor_reading
+        self.sensor_type = sensor_type
+
+    def __repr__(self) -> str:
+        return f"ReadingRecord({self.sensor_name!r}, {self.sensor_reading!r}, {self.sensor_type!r})"
+
+
+SENSOR_TYPE_VALUES = {t.value: t for t in SensorTypes}
+
+
 class SensorLogEvent(BaseModel):
     """Defines webhook event for ingestion by FastAPI. 'readings' is a list of captures from all sensors.  In the future, could be generecized."""
 
@@ -152,60 +332,204 @@ class SensorLogEvent(BaseModel):
     best_long: float
     readings: List[SensorLogReading]
 
-    def parse_event(self) -> list[ParsedReading]:
-        """Deserializes SensorLogEvent into individual readings for storage.
+    @classmethod
+    def decode(cls, body: bytes) -> "SensorLogEvent":
+        """Decodes a webhook body with orjson. Events whose fields already have exactly the expected types, as
+        Notehub sends them, are built without pydantic validation and with ReadingRecords as their readings.
+        Anything else is validated by parse_obj, so it is coerced or rejected exactly as before.
+
+        Args:
+            body (bytes): Request body
+
+        Raises:
+            orjson.JSONDecodeError: The body isn't JSON
+            ValidationError: The body isn't a valid SensorLogEvent
+
+        Returns:
+            SensorLogEvent: Decoded event
+        """
+        data = orjson.loads(body)
+        event = cls._construct_exact(data)
+        return event if event is not None else cls.parse_obj(data)
+
+    @classmethod
+    def _construct_exact(cls, data) -> Optional["SensorLogEvent"]:
+        if type(data) is not dict:
+            return None
+        datetime, event, best_lat, best_long, readings = (
+            data.get("datetime"),
+            data.get("event"),
+            data.get("best_lat"),
+            data.get("best_long"),
+            data.get("readings"),
+        )
+        if (
+            type(datetime) is not int
+            or type(event) is not str
+            or type(best_lat) not in (int, float)
+            or type(best_long) not in (int, float)
+            or type(readings) is not list
+        ):
+            return None
+        records = []
+        for r in readings:
+            if type(r) is not dict:
+                return None
+            sensor_name, sensor_reading, sensor_type = (
+                r.get("sensor_name"),
+                r.get("sensor_reading"),
+                r.get("sensor_type"),
+            )
+            if (
+                type(sensor_name) is not str
+                or type(sensor_reading) not in (int, float)
+                or type(sensor_type) is not int
+                or sensor_type not in SENSOR_TYPE_VALUES
+            ):
+                return None
+            records.append(
+                ReadingRecord(
+                    sensor_name, float(sensor_reading), SENSOR_TYPE_VALUES[sensor_type]
+                )
+            )
+        return cls.construct(
+            datetime=datetime,
+            event=event,
+            best_lat=float(best_lat),
+            best_long=float(best_long),
+            readings=records,
+        )
+
+    def parse_event(
+        self,
+        window: Optional[SensorWindowAggregator] = None,
+        trends: Optional[TrendTracker] = None,
+        outliers: Optional[HampelFilter] = None,
+    ) -> list[ParsedReading]:
+        """Deserializes SensorLogEvent into individual readings for storage. Outliers are flagged, and the median of
+        their sensor's recent readings is used in their place for the average and the trend.
 
         Args:
             sensor_log_event (SensorLogEvent): Event produced by / API call
+            window (SensorWindowAggregator, optional): Window for historical events, see compute_recent_sensor_averages. Defaults to recent_window.
+            trends (TrendTracker, optional): Trends of historical events, kept apart from live ones. Defaults to recent_trends.
+            outliers (HampelFilter, optional): Outlier filter of historical events. Defaults to recent_outliers.
 
         Returns:
             list:List of events split by individual sensor reading. If initial api call has 5 readings, this returns a list of 5
         """
-        return [
-            ParsedReading(
-                datetime=self.datetime,
-                event=self.event,
-                best_lat=self.best_lat,
-                best_long=self.best_long,
-                sensor_name=r.sensor_name,
-                sensor_config=SensorConfig(r.sensor_type),
-                sensor_reading=r.sensor_reading,
-                recent_average=self.compute_recent_sensor_averages(
-                    r.sensor_name, r.sensor_reading
-                ),
+        parsed_readings = []
+        for r in self.readings:
+            sensor_config = sensor_rules.lookup(r.sensor_type, r.sensor_name)
+            outlier, filtered_reading = (outliers or recent_outliers).check(
+                r.sensor_name,
+                r.sensor_reading,
+                sensor_config.thresholds["outlier_change"],
             )
-            for r in self.readings
-        ]
+            if outlier:
+                metrics.OUTLIER_READINGS.inc()
+                logging.debug(
+                    "%s reading %s is an outlier", r.sensor_name, r.sensor_reading
+                )
+            parsed_readings.append(
+                ParsedReading(
+                    datetime=self.datetime,
+                    event=self.event,
+                    best_lat=self.best_lat,
+                    best_long=self.best_long,
+                    sensor_name=r.sensor_name,
+                    sensor_config=sensor_config,
+                    sensor_reading=r.sensor_reading,
+                    recent_average=self.compute_recent_sensor_averages(
+                        r.sensor_name, filtered_reading, window
+                    ),
+                    trend=(trends or recent_trends).update(
+                        r.sensor_name, self.datetime, filtered_reading
+                    ),
+                    outlier=outlier,
+                )
+            )
+        return parsed_readings
 
     def compute_recent_sensor_averages(
-        self, sensor_name: str, sensor_reading: float
+        self,
+        sensor_name: str,
+        sensor_reading: float,
+        window: Optional[SensorWindowAggregator] = None,
     ) -> float:
         """Hydrates recent_average field in notecard_event storage based off set of recent readings stored in cache.
-        Set of readings in the average dependent on duration of expiration in recent_readings_db.
+        Set of readings in the average dependent on duration of expiration in recent_readings_db, tracked in memory by recent_window.
 
 
         Args:
             sensor_name (str): Name of sensor as specified in the reading field of the event
             sensor_reading (float): Sensor Reading passed in from Notebook event
+            window (SensorWindowAggregator, optional): Window of a historical replay, evicted by this event's datetime instead of the clock. Defaults to recent_window.
 
         Returns:
             float: Computed average of readings per sensor
         """
-
-        recent_readings = recent_readings_db.fetch().items
-        last_readings = [
-            reading["sensor_reading"]
-            for reading in recent_readings
-            if reading["sensor_name"] == sensor_name
-        ]
-        last_readings.append(sensor_reading)
+        if window is not None:
+            return window.recent_average(sensor_name, sensor_reading, now=self.datetime)
 
         # average is a function of the time set for the recent_readings cache. To get a smaller window, set a smaller time for CacheConfig.ExpirationTime
-        recent_sensor_average = sum(last_readings) / len(last_readings)
-        last_averages.insert(0, (sensor_name, recent_sensor_average))
+        with metrics.stage(metrics.AVERAGE):
+            recent_sensor_average = recent_window.recent_average(
+                sensor_name, sensor_reading
+            )
         return recent_sensor_average
 
 
+def evaluate_regions(
+    parsed_readings: List[ParsedReading],
+) -> Tuple[List[ParsedReading], List[Tuple[ParsedReading, NotificationType]]]:
+    """Evaluates the region rules of every region one of parsed_readings is in. A region is evaluated as a reading
+    of the average latest reading of the sensors of its type in it, from geo_index, named by RegionRule.sensor_name.
+
+    Args:
+        parsed_readings (List[ParsedReading]): Readings of an event, already added to geo_index
+
+    Returns:
+        Tuple[List[ParsedReading], List[Tuple[ParsedReading, NotificationType]]]: A reading per evaluated region,
+        and the notifications of those meeting their thresholds, for NotificationScheduler.observe
+    """
+    region_readings = []
+    for rule in sensor_rules.regions:
+        sensor_type = rule.sensor_config.sensor_type
+        if not any(
+            r.sensor_config.sensor_type == sensor_type
+            and rule.region.contains(r.best_lat, r.best_long)
+            for r in parsed_readings
+        ):
+            continue
+        positions = geo_index.within(rule.region, sensor_type)
+        if not positions:
+            continue
+        average = sum(p.sensor_reading for p in positions) / len(positions)
+        center = rule.region.center or (
+            (rule.region.box[0] + rule.region.box[2]) / 2,  # type: ignore
+            (rule.region.box[1] + rule.region.box[3]) / 2,  # type: ignore
+        )
+        region_readings.append(
+            ParsedReading(
+                datetime=max(p.datetime for p in positions),
+                event=rule.sensor_name,
+                best_lat=center[0],
+                best_long=center[1],
+                sensor_name=rule.sensor_name,
+                sensor_reading=average,
+                recent_average=average,
+                sensor_config=rule.sensor_config,
+            )
+        )
+    notifications = [
+        result
+        for result in evaluate_batch(region_readings, lambda: False)
+        if result[1] != NotificationType.NOOP
+    ]
+    return region_readings, notifications
+
+
 @dataclass
 class Notifications:
     """Handles evaluation for when to notify based on Reading state and mechanics for notification.
@@ -226,39 +550,145 @@ class Notifications:
         notification_result = self._evaluate_for_notify_logic(reading)
         if notification_result[1] != NotificationType.NOOP:
             self.queued_notifications.append(notification_result)
-            logging.debug(f"Appended {notification_result} to notification queue.")
+            logging.debug("Appended %s to notification queue.", notification_result)
             return True
         else:
             return False
 
+    def evaluate_batch(self, parsed_readings: List[ParsedReading]) -> int:
+        """Evaluates many readings at once with evaluation.evaluate_batch and appends those to be sent,
+        giving the same notifications as calling evaluate_for_notify on each reading.
+
+        Args:
+            parsed_readings (List[ParsedReading]): Readings to be evaluated
+
+        Returns:
+            int: Number of readings that triggered a notification
+        """
+        with metrics.stage(metrics.EVALUATE):
+            results = self._evaluate(parsed_readings, _if_recent_reading)
+        return self._queue(results)
+
+    async def evaluate_batch_async(self, parsed_readings: List[ParsedReading]) -> int:
+        """evaluate_batch for the event loop. _if_recent_reading is a blocking storage round trip, so it's made
+        from a thread, and only when a reading's RAPID_INCREASE depends on it.
+
+        Args:
+            parsed_readings (List[ParsedReading]): Readings to be evaluated
+
+        Returns:
+            int: Number of readings that triggered a notification
+        """
+        needed = []
+        started = time.perf_counter()
+        results = self._evaluate(parsed_readings, lambda: needed.append(True) or False)
+        elapsed = time.perf_counter() - started
+        if needed:
+            recent = await asyncio.to_thread(_if_recent_reading)
+            started = time.perf_counter()
+            results = self._evaluate(parsed_readings, lambda: recent)
+            elapsed += time.perf_counter() - started
+        # one observation for both evaluations, leaving out the storage round trip between them
+        metrics.STAGE_SECONDS.labels(metrics.EVALUATE).observe(elapsed)
+        return self._queue(results)
+
+    @staticmethod
+    def _evaluate(
+        parsed_readings: List[ParsedReading], is_recent: Callable[[], bool]
+    ) -> List[Tuple[ParsedReading, NotificationType]]:
+        return [
+            result
+            for result in evaluate_batch(parsed_readings, is_recent)
+            if result[1] != NotificationType.NOOP
+        ]
+
+    def _queue(self, results: List[Tuple[ParsedReading, NotificationType]]) -> int:
+        self.queued_notifications.extend(results)
+        if results:
+            logging.debug("Appended %s to notification queue.", results)
+        return len(results)
+
     def construct_twilio_sms(self):
         """Parses queued notifications and constructs strings to include in SMS."""
-        logging.debug(self.queued_notifications)
+        logging.debug("%s", self.queued_notifications)
 
         if len(self.queued_notifications) >= 1:
             body: str = ""
             for notification in self.queued_notifications:
-                if notification[0].sensor_config.sensor_type == 1:
-                    message = f"Current temperature: {round(notification[0].recent_average,0)} F, Reason: {notification[1]} \n"
-                    body = body.__add__(message)
-                elif notification[0].sensor_config.sensor_type == 2:
-                    message = f"Current humidity: {round(notification[0].recent_average,2)} %, Reason: {notification[1]} \n"
-                    body = body.__add__(message)
+                body = body.__add__(self._notification_message(*notification))
             self.send_twilio_message(body)
         else:
             logging.debug("Not armed")
 
-    def send_twilio_message(self, body: str):
+    @staticmethod
+    def construct_digest(alerts: List[PendingAlert]) -> str:
+        """Constructs a single SMS body for the alerts and recoveries taken from NotificationScheduler.flush().
+
+        Args:
+            alerts (List[PendingAlert]): Alerts to include in the SMS
+
+        Returns:
+            str: SMS body
+        """
+        body: str = ""
+        for alert in alerts:
+            if alert.recovered:
+                body = body.__add__(
+                    f"{alert.reading.sensor_name} recovered from {alert.notification_type}, current average: {round(alert.reading.recent_average,2)} \n"
+                )
+            else:
+                body = body.__add__(
+                    Notifications._notification_message(
+                        alert.reading, alert.notification_type
+                    )
+                )
+        return body
+
+    @staticmethod
+    def _notification_message(
+        reading: ParsedReading, notification_type: NotificationType
+    ) -> str:
+        if reading.sensor_config.sensor_type == 1:
+            return f"Current temperature: {round(reading.recent_average,0)} F, Reason: {notification_type} \n"
+        elif reading.sensor_config.sensor_type == 2:
+            return f"Current humidity: {round(reading.recent_average,2)} %, Reason: {notification_type} \n"
+        label, unit = READING_LABELS[reading.sensor_config.sensor_type]
+        return f"Current {label} ({reading.sensor_name}): {round(reading.recent_average,2)} {unit}, Reason: {notification_type} \n"
+
+    @staticmethod
+    def send_twilio_message(body: str):
         """Calls twilio API with constructed body string.
 
         Args:
-            body (str): Parsed sensor readings from construct_twilio_sms()
+            body (str): Parsed sensor readings from construct_twilio_sms() or construct_digest()
         """
-        TWILIO_CLIENT_IDS.messages.create(
-            body=body,
-            from_="+15405924574",
-            to="+19739438803",
-        )
+        with metrics.stage(metrics.SMS):
+            TWILIO_CLIENT_IDS.messages.create(
+                body=body,
+                from_=TWILIO_FROM,
+                to=TWILIO_TO,
+            )
+
+    @staticmethod
+    async def deliver_digest(alerts: List[PendingAlert]) -> int:
+        """Sends each recipient of the alerts a digest of the alerts routed to them, see delivery.Recipients.
+        Recipients are sent to concurrently by deliverer.
+
+        Args:
+            alerts (List[PendingAlert]): Alerts taken from NotificationScheduler.flush()
+
+        Returns:
+            int: Number of recipients the digest was delivered to
+        """
+        routed = recipients.route(alerts)
+        with metrics.stage(metrics.SMS):
+            delivered = await deliverer.deliver(
+                {
+                    recipient: Notifications.construct_digest(recipient_alerts)
+                    for recipient, recipient_alerts in routed.items()
+                }
+            )
+        return sum(delivered.values())
 
     def get_notifications(self) -> List:
         """
@@ -268,6 +698,7 @@ class Notifications:
         """
         return self.queued_notifications
 
+    @metrics.STAGE_SECONDS.labels(metrics.EVALUATE).time()
     def _evaluate_for_notify_logic(
         self, parsed_reading: ParsedReading
     ) -> Tuple[ParsedReading, NotificationType]:
@@ -279,48 +710,72 @@ class Notifications:
         Returns:
             Tuple[Reading, NotificationType]: Returns the Reading object and the constant associated with the notification reason. Returns a NOOP if no notification is to be sent."
         """
+        trend = parsed_reading.trend
         if (
             parsed_reading.recent_average
             >= parsed_reading.sensor_config.thresholds["average"]
         ):
-            logging.debug(NotificationType.TOO_HIGH_AVERAGE)
+            logging.debug("%s", NotificationType.TOO_HIGH_AVERAGE)
             return parsed_reading, NotificationType.TOO_HIGH_AVERAGE
 
-        # Evaluates if any current single reading is too high
+        # Evaluates if any current single reading is too high, unless it's an outlier
         elif (
-            parsed_reading.sensor_reading
+            not parsed_reading.outlier
+            and parsed_reading.sensor_reading
             >= parsed_reading.sensor_config.thresholds["single_reading"]
         ):
-            logging.debug(NotificationType.TOO_HIGH_SINGLE)
+            logging.debug("%s", NotificationType.TOO_HIGH_SINGLE)
             return parsed_reading, NotificationType.TOO_HIGH_SINGLE
 
+        # Evaluates if the recent average or the current single reading is too low
+        elif (
+            parsed_reading.recent_average
+            <= parsed_reading.sensor_config.thresholds["low_average"]
+        ):
+            logging.debug("%s", NotificationType.TOO_LOW_AVERAGE)
+            return parsed_reading, NotificationType.TOO_LOW_AVERAGE
+
+        elif (
+            not parsed_reading.outlier
+            and parsed_reading.sensor_reading
+            <= parsed_reading.sensor_config.thresholds["low_single_reading"]
+        ):
+            logging.debug("%s", NotificationType.TOO_LOW_SINGLE)
+            return parsed_reading, NotificationType.TOO_LOW_SINGLE
+
         # Evaluates if the last reading has increased too fast compared to the average
         elif (
-            parsed_reading.sensor_reading - parsed_reading.recent_average
+            not parsed_reading.outlier
+            and parsed_reading.sensor_reading - parsed_reading.recent_average
             >= parsed_reading.sensor_config.thresholds["single_increase_change"]
             and _if_recent_reading()  # TODO make this specific to the sensor_type
         ):
 
-            logging.debug(NotificationType.RAPID_INCREASE)
+            logging.debug("%s", NotificationType.RAPID_INCREASE)
             return parsed_reading, NotificationType.RAPID_INCREASE
 
-        # # Evaluates if the last average has increased too fast compared to the previous average
-        # elif (
-        #     (
-        #         (
-        #             last_average[1] - parsed_reading.recent_average
-        #             >= parsed_reading.sensor_config.thresholds[
-        #                 "average_increase_change"
-        #             ]
-        #         )
-        #         and _get_recent_readings() <= 5
-        #     )
-        #     for last_average in last_averages
-        #     if last_average[0] == parsed_reading.sensor_name
-        # ):
-
-        #     logging.debug(NotificationType.RAPID_INCREASE_AVERAGE)
-        #     return parsed_reading, NotificationType.RAPID_INCREASE_AVERAGE
+        # Evaluates if the sensor dropped well below its recent mean, beyond its usual variation
+        elif (
+            not parsed_reading.outlier
+            and trend is not None
+            and trend.count >= TrendConfig.MIN_READINGS
+            and trend.mean - parsed_reading.sensor_reading
+            >= parsed_reading.sensor_config.thresholds["single_decrease_change"]
+            and trend.mean - parsed_reading.sensor_reading
+            >= TrendConfig.DEVIATIONS * trend.deviation
+        ):
+            logging.debug("%s", NotificationType.RAPID_DECREASE)
+            return parsed_reading, NotificationType.RAPID_DECREASE
+
+        # Evaluates if the sensor's readings are trending up too fast across the window
+        elif (
+            trend is not None
+            and trend.count >= TrendConfig.MIN_READINGS
+            and trend.rise
+            >= parsed_reading.sensor_config.thresholds["average_increase_change"]
+        ):
+            logging.debug("%s", NotificationType.RAPID_INCREASE_AVERAGE)
+            return parsed_reading, NotificationType.RAPID_INCREASE_AVERAGE
 
         else:
             logging.debug("no notification triggered")
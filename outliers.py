@@ -0,0 +1,209 @@
+import math
+import random
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+from constants import MAD_SCALE, OutlierConfig
+
+
+class _Node:
+    __slots__ = ("value", "next", "width")
+
+    def __init__(self, value: float, levels: int):
+        self.value = value
+        self.next: List[Optional["_Node"]] = [None] * levels
+        # number of values each link skips over, to find a value by its rank
+        self.width = [1] * levels
+
+
+class IndexableSkiplist:
+    """Sorted multiset of floats with insert, remove and lookup by rank in O(log n) expected time.
+
+    Args:
+        max_levels (int, optional): Levels of links, enough for about 2 ** max_levels values. Defaults to 16.
+    """
+
+    def __init__(self, max_levels: int = 16):
+        self.max_levels = max_levels
+        self.head = _Node(float("-inf"), max_levels)
+        self.size = 0
+        self._random = random.Random(0)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, rank: int) -> float:
+        if not 0 <= rank < self.size:
+            raise IndexError(rank)
+        node = self.head
+        rank += 1
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.width[level] <= rank:
+                rank -= node.width[level]
+                node = node.next[level]  # type: ignore
+        return node.value
+
+    def _levels(self) -> int:
+        levels = 1
+        while levels < self.max_levels and self._random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def insert(self, value: float):
+        # the last node before value on each level and the rank it's at
+        chain: List[_Node] = [self.head] * self.max_levels
+        ranks = [0] * self.max_levels
+        node, rank = self.head, 0
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].value <= value:  # type: ignore
+                rank += node.width[level]
+                node = node.next[level]  # type: ignore
+            chain[level], ranks[level] = node, rank
+        new = _Node(value, self._levels())
+        for level in range(self.max_levels):
+            previous = chain[level]
+            if level < len(new.next):
+                skipped = rank - ranks[level]
+                new.next[level] = previous.next[level]
+                new.width[level] = previous.width[level] - skipped
+                previous.next[level] = new
+                previous.width[level] = skipped + 1
+            else:
+                previous.width[level] += 1
+        self.size += 1
+
+    def remove(self, value: float):
+        chain: List[_Node] = [self.head] * self.max_levels
+        node = self.head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].value < value:  # type: ignore
+                node = node.next[level]  # type: ignore
+            chain[level] = node
+        target = node.next[0]
+        if target is None or target.value != value:
+            raise KeyError(value)
+        for level in range(self.max_levels):
+            previous = chain[level]
+            if previous.next[level] is target:
+                previous.width[level] += target.width[level] - 1
+                previous.next[level] = target.next[level]
+            else:
+                previous.width[level] -= 1
+        self.size -= 1
+
+
+@dataclass
+class SlidingMedian:
+    """Median and median absolute deviation (MAD) of the last size values added.
+
+    Values are kept sorted in an IndexableSkiplist, so adding a value is O(log size). The median is two rank
+    lookups. The MAD is found by selecting from the deviations below and above the median, which are both
+    sorted in the skiplist already, in O(log size) lookups of O(log size) each.
+    """
+
+    size: int
+    values: Deque[float] = field(default_factory=deque)
+    ordered: IndexableSkiplist = field(init=False)
+
+    def __post_init__(self):
+        self.ordered = IndexableSkiplist(max_levels=max(1, self.size.bit_length()))
+
+    def add(self, value: float):
+        # NaN can't be found in the skiplist again, so it would never leave the window
+        if not math.isfinite(value):
+            raise ValueError(f"can't add {value} to a sliding median")
+        if len(self.values) >= self.size:
+            # removed from the skiplist first, so a failure leaves both as they were
+            self.ordered.remove(self.values[0])
+            self.values.popleft()
+        self.values.append(value)
+        self.ordered.insert(value)
+
+    def median(self) -> float:
+        n = len(self.ordered)
+        return (self.ordered[(n - 1) // 2] + self.ordered[n // 2]) / 2
+
+    def mad(self) -> float:
+        n = len(self.ordered)
+        median = self.median()
+        split = n // 2
+        below, above = split, n - split
+
+        def lower(i: int) -> float:
+            # deviations of the values below the median, nearest first
+            return median - self.ordered[split - 1 - i]
+
+        def upper(i: int) -> float:
+            return self.ordered[split + i] - median
+
+        def smallest(k: int) -> float:
+            # k-th smallest deviation, by binary search on how many come from below the median
+            low, high = max(0, k + 1 - above), min(k + 1, below)
+            while True:
+                i = (low + high) // 2
+                j = k + 1 - i
+                if i < below and j > 0 and upper(j - 1) > lower(i):
+                    low = i + 1
+                elif i > 0 and j < above and lower(i - 1) > upper(j):
+                    high = i - 1
+                else:
+                    return max(
+                        lower(i - 1) if i > 0 else float("-inf"),
+                        upper(j - 1) if j > 0 else float("-inf"),
+                    )
+
+        return (smallest((n - 1) // 2) + smallest(n // 2)) / 2
+
+
+@dataclass
+class HampelFilter:
+    """Flags readings far from the median of their sensor's recent readings, with the Hampel identifier: a reading
+    is an outlier if it's more than deviations scaled MADs and at least min_change away from the median of the
+    last window_size readings. Every reading, outlier or not, stays in the window, so a lasting change in level
+    stops being flagged once it makes up half of the window. NaN and infinite readings are passed through
+    unflagged and aren't added to the window.
+
+    Args:
+        window_size (int): Readings per sensor the median is taken over. Defaults to OutlierConfig.WINDOW_SIZE.
+        deviations (int): Scaled MADs from the median a reading has to be. Defaults to OutlierConfig.DEVIATIONS.
+        min_readings (int): Readings a sensor needs before any are flagged. Defaults to OutlierConfig.MIN_READINGS.
+    """
+
+    window_size: int = OutlierConfig.WINDOW_SIZE.value
+    deviations: int = OutlierConfig.DEVIATIONS.value
+    min_readings: int = OutlierConfig.MIN_READINGS.value
+    windows: Dict[str, SlidingMedian] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def check(
+        self, sensor_name: str, sensor_reading: float, min_change: float
+    ) -> Tuple[bool, float]:
+        """Adds a reading to its sensor's window and checks whether it's an outlier.
+
+        Args:
+            sensor_name (str): Name of sensor as specified in the reading field of the event
+            sensor_reading (float): Sensor Reading passed in from Notebook event
+            min_change (float): Least distance from the median for the reading to be an outlier
+
+        Returns:
+            Tuple[bool, float]: Whether the reading is an outlier, and the reading or, for an outlier, the median of
+            the sensor's previous readings to use in its place
+        """
+        if not math.isfinite(sensor_reading):
+            return False, sensor_reading
+        with self._lock:
+            window = self.windows.get(sensor_name)
+            if window is None:
+                window = self.windows[sensor_name] = SlidingMedian(self.window_size)
+            outlier = False
+            if len(window.values) >= self.min_readings:
+                median = window.median()
+                distance = abs(sensor_reading - median)
+                outlier = (
+                    distance >= min_change
+                    and distance > self.deviations * MAD_SCALE * window.mad()
+                )
+            window.add(sensor_reading)
+        return (True, median) if outlier else (False, sensor_reading)
@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import json
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+import orjson
+from fastapi.exceptions import RequestValidationError
+
+import benchmark
+import main
+import model as m
+from capture import read_capture, write_capture
+
+# sends a webhook body and returns the response's status code, 0 if there was no response
+Sender = Callable[[bytes], Awaitable[int]]
+
+
+@dataclass
+class ReplayResult:
+    rate: float
+    concurrency: int
+    events: int
+    offered_per_second: Optional[float]
+    achieved_per_second: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+    errors: int
+    error_rate: float
+    saturated: bool
+
+
+def in_process_sender() -> Sender:
+    """Sends bodies straight to main.acknowledge, as the webhook route does, with no HTTP in between."""
+
+    async def send(body: bytes) -> int:
+        try:
+            return (await main.acknowledge(body)).status_code
+        except RequestValidationError:
+            return 422
+        except Exception:
+            return 500
+
+    return send
+
+
+def http_sender(client, url: str) -> Sender:
+    """POSTs bodies to url, e.g. a server started with `python replay.py serve`.
+
+    Args:
+        client (httpx.AsyncClient): Client to send with, its pool should allow as many connections as the concurrency
+        url (str): Webhook URL
+    """
+    import httpx
+
+    async def send(body: bytes) -> int:
+        try:
+            response = await client.post(
+                url, content=body, headers={"content-type": "application/json"}
+            )
+        except httpx.HTTPError:
+            return 0
+        return response.status_code
+
+    return send
+
+
+def with_fresh_ids(
+    records: Iterable[Tuple[float, bytes]], suffix: str
+) -> List[Tuple[float, bytes]]:
+    """Appends suffix to the event id of every valid body, so a server that has seen the capture already doesn't
+    drop the replayed events as duplicates. Invalid bodies are kept as they are."""
+    fresh = []
+    for arrived, body in records:
+        try:
+            event = orjson.loads(body)
+            event["event"] = f"{event['event']}{suffix}"
+            body = orjson.dumps(event)
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            pass
+        fresh.append((arrived, body))
+    return fresh
+
+
+async def replay(
+    records: List[Tuple[float, bytes]], send: Sender, rate: float, concurrency: int
+) -> ReplayResult:
+    """Sends the captured bodies with the gaps between their arrivals divided by rate, or as fast as possible if
+    rate is 0, with at most concurrency in flight.
+
+    Latency is measured from when an event was due, so time spent waiting for one of the concurrency slots
+    counts, as it would for Notehub waiting on a saturated server. With rate 0 an event is due once a slot is
+    free. The replay is saturated if it sent events less than 90% as fast as the capture was offered at.
+
+    Args:
+        records (List[Tuple[float, bytes]]): (arrival time, body) records, as read by capture.read_capture
+        send (Sender): Sends a body and returns the status code
+        rate (float): Multiple of the captured event rate to send at, 0 for as fast as possible
+        concurrency (int): Most events in flight at once
+
+    Returns:
+        ReplayResult: Throughput, latency percentiles and errors, a status other than 2xx being an error
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def send_one(body: bytes, due: float):
+        nonlocal errors
+        try:
+            status = await send(body)
+        finally:
+            slots.release()
+        latencies.append(loop.time() - due)
+        if not 200 <= status < 300:
+            errors += 1
+
+    tasks = set()
+    first = records[0][0] if records else 0.0
+    started = loop.time()
+    for arrived, body in records:
+        if rate:
+            due = started + (arrived - first) / rate
+            if due > loop.time():
+                await asyncio.sleep(due - loop.time())
+        await slots.acquire()
+        if not rate:
+            due = loop.time()
+        task = asyncio.create_task(send_one(body, due))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - started
+
+    events = len(records)
+    span = (records[-1][0] - first) / rate if rate and events > 1 else 0.0
+    offered = round(events / span, 1) if span else None
+    achieved = round(events / elapsed, 1) if elapsed else 0.0
+    p50, p90, p99, most = (
+        np.percentile(latencies, [50, 90, 99, 100]) * 1000 if latencies else [0.0] * 4
+    )
+    return ReplayResult(
+        rate=rate,
+        concurrency=concurrency,
+        events=events,
+        offered_per_second=offered,
+        achieved_per_second=achieved,
+        p50_ms=round(float(p50), 3),
+        p90_ms=round(float(p90), 3),
+        p99_ms=round(float(p99), 3),
+        max_ms=round(float(most), 3),
+        errors=errors,
+        error_rate=round(errors / events, 4) if events else 0.0,
+        saturated=offered is not None and achieved < 0.9 * offered,
+    )
+
+
+async def replay_in_process(
+    records: List[Tuple[float, bytes]],
+    rate: float,
+    concurrency: int,
+    latency: float = 0.0,
+) -> ReplayResult:
+    """Replays against main.acknowledge with fresh in-memory stand-ins for storage and alert delivery, see
+    benchmark.install_stand_ins. Background writes and the last digest are drained before returning, but
+    aren't part of the result.
+    """
+    benchmark.install_stand_ins(latency)
+    await m.dispatcher.start()
+    result = await replay(records, in_process_sender(), rate, concurrency)
+    await main.send_digest(force=True)
+    await m.dispatcher.stop()
+    await asyncio.to_thread(m.db_writer.close)
+    return result
+
+
+async def replay_over_http(
+    records: List[Tuple[float, bytes]],
+    url: str,
+    rate: float,
+    concurrency: int,
+    fresh_ids: bool = False,
+) -> ReplayResult:
+    import httpx
+
+    if fresh_ids:
+        records = with_fresh_ids(records, f"-replay-{rate:g}x")
+    async with httpx.AsyncClient(
+        timeout=30, limits=httpx.Limits(max_connections=concurrency)
+    ) as client:
+        return await replay(records, http_sender(client, url), rate, concurrency)
+
+
+def synthesize(
+    path: str, sensors: int, readings_per_event: int, events: int, per_second: float
+) -> int:
+    """Writes a capture of benchmark.generate_events arriving per_second events a second, to replay when there's
+    no captured traffic yet."""
+    payloads = benchmark.generate_events(sensors, readings_per_event, events)
+    return write_capture(
+        path, ((i / per_second, orjson.dumps(p)) for i, p in enumerate(payloads))
+    )
+
+
+def serve(host: str, port: int, latency: float):
+    """Runs the app under uvicorn with in-memory storage and no SMS, as a target for `--url`."""
+    import uvicorn  # type: ignore
+
+    benchmark.install_stand_ins(latency)
+    uvicorn.run(main.app, host=host, port=port, log_level="warning")
+
+
+def _float_list(value: str) -> List[float]:
+    return [float(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replays captured webhook traffic to find the event rate the app saturates at."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="replay a capture file")
+    run.add_argument("capture", help="file written with CAPTURE_PATH set")
+    run.add_argument(
+        "--rates",
+        type=_float_list,
+        default=[1.0],
+        help="multiples of the captured rate, 0 for as fast as possible",
+    )
+    run.add_argument("--concurrency", type=int, default=10)
+    run.add_argument(
+        "--url", help="webhook URL of a running server, else replays in process"
+    )
+    run.add_argument(
+        "--fresh-ids",
+        action="store_true",
+        help="change event ids so a server doesn't drop the replay as duplicates",
+    )
+    run.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0.0,
+        help="simulated latency of each storage call and SMS in process",
+    )
+    run.add_argument("--json", action="store_true", help="print results as JSON")
+
+    synthetic = commands.add_parser(
+        "synthesize", help="write a capture of synthetic events"
+    )
+    synthetic.add_argument("capture")
+    synthetic.add_argument("--sensors", type=int, default=100)
+    synthetic.add_argument("--readings", type=int, default=10)
+    synthetic.add_argument("--events", type=int, default=1000)
+    synthetic.add_argument("--per-second", type=float, default=10.0)
+
+    server = commands.add_parser(
+        "serve", help="run the app with in-memory storage and no SMS"
+    )
+    server.add_argument("--host", default="127.0.0.1")
+    server.add_argument("--port", type=int, default=8000)
+    server.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    benchmark.use_stand_in_env()
+
+    if args.command == "synthesize":
+        count = synthesize(
+            args.capture, args.sensors, args.readings, args.events, args.per_second
+        )
+        print(f"wrote {count} events to {args.capture}")
+        raise SystemExit
+    if args.command == "serve":
+        serve(args.host, args.port, args.latency_ms / 1000)
+        raise SystemExit
+
+    records = list(read_capture(args.capture))
+    results = [
+        asyncio.run(
+            replay_over_http(records, args.url, rate, args.concurrency, args.fresh_ids)
+            if args.url
+            else replay_in_process(
+                records, rate, args.concurrency, args.latency_ms / 1000
+            )
+        )
+        for rate in args.rates
+    ]
+    if args.json:
+        print(json.dumps([asdict(r) for r in results], indent=2))
+    else:
+        columns = list(asdict(results[0]))
+        print("  ".join(columns))
+        for result in results:
+            print(
+                "  ".join(
+                    f"{v!s:>{len(c)}}" for c, v in zip(columns, asdict(result).values())
+                )
+            )
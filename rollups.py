@@ -0,0 +1,185 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from constants import ROLLUP_RETENTION, RollupResolution
+
+
+class RollupRing:
+    """Fixed number of consecutive time buckets of min/max/sum/count for one sensor at one resolution.
+    Bucket slots are reused round robin, so the newest size buckets are kept and updates are O(1).
+
+    Args:
+        resolution (int): Bucket width in seconds
+        size (int): Number of buckets kept
+    """
+
+    def __init__(self, resolution: int, size: int):
+        self.resolution = resolution
+        self.size = size
+        self.starts = np.full(size, -1, dtype=np.int64)
+        self.count = np.zeros(size, dtype=np.int64)
+        self.total = np.zeros(size)
+        self.minimum = np.full(size, np.inf)
+        self.maximum = np.full(size, -np.inf)
+        self.newest = -1
+
+    def add(self, datetime: int, value: float):
+        bucket = datetime // self.resolution
+        if bucket <= self.newest - self.size:
+            # older than anything kept
+            return
+        slot = bucket % self.size
+        start = bucket * self.resolution
+        if self.starts[slot] != start:
+            self.starts[slot] = start
+            self.count[slot] = 0
+            self.total[slot] = 0.0
+            self.minimum[slot] = np.inf
+            self.maximum[slot] = -np.inf
+        self.count[slot] += 1
+        self.total[slot] += value
+        if value < self.minimum[slot]:
+            self.minimum[slot] = value
+        if value > self.maximum[slot]:
+            self.maximum[slot] = value
+        self.newest = max(self.newest, bucket)
+
+    def retains(self, start: int) -> bool:
+        """True if buckets from start onwards haven't been overwritten."""
+        return start // self.resolution > self.newest - self.size
+
+    def buckets(
+        self, start: int, end: int
+    ) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the start of the first bucket, then count, total, minimum and maximum of each bucket overlapping
+        [start, end), empty buckets included. Only the retained buckets are returned, so the arrays are at most
+        size long however long the range is.
+        """
+        first = max(start // self.resolution, self.newest - self.size + 1)
+        last = min((end - 1) // self.resolution, self.newest)
+        buckets = np.arange(first, max(first, last + 1))
+        slots = buckets % self.size
+        present = self.starts[slots] == buckets * self.resolution
+        return (
+            first * self.resolution,
+            np.where(present, self.count[slots], 0),
+            np.where(present, self.total[slots], 0.0),
+            np.where(present, self.minimum[slots], np.inf),
+            np.where(present, self.maximum[slots], -np.inf),
+        )
+
+
+@dataclass
+class RollupIndex:
+    """Per sensor minute, hour and day rollups of readings, updated as readings arrive so that range queries
+    never scan raw readings. Retention per resolution is set by ROLLUP_RETENTION.
+    """
+
+    retention: Dict[int, int] = field(
+        default_factory=lambda: {int(r): n for r, n in ROLLUP_RETENTION.items()}
+    )
+    rings: Dict[str, Dict[int, RollupRing]] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, sensor_name: str, datetime: int, sensor_reading: float):
+        with self._lock:
+            rings = self.rings.get(sensor_name)
+            if rings is None:
+                rings = self.rings[sensor_name] = {
+                    r: RollupRing(r, n) for r, n in self.retention.items()
+                }
+            for ring in rings.values():
+                ring.add(datetime, sensor_reading)
+
+    def load_archive(self, archive) -> int:
+        """Rebuilds rollups from a segments.SegmentStore, e.g. at startup.
+
+        Returns:
+            int: Number of readings loaded
+        """
+        loaded = 0
+        for sensor_name in archive.sensors():
+            records = archive.scan(sensor_name)
+            for datetime, sensor_reading in zip(
+                records["datetime"].tolist(), records["sensor_reading"].tolist()
+            ):
+                self.add(sensor_name, datetime, sensor_reading)
+            loaded += len(records)
+        return loaded
+
+    def choose_resolution(
+        self, sensor_name: str, start: int, end: int, step: int
+    ) -> int:
+        """Picks the coarsest resolution whose buckets line up with start, end and step and that still
+        holds start. Falls back to the finest retained resolution dividing step, with start and end
+        rounded out to its buckets, then to the finest retained resolution.
+        """
+        rings = self.rings.get(sensor_name, {})
+        resolutions = sorted(self.retention)
+        for r in reversed(resolutions):
+            if (
+                step % r == 0
+                and start % r == 0
+                and end % r == 0
+                and (r not in rings or rings[r].retains(start))
+            ):
+                return r
+        retained = [r for r in resolutions if r not in rings or rings[r].retains(start)]
+        for r in retained:
+            if step % r == 0:
+                return r
+        # nothing fine enough is kept for the whole range, buckets come back coarser than step
+        return retained[0] if retained else resolutions[-1]
+
+    def query(
+        self, sensor_name: str, start: int, end: int, step: Optional[int] = None
+    ) -> Tuple[int, List[dict]]:
+        """Aggregates a sensor's readings in [start, end) into buckets of step seconds.
+
+        Args:
+            sensor_name (str): Name of sensor
+            start (int): Unix time of the first bucket
+            end (int): Unix time the last bucket ends, exclusive
+            step (int, optional): Bucket width in seconds. Defaults to one bucket for the whole range.
+
+        Raises:
+            ValueError: The range is empty or step isn't positive
+
+        Returns:
+            Tuple[int, List[dict]]: Rollup resolution used and the non-empty buckets with start, count, min, max and mean
+        """
+        if end <= start:
+            raise ValueError("end must be after start")
+        step = end - start if step is None else step
+        if step <= 0:
+            raise ValueError("step must be positive")
+        resolution = self.choose_resolution(sensor_name, start, end, step)
+        with self._lock:
+            ring = self.rings.get(sensor_name, {}).get(resolution)
+            if ring is None:
+                return resolution, []
+            first, count, total, minimum, maximum = ring.buckets(start, end)
+        if not len(count):
+            return resolution, []
+        # groups the rollup buckets into output buckets of step seconds
+        group = (np.arange(len(count)) * resolution + first - start) // step
+        group = np.maximum(group, 0)
+        edges = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        counts = np.add.reduceat(count, edges)
+        totals = np.add.reduceat(total, edges)
+        minimums = np.minimum.reduceat(minimum, edges)
+        maximums = np.maximum.reduceat(maximum, edges)
+        return resolution, [
+            {
+                "start": start + int(group[e]) * step,
+                "count": int(c),
+                "min": float(lo),
+                "max": float(hi),
+                "mean": float(t / c),
+            }
+            for e, c, t, lo, hi in zip(edges, counts, totals, minimums, maximums)
+            if c
+        ]
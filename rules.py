@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+
+from decouple import config  # type: ignore
+
+from constants import DEFAULT_THRESHOLDS, THRESHOLD_NAMES, SensorConfig, SensorTypes
+from geo import Region
+
+# JSON file of threshold overrides, the defaults in constants.DEFAULT_THRESHOLDS apply if it doesn't exist
+RULES_PATH = config("RULES_PATH", default="rules.json")
+
+
+@dataclass(frozen=True)
+class RegionRule:
+    """Thresholds on the average latest reading of the sensors of one type in a region, see model.evaluate_regions."""
+
+    name: str
+    region: Region
+    sensor_config: SensorConfig
+
+    @property
+    def sensor_name(self) -> str:
+        # regions are alerted on like sensors, under a name that can't clash with a sensor's
+        return f"region:{self.name}"
+
+
+@dataclass(frozen=True)
+class RuleTable:
+    """Compiled rules, one shared SensorConfig per sensor type and per overridden (sensor_type, sensor_name),
+    and the region rules."""
+
+    by_type: Mapping[SensorTypes, SensorConfig]
+    by_sensor: Mapping[Tuple[SensorTypes, str], SensorConfig]
+    regions: Tuple[RegionRule, ...] = ()
+
+    def lookup(self, sensor_type: SensorTypes, sensor_name: str) -> SensorConfig:
+        return (
+            self.by_sensor.get((sensor_type, sensor_name)) or self.by_type[sensor_type]
+        )
+
+
+def _sensor_type(name: str) -> SensorTypes:
+    try:
+        return SensorTypes[name.upper()]
+    except (KeyError, AttributeError):
+        raise ValueError(f"unknown sensor type {name!r}")
+
+
+def _thresholds(base: Mapping[str, float], overrides: dict) -> dict:
+    if not isinstance(overrides, dict):
+        raise ValueError(f"thresholds must be an object, got {overrides!r}")
+    thresholds = dict(base)
+    for name, value in overrides.items():
+        if name not in THRESHOLD_NAMES:
+            raise ValueError(f"unknown threshold {name!r}")
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ValueError(f"threshold {name} must be a number, got {value!r}")
+        thresholds[name] = value
+    return thresholds
+
+
+def _region(rule: dict) -> Region:
+    box, center = rule.pop("box", None), rule.pop("center", None)
+    try:
+        return Region(
+            box=tuple(box) if box is not None else None,  # type: ignore
+            center=tuple(center) if center is not None else None,  # type: ignore
+            radius_km=rule.pop("radius_km", 0.0),
+        )
+    except TypeError:
+        raise ValueError(f"invalid region {box or center!r}")
+
+
+def _section(rules: dict, name: str, kind: type):
+    section = rules.get(name, kind())
+    if not isinstance(section, kind):
+        raise ValueError(
+            f"{name} must be {'an object' if kind is dict else 'a list'}, got {section!r}"
+        )
+    return section
+
+
+def compile_rules(rules: dict) -> RuleTable:
+    """Compiles the contents of a rules file, e.g.
+
+        {
+            "types": {"temperature": {"single_reading": 85}},
+            "sensors": [{"sensor_name": "arduino_1", "sensor_type": "temperature", "average": 75}],
+            "regions": [
+                {"name": "warehouse", "sensor_type": "temperature", "box": [45.5, -122.7, 45.6, -122.6], "average": 75},
+                {"name": "depot", "sensor_type": "humidity", "center": [45.52, -122.68], "radius_km": 5}
+            ]
+        }
+
+    Thresholds under "types" replace DEFAULT_THRESHOLDS for every sensor of that type, and each entry of
+    "sensors" replaces thresholds of one sensor on top of its type's. Thresholds that aren't given are kept.
+    Each entry of "regions" applies its type's thresholds, with any given replaced, to the average latest
+    reading of the sensors of that type in a box ([south, west, north, east]) or within radius_km of a center.
+
+    Raises:
+        ValueError: The rules aren't shaped as above, name an unknown sensor type or threshold, a threshold
+            isn't a number or a region isn't valid
+
+    Returns:
+        RuleTable: Compiled rules
+    """
+    if not isinstance(rules, dict):
+        raise ValueError("rules must be an object")
+    types = {sensor_type: dict(t) for sensor_type, t in DEFAULT_THRESHOLDS.items()}
+    for name, overrides in _section(rules, "types", dict).items():
+        sensor_type = _sensor_type(name)
+        types[sensor_type] = _thresholds(types[sensor_type], overrides)
+    by_type = {t: SensorConfig(t, thresholds) for t, thresholds in types.items()}
+
+    by_sensor = {}
+    for rule in _section(rules, "sensors", list):
+        if not isinstance(rule, dict):
+            raise ValueError(f"sensor rule must be an object, got {rule!r}")
+        overrides = dict(rule)
+        try:
+            sensor_name = overrides.pop("sensor_name")
+            sensor_type = _sensor_type(overrides.pop("sensor_type"))
+        except KeyError as e:
+            raise ValueError(f"sensor rule {rule!r} is missing {e}")
+        by_sensor[sensor_type, sensor_name] = SensorConfig(
+            sensor_type, _thresholds(types[sensor_type], overrides)
+        )
+
+    regions = []
+    for rule in _section(rules, "regions", list):
+        if not isinstance(rule, dict):
+            raise ValueError(f"region rule must be an object, got {rule!r}")
+        overrides = dict(rule)
+        try:
+            name = str(overrides.pop("name"))
+            sensor_type = _sensor_type(overrides.pop("sensor_type"))
+        except KeyError as e:
+            raise ValueError(f"region rule {rule!r} is missing {e}")
+        region = _region(overrides)
+        regions.append(
+            RegionRule(
+                name,
+                region,
+                SensorConfig(sensor_type, _thresholds(types[sensor_type], overrides)),
+            )
+        )
+    return RuleTable(
+        MappingProxyType(by_type), MappingProxyType(by_sensor), tuple(regions)
+    )
+
+
+class SensorRules:
+    """Thresholds of every sensor, compiled from the rules file at path. reload_if_changed() recompiles the file
+    when it has changed and swaps in the new table as a whole, so a reading is never evaluated against half a
+    reload. An invalid file is logged and the previous table is kept.
+
+    Args:
+        path (str, optional): Rules file. Defaults to RULES_PATH.
+    """
+
+    def __init__(self, path: str = RULES_PATH):
+        self.path = path
+        self.table = compile_rules({})
+        self._stamp: Optional[tuple] = None
+        self.loaded = False
+
+    def lookup(self, sensor_type: SensorTypes, sensor_name: str) -> SensorConfig:
+        if not self.loaded:
+            self.reload_if_changed()
+        return self.table.lookup(sensor_type, sensor_name)
+
+    @property
+    def regions(self) -> Tuple[RegionRule, ...]:
+        if not self.loaded:
+            self.reload_if_changed()
+        return self.table.regions
+
+    def reload_if_changed(self) -> bool:
+        """Compiles the rules file if it changed since the last call.
+
+        Returns:
+            bool: True if a new table was swapped in
+        """
+        self.loaded = True
+        try:
+            stat = os.stat(self.path)
+            stamp: Optional[tuple] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        try:
+            rules = {}
+            if stamp is not None:
+                with open(self.path) as f:
+                    rules = json.load(f)
+            table = compile_rules(rules)
+        except (OSError, ValueError) as e:
+            logging.error("keeping previous rules, %s is invalid: %s", self.path, e)
+            return False
+        self.table = table
+        logging.debug(
+            "loaded rules from %s, %s sensor overrides", self.path, len(table.by_sensor)
+        )
+        return True
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from constants import AlertTiming, NotificationType
+from shared import MemorySharedState, SharedState
+
+if TYPE_CHECKING:
+    from model import ParsedReading
+
+
+@dataclass
+class PendingAlert:
+    """A notification waiting for the next digest. recovered is set when the condition has cleared."""
+
+    reading: "ParsedReading"
+    notification_type: NotificationType
+    recovered: bool = False
+
+
+@dataclass
+class NotificationScheduler:
+    """Decides which evaluated notifications are sent, across webhook events. Active conditions are tracked per
+    (sensor_name, NotificationType): a condition that is still active isn't alerted on again until cooldown has
+    passed, and a "recovered" alert is queued once a sensor's reading no longer meets it. Pending alerts from
+    every sensor and event are sent together as one digest at most once per digest_interval.
+    Active conditions are kept in state, so with a shared state a condition is alerted on by one worker only.
+    Pending alerts and digests stay with the worker that queued them.
+
+    Args:
+        cooldown (float, optional): Seconds before an active condition is alerted on again. Defaults to AlertTiming.NOTIFICATION_COOLDOWN.
+        digest_interval (float, optional): Minimum seconds between digests. Defaults to AlertTiming.DIGEST_INTERVAL.
+        state (SharedState, optional): Holds the active conditions. Defaults to a MemorySharedState.
+    """
+
+    cooldown: float = AlertTiming.NOTIFICATION_COOLDOWN.value
+    digest_interval: float = AlertTiming.DIGEST_INTERVAL.value
+    state: SharedState = field(default_factory=MemorySharedState)
+    pending: List[PendingAlert] = field(default_factory=list)
+    last_digest: float = float("-inf")
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def observe(
+        self,
+        parsed_readings: Iterable["ParsedReading"],
+        notifications: Iterable[Tuple["ParsedReading", NotificationType]],
+        now: Optional[float] = None,
+    ):
+        """Queues alerts for new conditions and recoveries for conditions that cleared.
+
+        Args:
+            parsed_readings (Iterable[ParsedReading]): Every reading of the event, used to detect recoveries
+            notifications (Iterable[Tuple[ParsedReading, NotificationType]]): Notifications from Notifications.evaluate_for_notify
+            now (float, optional): Unix time of the observation. Defaults to time.time().
+        """
+        if now is None:
+            now = time.time()
+        current = {
+            (reading.sensor_name, notification_type): reading
+            for reading, notification_type in notifications
+            if notification_type != NotificationType.NOOP
+        }
+        latest = {reading.sensor_name: reading for reading in parsed_readings}
+        alerts = []
+        for (sensor_name, notification_type), reading in current.items():
+            if self.state.claim_alert(
+                sensor_name, notification_type.value, now, self.cooldown
+            ):
+                alerts.append(PendingAlert(reading, notification_type))
+            else:
+                logging.debug("suppressed %s %s", sensor_name, notification_type)
+        for sensor_name, reading in latest.items():
+            keep = [t.value for name, t in current if name == sensor_name]
+            for cleared in self.state.clear_alerts(sensor_name, keep):
+                alerts.append(
+                    PendingAlert(reading, NotificationType(cleared), recovered=True)
+                )
+        with self._lock:
+            self.pending.extend(alerts)
+
+    @property
+    def active(self) -> Dict[Tuple[str, NotificationType], float]:
+        """Last alert time of every active (sensor_name, NotificationType)."""
+        return {
+            (sensor_name, NotificationType(notification_type)): alerted_at
+            for (
+                sensor_name,
+                notification_type,
+            ), alerted_at in self.state.active_alerts().items()
+        }
+
+    def flush(
+        self, now: Optional[float] = None, force: bool = False
+    ) -> List[PendingAlert]:
+        """Takes the pending alerts if a digest is due.
+
+        Args:
+            now (float, optional): Unix time of the flush. Defaults to time.time().
+            force (bool, optional): Ignore digest_interval, e.g. on shutdown. Defaults to False.
+
+        Returns:
+            List[PendingAlert]: Alerts to send in one digest, empty if none are pending or a digest was sent too recently
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if not self.pending or (
+                not force and now - self.last_digest < self.digest_interval
+            ):
+                return []
+            alerts, self.pending = self.pending, []
+            self.last_digest = now
+            return alerts
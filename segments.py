@@ -0,0 +1,267 @@
+import argparse
+import fcntl
+import heapq
+import logging
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+# fixed-width record of a ParsedReading, 25 bytes instead of a JSON document per reading
+RECORD_DTYPE = np.dtype(
+    [
+        ("datetime", "<i8"),
+        ("sensor_reading", "<f8"),
+        ("recent_average", "<f8"),
+        ("sensor_type", "u1"),
+    ]
+)
+
+MAGIC = b"HTSEG001"
+HEADER_SIZE = 16
+# header byte set once a record is appended out of datetime order, cleared by compact()
+FLAGS_OFFSET = len(MAGIC)
+UNSORTED = 1
+SUFFIX = ".seg"
+# taken by every process writing to a segment directory, see SegmentStore
+LOCK_FILE = ".lock"
+
+
+class SegmentStore:
+    """Append-only archive of reading history with one segment file per sensor. Each file is a 16 byte header
+    followed by packed RECORD_DTYPE records and is read through mmap, so scans return NumPy views of the file
+    without copying or decoding. Range scans binary search on datetime while a segment is in order.
+
+    Several workers, and `python segments.py`, can write to the same directory. Appends and compaction hold an
+    flock on its lock file, and each append opens its segment with O_APPEND, so writers never overwrite each
+    other's records or append to a segment that compaction has replaced. A partial record left at the end of a
+    segment by a crash is truncated before the next append.
+
+    Args:
+        root (str): Directory holding the segment files
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_fd: Optional[int] = None
+
+    def path(self, sensor_name: str) -> str:
+        return os.path.join(self.root, quote(sensor_name, safe="") + SUFFIX)
+
+    def sensors(self) -> List[str]:
+        return sorted(
+            unquote(f[: -len(SUFFIX)])
+            for f in os.listdir(self.root)
+            if f.endswith(SUFFIX)
+        )
+
+    def append(self, items: Iterable[dict]) -> int:
+        """Appends readings to their sensors' segments.
+
+        Args:
+            items (Iterable[dict]): Readings as returned by ParsedReading.parse_for_db_save() or stored in all_readings_db
+
+        Returns:
+            int: Number of records appended
+        """
+        by_sensor: Dict[str, list] = {}
+        for item in items:
+            by_sensor.setdefault(item["sensor_name"], []).append(
+                (
+                    item["datetime"],
+                    item["sensor_reading"],
+                    item["recent_average"],
+                    item["sensor_type"],
+                )
+            )
+        with self._writing():
+            for sensor_name, rows in by_sensor.items():
+                records = np.array(rows, dtype=RECORD_DTYPE)
+                fd, last = self._open(sensor_name)
+                try:
+                    if (last is not None and records["datetime"][0] < last) or (
+                        np.diff(records["datetime"]) < 0
+                    ).any():
+                        self._set_flags(sensor_name, UNSORTED)
+                    os.write(fd, records.tobytes())
+                finally:
+                    os.close(fd)
+        return sum(len(rows) for rows in by_sensor.values())
+
+    def scan(
+        self,
+        sensor_name: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> np.ndarray:
+        """Returns a sensor's records with start <= datetime <= end. The result is a view of the mapped file
+        while the segment is in datetime order, and a copy otherwise.
+
+        Args:
+            sensor_name (str): Name of sensor
+            start (int, optional): First unix time to include. Defaults to the start of the segment.
+            end (int, optional): Last unix time to include. Defaults to the end of the segment.
+
+        Returns:
+            np.ndarray: Records of RECORD_DTYPE
+        """
+        records, ordered = self._map(sensor_name)
+        if ordered:
+            lo = 0 if start is None else np.searchsorted(records["datetime"], start)
+            hi = (
+                len(records)
+                if end is None
+                else np.searchsorted(records["datetime"], end, side="right")
+            )
+            return records[lo:hi]
+        mask = np.ones(len(records), dtype=bool)
+        if start is not None:
+            mask &= records["datetime"] >= start
+        if end is not None:
+            mask &= records["datetime"] <= end
+        return np.sort(records[mask], order="datetime", kind="stable")
+
+    def replay(
+        self, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Iterator[Tuple[str, np.void]]:
+        """Yields (sensor_name, record) for every sensor in datetime order, merging the segments lazily."""
+        streams = [self._stream(name, start, end) for name in self.sensors()]
+        for _, name, record in heapq.merge(*streams, key=lambda s: s[0]):
+            yield name, record
+
+    def _stream(
+        self, sensor_name: str, start: Optional[int], end: Optional[int]
+    ) -> Iterator[Tuple[int, str, np.void]]:
+        for record in self.scan(sensor_name, start, end):
+            yield int(record["datetime"]), sensor_name, record
+
+    def compact(self, sensor_name: str):
+        """Rewrites a segment in datetime order so that scans can binary search again."""
+        with self._writing():
+            records = self.scan(sensor_name)
+            path = self.path(sensor_name)
+            with open(path + ".tmp", "wb") as f:
+                f.write(MAGIC.ljust(HEADER_SIZE, b"\0"))
+                f.write(records.tobytes())
+            del records
+            os.replace(path + ".tmp", path)
+
+    def close(self):
+        with self._lock:
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    @contextmanager
+    def _writing(self):
+        # the thread lock keeps threads of this process apart, the flock other processes
+        with self._lock:
+            if self._lock_fd is None:
+                self._lock_fd = os.open(
+                    os.path.join(self.root, LOCK_FILE), os.O_RDWR | os.O_CREAT
+                )
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _open(self, sensor_name: str) -> Tuple[int, Optional[int]]:
+        # opened for each append, as another process may have compacted the segment since
+        fd = os.open(self.path(sensor_name), os.O_RDWR | os.O_APPEND | os.O_CREAT)
+        try:
+            size = os.fstat(fd).st_size
+            if size < HEADER_SIZE:
+                os.ftruncate(fd, 0)
+                os.write(fd, MAGIC.ljust(HEADER_SIZE, b"\0"))
+                return fd, None
+            partial = (size - HEADER_SIZE) % RECORD_DTYPE.itemsize
+            if partial:
+                logging.warning(
+                    "truncating a partial record of %s bytes from %s",
+                    partial,
+                    self.path(sensor_name),
+                )
+                size -= partial
+                os.ftruncate(fd, size)
+            if size == HEADER_SIZE or os.pread(fd, 1, FLAGS_OFFSET)[0] & UNSORTED:
+                # nothing to compare against, or already flagged
+                return fd, None
+            last = np.frombuffer(
+                os.pread(fd, RECORD_DTYPE.itemsize, size - RECORD_DTYPE.itemsize),
+                dtype=RECORD_DTYPE,
+            )
+            return fd, int(last["datetime"][0])
+        except BaseException:
+            os.close(fd)
+            raise
+
+    def _set_flags(self, sensor_name: str, flags: int):
+        # pwrite on an O_APPEND descriptor appends on Linux, so the header is written through its own
+        fd = os.open(self.path(sensor_name), os.O_WRONLY)
+        try:
+            os.pwrite(fd, bytes([flags]), FLAGS_OFFSET)
+        finally:
+            os.close(fd)
+
+    def _map(self, sensor_name: str) -> Tuple[np.ndarray, bool]:
+        path = self.path(sensor_name)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=RECORD_DTYPE), True
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            count = (size - HEADER_SIZE) // RECORD_DTYPE.itemsize
+            if count <= 0:
+                return np.empty(0, dtype=RECORD_DTYPE), True
+            # the map stays open for as long as the returned array references it
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a segment file")
+        ordered = not mapped[FLAGS_OFFSET] & UNSORTED
+        return (
+            np.frombuffer(mapped, dtype=RECORD_DTYPE, count=count, offset=HEADER_SIZE),
+            ordered,
+        )
+
+
+def import_store(segments: SegmentStore, store) -> int:
+    """Copies every reading in a ReadingStore, e.g. all_readings_db, into segments, following pagination.
+    Segments are compacted afterwards since stores are paged by key rather than by time.
+
+    Returns:
+        int: Number of readings imported
+    """
+    imported = 0
+    resp = store.fetch()
+    while True:
+        imported += segments.append(
+            i
+            for i in resp.items
+            if i.get("recent_average") is not None and i.get("sensor_name")
+        )
+        logging.debug("imported %s readings from %s", imported, store)
+        if not resp.last:
+            break
+        resp = store.fetch(last=resp.last)
+    for sensor_name in segments.sensors():
+        segments.compact(sensor_name)
+    return imported
+
+
+if __name__ == "__main__":
+    from storage import open_store
+
+    parser = argparse.ArgumentParser(
+        description="Import reading history from a store into segment files."
+    )
+    parser.add_argument("root", help="directory holding the segment files")
+    parser.add_argument("--store", default="therm-all-readings")
+    args = parser.parse_args()
+    count = import_store(SegmentStore(args.root), open_store(args.store))
+    print(f"imported {count} readings into {args.root}")
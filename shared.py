@@ -0,0 +1,339 @@
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Tuple
+
+from decouple import config  # type: ignore
+
+from aggregator import SensorWindow
+
+# "memory" keeps state in the process, "sqlite" shares it between the workers of a host through SHARED_STATE_PATH
+SHARED_STATE = config("SHARED_STATE", default="memory")
+SHARED_STATE_PATH = config("SHARED_STATE_PATH", default="hottoddy-state.db")
+
+
+class SharedState(ABC):
+    """State that every worker serving the app has to agree on: flags such as the arm state, the recent readings
+    window of each sensor and the alert cooldowns of NotificationScheduler. Each method is a single atomic
+    operation so that workers can't interleave within a toggle or a cooldown check, and so that the interface
+    can be implemented by a network store as well as by the local backends below.
+    """
+
+    # whether operations wait on I/O, so that async callers make them off the event loop, see
+    # model.run_with_shared_state
+    blocking: bool = False
+
+    @abstractmethod
+    def get_flag(self, name: str, default: bool) -> bool:
+        """Returns the flag, or default if it was never set."""
+
+    @abstractmethod
+    def set_flag(self, name: str, value: bool):
+        """Sets the flag for every worker."""
+
+    @abstractmethod
+    def toggle_flag(self, name: str, default: bool) -> bool:
+        """Flips the flag, treating an unset flag as default.
+
+        Returns:
+            bool: The new value
+        """
+
+    @abstractmethod
+    def claim(self, name: str, now: float, ttl: float) -> bool:
+        """Claims work that only one worker should do, unless another claimed it less than ttl seconds ago. Claims
+        expire rather than being held for good, so the work is done again by the workers started after a restart.
+
+        Args:
+            name (str): Name of the work
+            now (float): Unix time of the claim
+            ttl (float): Seconds the claim is held for
+
+        Returns:
+            bool: True if the caller should do the work
+        """
+
+    @abstractmethod
+    def add_readings(self, readings: Iterable[Tuple[str, float, float]]):
+        """Adds readings to their sensors' windows.
+
+        Args:
+            readings (Iterable[Tuple[str, float, float]]): (sensor_name, expires_at, sensor_reading) of each reading
+        """
+
+    @abstractmethod
+    def window(self, sensor_name: str, now: float) -> Tuple[float, int]:
+        """Returns the sum and count of a sensor's readings that expire after now."""
+
+    @abstractmethod
+    def has_readings(self, now: float) -> bool:
+        """Returns whether any sensor has readings that expire after now."""
+
+    @abstractmethod
+    def claim_alert(
+        self, sensor_name: str, notification_type: int, now: float, cooldown: float
+    ) -> bool:
+        """Marks a condition as alerted at now, unless it was already alerted on less than cooldown seconds ago.
+
+        Args:
+            sensor_name (str): Name of sensor
+            notification_type (int): NotificationType value
+            now (float): Unix time of the alert
+            cooldown (float): Seconds before a condition is alerted on again
+
+        Returns:
+            bool: True if the caller should send the alert
+        """
+
+    @abstractmethod
+    def clear_alerts(self, sensor_name: str, keep: Iterable[int]) -> List[int]:
+        """Clears a sensor's active conditions except those in keep, as they've recovered.
+
+        Returns:
+            List[int]: NotificationType values of the cleared conditions
+        """
+
+    @abstractmethod
+    def active_alerts(self) -> Dict[Tuple[str, int], float]:
+        """Returns the last alert time of every active (sensor_name, NotificationType value)."""
+
+
+class MemorySharedState(SharedState):
+    """SharedState for a single worker, kept in the process."""
+
+    def __init__(self):
+        self.flags: Dict[str, bool] = {}
+        self.claims: Dict[str, float] = {}
+        self.windows: Dict[str, SensorWindow] = {}
+        self.alerts: Dict[Tuple[str, int], float] = {}
+        self._lock = threading.Lock()
+
+    def get_flag(self, name, default):
+        return self.flags.get(name, default)
+
+    def set_flag(self, name, value):
+        self.flags[name] = value
+
+    def toggle_flag(self, name, default):
+        with self._lock:
+            value = self.flags[name] = not self.flags.get(name, default)
+            return value
+
+    def claim(self, name, now, ttl):
+        with self._lock:
+            claimed_at = self.claims.get(name)
+            if claimed_at is not None and now - claimed_at < ttl:
+                return False
+            self.claims[name] = now
+            return True
+
+    def add_readings(self, readings):
+        with self._lock:
+            for sensor_name, expires_at, sensor_reading in readings:
+                self.windows.setdefault(sensor_name, SensorWindow()).append(
+                    expires_at, sensor_reading
+                )
+
+    def window(self, sensor_name, now):
+        with self._lock:
+            window = self.windows.setdefault(sensor_name, SensorWindow())
+            window.evict(now)
+            return window.total, len(window.entries)
+
+    def has_readings(self, now):
+        with self._lock:
+            return any(
+                window.entries and window.entries[-1][0] > now
+                for window in self.windows.values()
+            )
+
+    def claim_alert(self, sensor_name, notification_type, now, cooldown):
+        key = (sensor_name, notification_type)
+        with self._lock:
+            last_sent = self.alerts.get(key)
+            if last_sent is not None and now - last_sent < cooldown:
+                return False
+            self.alerts[key] = now
+            return True
+
+    def clear_alerts(self, sensor_name, keep):
+        keep = set(keep)
+        with self._lock:
+            cleared = [
+                key
+                for key in self.alerts
+                if key[0] == sensor_name and key[1] not in keep
+            ]
+            for key in cleared:
+                del self.alerts[key]
+        return [key[1] for key in cleared]
+
+    def active_alerts(self):
+        with self._lock:
+            return dict(self.alerts)
+
+
+class SqliteSharedState(SharedState):
+    """SharedState for the workers of one host, in a SQLite file in WAL mode. Each operation is one statement
+    or one transaction, so concurrent workers see each other's changes immediately. Operations can wait on the
+    disk and on other workers' transactions, so they're blocking.
+
+    Args:
+        path (str, optional): Database file. Defaults to SHARED_STATE_PATH.
+        purge_interval (int, optional): Minimum seconds between purges of expired window readings. Defaults to 60.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str = SHARED_STATE_PATH, purge_interval: int = 60):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._last_purge = 0.0
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS flags (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS claims (name TEXT PRIMARY KEY, claimed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS windows (sensor_name TEXT NOT NULL, expires_at REAL NOT NULL, sensor_reading REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS windows_sensor_name_expires_at ON windows (sensor_name, expires_at)"
+            )
+            conn.execute("""CREATE TABLE IF NOT EXISTS alerts (
+                    sensor_name TEXT NOT NULL,
+                    notification_type INTEGER NOT NULL,
+                    alerted_at REAL NOT NULL,
+                    PRIMARY KEY (sensor_name, notification_type)
+                )""")
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, as in storage.SqliteStore
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_flag(self, name, default):
+        row = (
+            self._connection()
+            .execute("SELECT value FROM flags WHERE name = ?", (name,))
+            .fetchone()
+        )
+        return default if row is None else bool(row[0])
+
+    def set_flag(self, name, value):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO flags VALUES (?, ?)", (name, int(value))
+            )
+
+    def toggle_flag(self, name, default):
+        with self._connection() as conn:
+            return bool(
+                conn.execute(
+                    """INSERT INTO flags VALUES (?, ?)
+                    ON CONFLICT (name) DO UPDATE SET value = NOT value
+                    RETURNING value""",
+                    (name, int(not default)),
+                ).fetchone()[0]
+            )
+
+    def claim(self, name, now, ttl):
+        with self._connection() as conn:
+            return (
+                conn.execute(
+                    """INSERT INTO claims VALUES (?, ?)
+                    ON CONFLICT (name) DO UPDATE SET claimed_at = excluded.claimed_at
+                    WHERE excluded.claimed_at - claimed_at >= ?""",
+                    (name, now, ttl),
+                ).rowcount
+                == 1
+            )
+
+    def add_readings(self, readings):
+        with self._connection() as conn:
+            conn.executemany("INSERT INTO windows VALUES (?, ?, ?)", readings)
+        if time.time() - self._last_purge >= self.purge_interval:
+            self.purge_expired()
+
+    def window(self, sensor_name, now):
+        total, count = (
+            self._connection()
+            .execute(
+                "SELECT TOTAL(sensor_reading), COUNT(*) FROM windows WHERE sensor_name = ? AND expires_at > ?",
+                (sensor_name, now),
+            )
+            .fetchone()
+        )
+        return total, count
+
+    def has_readings(self, now):
+        return (
+            self._connection()
+            .execute("SELECT 1 FROM windows WHERE expires_at > ? LIMIT 1", (now,))
+            .fetchone()
+            is not None
+        )
+
+    def purge_expired(self) -> int:
+        """Deletes window readings that have expired.
+
+        Returns:
+            int: Number of readings deleted
+        """
+        self._last_purge = time.time()
+        with self._connection() as conn:
+            return conn.execute(
+                "DELETE FROM windows WHERE expires_at <= ?", (self._last_purge,)
+            ).rowcount
+
+    def claim_alert(self, sensor_name, notification_type, now, cooldown):
+        with self._connection() as conn:
+            return (
+                conn.execute(
+                    """INSERT INTO alerts VALUES (?, ?, ?)
+                    ON CONFLICT (sensor_name, notification_type) DO UPDATE SET alerted_at = excluded.alerted_at
+                    WHERE excluded.alerted_at - alerted_at >= ?""",
+                    (sensor_name, notification_type, now, cooldown),
+                ).rowcount
+                == 1
+            )
+
+    def clear_alerts(self, sensor_name, keep):
+        keep = list(keep)
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"""DELETE FROM alerts WHERE sensor_name = ?
+                AND notification_type NOT IN ({", ".join("?" * len(keep))})
+                RETURNING notification_type""",
+                [sensor_name, *keep],
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def active_alerts(self):
+        rows = self._connection().execute("SELECT * FROM alerts").fetchall()
+        return {(name, notification_type): at for name, notification_type, at in rows}
+
+
+def open_shared_state(backend: str = SHARED_STATE) -> SharedState:
+    """Opens the shared state backend set with the SHARED_STATE environment variable.
+
+    Args:
+        backend (str, optional): "memory" or "sqlite". Defaults to SHARED_STATE.
+
+    Returns:
+        SharedState: State shared by every worker using the same backend
+    """
+    if backend == "memory":
+        return MemorySharedState()
+    elif backend == "sqlite":
+        return SqliteSharedState()
+    raise ValueError(f"unknown shared state backend {backend!r}")
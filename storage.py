@@ -0,0 +1,510 @@
+import heapq
+import json
+import logging
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from decouple import config  # type: ignore
+
+import metrics
+
+STORAGE_BACKEND = config("STORAGE_BACKEND", default="deta")
+SQLITE_PATH = config("SQLITE_PATH", default="hottoddy.db")
+
+# Deta Base limits
+PUT_MANY_LIMIT = 25
+FETCH_LIMIT = 1000
+
+Query = Union[dict, List[dict], None]
+
+
+@dataclass
+class FetchResponse:
+    """One page of results, mirroring deta's FetchResponse. Pass last to the next fetch to get the following page."""
+
+    items: List[dict] = field(default_factory=list)
+    last: Optional[str] = None
+
+    @property
+    def count(self) -> int:
+        return len(self.items)
+
+
+class ReadingStore(ABC):
+    """Storage interface used by ingest, the recent readings cache and SMS commands.
+    Follows the deta Base API so that queries are written the same way for every backend:
+    a query is a dict of conditions that must all match, or a list of such dicts of which any may match.
+    Conditions are either "field": value for equality or "field?op": value where op is one of
+    gt, gte, lt, lte, ne, r (inclusive range given as [low, high]) or pfx (string prefix).
+    """
+
+    name: str
+
+    @abstractmethod
+    def put(
+        self, data: dict, key: Optional[str] = None, *, expire_in: Optional[int] = None
+    ) -> dict:
+        """Inserts or replaces a single item. Items without a key are given a random one.
+
+        Returns:
+            dict: The stored item, including its key
+        """
+
+    @abstractmethod
+    def put_many(self, items: List[dict], *, expire_in: Optional[int] = None) -> dict:
+        """Inserts or replaces several items at once.
+
+        Returns:
+            dict: {"processed": {"items": [...]}} as returned by deta
+        """
+
+    @abstractmethod
+    def fetch(
+        self,
+        query: Query = None,
+        *,
+        limit: int = FETCH_LIMIT,
+        last: Optional[str] = None,
+    ) -> FetchResponse:
+        """Fetches one page of items matching query, ordered by key."""
+
+    def scan(
+        self, query: Query = None, *, page_size: int = FETCH_LIMIT
+    ) -> Iterator[dict]:
+        """Yields every item matching query, fetching one page at a time as the previous one is consumed,
+        so that only a single page is held in memory.
+
+        Args:
+            query (Query, optional): Deta style query, passed to every fetch. Defaults to every item.
+            page_size (int, optional): Items per fetch. Defaults to FETCH_LIMIT.
+
+        Yields:
+            dict: Each matching item, ordered by key
+        """
+        resp = self.fetch(query, limit=page_size)
+        while True:
+            yield from resp.items
+            if not resp.last:
+                return
+            resp = self.fetch(query, limit=page_size, last=resp.last)
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]:
+        """Returns the item stored under key, or None."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Deletes the item stored under key, if any."""
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.name!r})"
+
+
+class DetaStore(ReadingStore):
+    """Hosted deta.sh Base."""
+
+    def __init__(self, name: str, project_key: Optional[str] = None):
+        from deta import Deta  # type: ignore
+
+        self.name = name
+        self._base = Deta(project_key or config("DETA_KEY")).Base(name)  # type: ignore
+
+    def put(self, data, key=None, *, expire_in=None):
+        return self._base.put(data, key, expire_in=expire_in or None)
+
+    def put_many(self, items, *, expire_in=None):
+        processed: List[dict] = []
+        for i in range(0, len(items), PUT_MANY_LIMIT):
+            resp = self._base.put_many(
+                items[i : i + PUT_MANY_LIMIT], expire_in=expire_in or None
+            )
+            processed.extend(resp["processed"]["items"])
+        return {"processed": {"items": processed}}
+
+    def fetch(self, query=None, *, limit=FETCH_LIMIT, last=None):
+        resp = self._base.fetch(query, limit=limit, last=last)
+        return FetchResponse(items=resp.items, last=resp.last)
+
+    def get(self, key):
+        return self._base.get(key)
+
+    def delete(self, key):
+        self._base.delete(key)
+
+
+class SqliteStore(ReadingStore):
+    """Embedded SQLite table in WAL mode. Reading fields that are queried often are kept in indexed columns,
+    everything else is stored as JSON. Items put with expire_in stop being returned once expired and are purged
+    periodically, matching the TTL behaviour of recent_readings_db.
+
+    Args:
+        name (str): Table name
+        path (str, optional): Database file, shared by every store. Defaults to SQLITE_PATH.
+        purge_interval (int, optional): Minimum seconds between purges of expired rows. Defaults to 60.
+    """
+
+    INDEXED_COLUMNS = ("sensor_name", "sensor_type", "datetime")
+    OPERATORS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "ne": "!="}
+
+    def __init__(self, name: str, path: str = SQLITE_PATH, purge_interval: int = 60):
+        if not re.fullmatch(r"[A-Za-z0-9_\-]+", name):
+            raise ValueError(f"invalid table name {name!r}")
+        self.name = name
+        self.path = path
+        self.purge_interval = purge_interval
+        self._table = f'"{name}"'
+        self._local = threading.local()
+        self._last_purge = 0.0
+        with self._connection() as conn:
+            conn.execute(f"""CREATE TABLE IF NOT EXISTS {self._table} (
+                    key TEXT PRIMARY KEY,
+                    sensor_name TEXT,
+                    sensor_type INTEGER,
+                    datetime INTEGER,
+                    expires_at REAL,
+                    data TEXT NOT NULL
+                )""")
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "{name}_sensor_name_datetime" ON {self._table} (sensor_name, datetime)'
+            )
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "{name}_sensor_type_datetime" ON {self._table} (sensor_type, datetime)'
+            )
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "{name}_expires_at" ON {self._table} (expires_at) WHERE expires_at IS NOT NULL'
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, WAL lets readers run alongside the batch writer thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _row(self, data: dict, expire_in: Optional[int]) -> tuple:
+        data = dict(data)
+        key = data.pop("key", None) or secrets.token_hex(6)
+        data.pop("__expires", None)
+        expires_at = time.time() + expire_in if expire_in else None
+        return (
+            key,
+            data.get("sensor_name"),
+            data.get("sensor_type"),
+            data.get("datetime"),
+            expires_at,
+            json.dumps(data),
+        )
+
+    def put(self, data, key=None, *, expire_in=None):
+        return self.put_many(
+            [dict(data, key=key) if key else data], expire_in=expire_in
+        )["processed"]["items"][0]
+
+    def put_many(self, items, *, expire_in=None):
+        rows = [self._row(item, expire_in) for item in items]
+        with self._connection() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self._table} VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+        self._maybe_purge()
+        return {"processed": {"items": [self._item(r[0], r[5], r[4]) for r in rows]}}
+
+    def fetch(self, query=None, *, limit=FETCH_LIMIT, last=None):
+        where, params = self._where(query)
+        clauses = ["(expires_at IS NULL OR expires_at > ?)"]
+        params = [time.time()] + params
+        if where:
+            clauses.append(where)
+        if last is not None:
+            clauses.append("key > ?")
+            params.append(last)
+        rows = (
+            self._connection()
+            .execute(
+                f"SELECT key, data, expires_at FROM {self._table} WHERE {' AND '.join(clauses)} ORDER BY key LIMIT ?",
+                params + [limit + 1],
+            )
+            .fetchall()
+        )
+        more = len(rows) > limit
+        items = [self._item(*row) for row in rows[:limit]]
+        return FetchResponse(items=items, last=items[-1]["key"] if more else None)
+
+    def get(self, key):
+        row = (
+            self._connection()
+            .execute(
+                f"SELECT key, data, expires_at FROM {self._table} WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return self._item(*row) if row else None
+
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+
+    def purge_expired(self) -> int:
+        """Deletes expired rows.
+
+        Returns:
+            int: Number of rows deleted
+        """
+        self._last_purge = time.time()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                f"DELETE FROM {self._table} WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (self._last_purge,),
+            )
+        logging.debug("purged %s expired rows from %s", cursor.rowcount, self)
+        return cursor.rowcount
+
+    def _maybe_purge(self):
+        if time.time() - self._last_purge >= self.purge_interval:
+            self.purge_expired()
+
+    @staticmethod
+    def _item(key: str, data: str, expires_at: Optional[float]) -> dict:
+        item = json.loads(data)
+        item["key"] = key
+        if expires_at is not None:
+            item["__expires"] = int(expires_at)
+        return item
+
+    def _column(self, name: str) -> str:
+        if name in self.INDEXED_COLUMNS or name == "key":
+            return name
+        if not re.fullmatch(r"[A-Za-z0-9_.]+", name):
+            raise ValueError(f"invalid query field {name!r}")
+        return f"json_extract(data, '$.{name}')"
+
+    def _where(self, query: Query) -> tuple[str, list]:
+        """Translates a deta style query into a SQL condition and its parameters."""
+        if not query:
+            return "", []
+        if isinstance(query, list):
+            parts = [self._where(q) for q in query]
+            return (
+                "(" + " OR ".join(f"({p[0] or '1'})" for p in parts) + ")",
+                [param for p in parts for param in p[1]],
+            )
+        conditions: list[str] = []
+        params: list[Any] = []
+        for condition, value in query.items():
+            name, _, op = condition.partition("?")
+            column = self._column(name)
+            if not op:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+            elif op in self.OPERATORS:
+                conditions.append(f"{column} {self.OPERATORS[op]} ?")
+                params.append(value)
+            elif op == "r":
+                conditions.append(f"{column} BETWEEN ? AND ?")
+                params.extend(value)
+            elif op == "pfx":
+                conditions.append(f"substr({column}, 1, ?) = ?")
+                params.extend([len(value), value])
+            else:
+                raise ValueError(f"unsupported query operator {op!r}")
+        return " AND ".join(conditions), params
+
+
+class MemoryStore(ReadingStore):
+    """In-process stand-in for a deta Base, for tests and benchmarks. Every call sleeps for latency seconds to
+    simulate a network round trip and is counted in calls.
+
+    Args:
+        name (str): Name of the store
+        latency (float, optional): Seconds added to every call. Defaults to 0.
+    """
+
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._items: Dict[str, Tuple[dict, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, data, key=None, *, expire_in=None):
+        self._round_trip("put")
+        return self._store([dict(data, key=key) if key else data], expire_in)[0]
+
+    def put_many(self, items, *, expire_in=None):
+        self._round_trip("put_many")
+        return {"processed": {"items": self._store(items, expire_in)}}
+
+    def _store(self, items: List[dict], expire_in: Optional[int]) -> List[dict]:
+        expires_at = time.time() + expire_in if expire_in else None
+        processed = []
+        with self._lock:
+            for item in items:
+                item = dict(item)
+                item.pop("__expires", None)
+                item["key"] = item.get("key") or secrets.token_hex(6)
+                self._items[item["key"]] = (item, expires_at)
+                processed.append(self._item(item, expires_at))
+        return processed
+
+    def fetch(self, query=None, *, limit=FETCH_LIMIT, last=None):
+        self._round_trip("fetch")
+        now = time.time()
+        with self._lock:
+            # only the first page and whether there's another are needed, not every match in order
+            matches = heapq.nsmallest(
+                limit + 1,
+                (
+                    (key, item, expires_at)
+                    for key, (item, expires_at) in self._items.items()
+                    if (expires_at is None or expires_at > now)
+                    and (last is None or key > last)
+                    and match_query(item, query)
+                ),
+                key=lambda match: match[0],
+            )
+        items = [
+            self._item(item, expires_at) for _, item, expires_at in matches[:limit]
+        ]
+        return FetchResponse(
+            items=items, last=items[-1]["key"] if len(matches) > limit else None
+        )
+
+    def get(self, key):
+        self._round_trip("get")
+        item, expires_at = self._items.get(key, (None, None))
+        if item is None or (expires_at is not None and expires_at <= time.time()):
+            return None
+        return self._item(item, expires_at)
+
+    def delete(self, key):
+        self._round_trip("delete")
+        with self._lock:
+            self._items.pop(key, None)
+
+    def _round_trip(self, call: str):
+        self.calls[call] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _item(item: dict, expires_at: Optional[float]) -> dict:
+        item = dict(item)
+        if expires_at is not None:
+            item["__expires"] = int(expires_at)
+        return item
+
+
+class InstrumentedStore(ReadingStore):
+    """Wraps a store to record the duration of every call and the number of items written and fetched,
+    see metrics.STORAGE_SECONDS. Other attributes, e.g. SqliteStore.purge_expired, pass through to the store.
+
+    Args:
+        store (ReadingStore): Store to instrument
+    """
+
+    def __init__(self, store: ReadingStore):
+        self.store = store
+        self.name = store.name
+
+    def put(self, data, key=None, *, expire_in=None):
+        with self._timed("put", 1):
+            return self.store.put(data, key, expire_in=expire_in)
+
+    def put_many(self, items, *, expire_in=None):
+        with self._timed("put_many", len(items)):
+            return self.store.put_many(items, expire_in=expire_in)
+
+    def fetch(self, query=None, *, limit=FETCH_LIMIT, last=None):
+        with self._timed("fetch"):
+            resp = self.store.fetch(query, limit=limit, last=last)
+        metrics.STORAGE_ITEMS.labels(self.name, "fetch").inc(resp.count)
+        metrics.FETCH_SIZE.labels(self.name).observe(resp.count)
+        return resp
+
+    def get(self, key):
+        with self._timed("get"):
+            return self.store.get(key)
+
+    def delete(self, key):
+        with self._timed("delete"):
+            self.store.delete(key)
+
+    def _timed(self, call: str, items: int = 0):
+        if items:
+            metrics.STORAGE_ITEMS.labels(self.name, call).inc(items)
+        return metrics.STORAGE_SECONDS.labels(self.name, call).time()
+
+    def __getattr__(self, name: str):
+        return getattr(self.store, name)
+
+    def __repr__(self) -> str:
+        return repr(self.store)
+
+
+def match_query(item: dict, query: Query) -> bool:
+    """Evaluates a deta style query, see ReadingStore, against a single item."""
+    if not query:
+        return True
+    if isinstance(query, list):
+        return any(match_query(item, q) for q in query)
+    for condition, expected in query.items():
+        name, _, op = condition.partition("?")
+        value: Any = item
+        for part in name.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if not op:
+            matched = value == expected
+        elif value is None:
+            matched = op == "ne" and expected is not None
+        elif op == "gt":
+            matched = value > expected
+        elif op == "gte":
+            matched = value >= expected
+        elif op == "lt":
+            matched = value < expected
+        elif op == "lte":
+            matched = value <= expected
+        elif op == "ne":
+            matched = value != expected
+        elif op == "r":
+            matched = expected[0] <= value <= expected[1]
+        elif op == "pfx":
+            matched = isinstance(value, str) and value.startswith(expected)
+        else:
+            raise ValueError(f"unsupported query operator {op!r}")
+        if not matched:
+            return False
+    return True
+
+
+def open_store(name: str, backend: str = STORAGE_BACKEND) -> ReadingStore:
+    """Opens a store with the configured backend, set with the STORAGE_BACKEND environment variable.
+
+    Args:
+        name (str): Name of the deta Base or SQLite table
+        backend (str, optional): "deta", "sqlite" or "memory". Defaults to STORAGE_BACKEND.
+
+    Returns:
+        ReadingStore: Store for name, instrumented with InstrumentedStore
+    """
+    store: ReadingStore
+    if backend == "deta":
+        store = DetaStore(name)
+    elif backend == "sqlite":
+        store = SqliteStore(name)
+    elif backend == "memory":
+        store = MemoryStore(name)
+    else:
+        raise ValueError(f"unknown storage backend {backend!r}")
+    return InstrumentedStore(store)
@@ -0,0 +1,41 @@
+import pytest  # type: ignore
+
+from aggregator import SensorWindowAggregator
+
+
+@pytest.fixture
+def window() -> SensorWindowAggregator:
+    return SensorWindowAggregator(expiration_seconds=360)
+
+
+def test_average_includes_current_reading(window):
+    window.add("arduino_1", 70, expires_at=1000)
+    window.add("arduino_1", 80, expires_at=1000)
+    window.add("arduino_2", 10, expires_at=1000)
+    assert window.recent_average("arduino_1", 90, now=500) == 80
+    assert window.recent_average("notecard", 42, now=500) == 42
+
+
+def test_expired_readings_are_evicted(window):
+    window.add("arduino_1", 100, expires_at=400)
+    window.add("arduino_1", 50, expires_at=900)
+    assert window.recent_average("arduino_1", 50, now=400) == 50
+    assert window.recent_average("arduino_1", 50, now=900) == 50
+
+
+def test_warm_loads_cache_once():
+    cache = [
+        {"datetime": 10, "sensor_name": "arduino_1", "sensor_reading": 60},
+        {"datetime": 10, "sensor_name": "arduino_1", "sensor_reading": 80},
+        # already expired cache entries are ignored
+        {
+            "datetime": 10,
+            "sensor_name": "arduino_1",
+            "sensor_reading": 1000,
+            "__expires": 1,
+        },
+    ]
+    window = SensorWindowAggregator(expiration_seconds=10**10, loader=lambda: cache)
+    assert window.warm() == 3
+    assert window.warm() == 0
+    assert window.recent_average("arduino_1", 100) == 80
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest  # type: ignore
+
+import benchmark
+import model as m
+
+
+@pytest.fixture
+def stand_ins():
+    """Runs a test against benchmark's in-memory stand-ins and puts model's own objects back afterwards."""
+    with benchmark.stand_ins(0.0) as stores:
+        yield stores
+
+
+def test_benchmark_scenario_runs_offline(stand_ins):
+    result = asyncio.run(
+        benchmark.run_scenario(
+            sensors=5, readings_per_event=3, cache_size=20, events=50
+        )
+    )
+    assert result.events == 50
+    assert result.p50_ms <= result.p99_ms
+    # writes are batched, so far fewer than the two puts per reading made before batching
+    assert 0 < result.round_trips_per_event < 2 * 3
+    assert m.all_readings_db.fetch(limit=1000).count == 150
+
+
+def test_stand_ins_are_removed_afterwards():
+    store, dispatcher = m.all_readings_db, m.dispatcher
+    with benchmark.stand_ins(0.0) as stores:
+        assert m.all_readings_db is stores[0] is not store
+        # replaced again inside the block, as run_scenario does
+        benchmark.install_stand_ins(0.0)
+    assert m.all_readings_db is store and m.dispatcher is dispatcher
+
+
+def test_import_leaves_the_environment_alone():
+    env = {k: v for k, v in os.environ.items() if k not in benchmark.STAND_IN_ENV}
+    code = (
+        "import os, benchmark, replay; "
+        "assert not set(benchmark.STAND_IN_ENV) & set(os.environ), os.environ"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(benchmark.__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,47 @@
+import asyncio
+import json
+
+import pytest  # type: ignore
+
+from bulk import iter_batches, iter_json_records
+
+RECORDS = [{"datetime": i, "event": f"é{i}"} for i in (3, 1, 2)]
+
+
+async def chunked(body: bytes, size: int):
+    for i in range(0, len(body), size):
+        yield body[i : i + size]
+
+
+def parse(body: bytes, size: int) -> list:
+    async def run():
+        return [r async for r in iter_json_records(chunked(body, size))]
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096])
+def test_parses_json_array_across_chunks(size):
+    assert parse(json.dumps(RECORDS, ensure_ascii=False).encode(), size) == RECORDS
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096])
+def test_parses_ndjson_across_chunks(size):
+    body = "\n".join(json.dumps(r, ensure_ascii=False) for r in RECORDS).encode()
+    assert parse(body, size) == RECORDS
+
+
+def test_truncated_array_is_rejected():
+    with pytest.raises(ValueError):
+        parse(json.dumps(RECORDS).encode()[:-3], 5)
+
+
+def test_batches_are_sorted_by_datetime():
+    async def records():
+        for record in RECORDS:
+            yield record
+
+    async def run():
+        return [b async for b in iter_batches(records(), 2)]
+
+    assert [[r["datetime"] for r in b] for b in asyncio.run(run())] == [[1, 3], [2]]
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest  # type: ignore
+
+import main
+import model as m
+from aggregator import SensorWindowAggregator
+from dedup import BloomFilter, SeenEvents
+from latest import LatestReadingIndex
+from outliers import HampelFilter
+from scheduler import NotificationScheduler
+from storage import MemoryStore
+from writer import BatchWriter
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    for i in range(10000):
+        bloom.add(f"event-{i}")
+    assert all(f"event-{i}" in bloom for i in range(10000))
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_keys_are_remembered_after_leaving_the_lru():
+    seen = SeenEvents(lru_size=2, filter_capacity=100)
+    seen.add(f"event-{i}" for i in range(10))
+    assert len(seen._recent) == 2
+    assert seen.unseen(["event-0", "event-9", "event-10"]) == ["event-10"]
+
+
+def test_oldest_filter_generation_is_discarded():
+    seen = SeenEvents(lru_size=1, filter_capacity=20)
+    seen.add(f"event-{i}" for i in range(30))
+    assert "event-29" in seen and "event-15" in seen
+    assert "event-0" not in seen
+
+
+def test_new_keys_are_false_positives_at_about_error_rate():
+    # both generations full, so a new key is checked against two filters at capacity
+    seen = SeenEvents(lru_size=1, filter_capacity=20000, error_rate=0.01)
+    seen.add(f"event-{i}" for i in range(20000))
+    assert seen._previous.count == seen._current.count == 10000
+    false_positives = sum(f"other-{i}" in seen for i in range(20000))
+    assert false_positives < 300
+
+
+@pytest.fixture
+def ingest(monkeypatch) -> MemoryStore:
+    store = MemoryStore("therm-all-readings")
+    monkeypatch.setattr(m, "all_readings_db", store)
+    monkeypatch.setattr(m, "recent_readings_db", MemoryStore("recent_readings"))
+    monkeypatch.setattr(m, "db_writer", BatchWriter())
+    monkeypatch.setattr(m, "seen_events", SeenEvents())
+    monkeypatch.setattr(m, "notification_scheduler", NotificationScheduler())
+    monkeypatch.setattr(
+        m,
+        "latest_readings",
+        LatestReadingIndex(store=MemoryStore("latest_readings"), writer=m.db_writer),
+    )
+    monkeypatch.setattr(m, "recent_window", SensorWindowAggregator())
+    monkeypatch.setattr(m, "recent_outliers", HampelFilter())
+    return store
+
+
+def event(*sensor_names) -> m.SensorLogEvent:
+    return m.SensorLogEvent(
+        datetime=1665021239,
+        event="f3ec6e7b-382b-472b-ad13-c52d7327cf76",
+        best_lat=45.5728875,
+        best_long=-122.66610937499999,
+        readings=[
+            m.SensorLogReading(
+                sensor_name=name, sensor_reading=10, sensor_type=m.SensorTypes(1)
+            )
+            for name in sensor_names
+        ],
+    )
+
+
+def stored_sensor_names(store: MemoryStore) -> list:
+    m.db_writer.flush()
+    return sorted(i["sensor_name"] for i in store.fetch().items)
+
+
+def test_retried_event_is_acknowledged_without_work(ingest):
+    async def deliver():
+        await main.sensor_event(event("arduino_1", "notecard"))
+        # a retry, then a retry with a reading that wasn't in the first delivery
+        retried = event("arduino_1", "notecard")
+        assert await main.sensor_event(retried) == retried
+        await main.sensor_event(event("arduino_1", "notecard", "notecard2"))
+
+    asyncio.run(deliver())
+    assert stored_sensor_names(ingest) == ["arduino_1", "notecard", "notecard2"]
+
+
+def test_retry_during_the_first_delivery_is_dropped(ingest, monkeypatch):
+    process_event = main.process_event
+
+    async def slow_process_event(event):
+        # the first delivery is still being processed when the retry arrives
+        await asyncio.sleep(0.01)
+        return await process_event(event)
+
+    monkeypatch.setattr(main, "process_event", slow_process_event)
+
+    async def deliver():
+        await asyncio.gather(
+            main.sensor_event(event("arduino_1", "notecard")),
+            main.sensor_event(event("arduino_1", "notecard")),
+        )
+
+    asyncio.run(deliver())
+    assert stored_sensor_names(ingest) == ["arduino_1", "notecard"]
+
+
+def test_readings_that_fail_to_process_are_not_marked_seen(ingest, monkeypatch):
+    process_event = main.process_event
+
+    async def failing_process_event(event):
+        raise RuntimeError("evaluation failed")
+
+    monkeypatch.setattr(main, "process_event", failing_process_event)
+    with pytest.raises(RuntimeError):
+        asyncio.run(main.sensor_event(event("arduino_1")))
+    monkeypatch.setattr(main, "process_event", process_event)
+    asyncio.run(main.sensor_event(event("arduino_1")))
+    assert stored_sensor_names(ingest) == ["arduino_1"]
@@ -0,0 +1,257 @@
+import asyncio
+import base64
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest  # type: ignore
+
+import model as m
+from constants import NotificationType, SensorConfig, SensorTypes
+from delivery import (
+    Channel,
+    Deliverer,
+    DeliveryError,
+    Recipient,
+    TwilioChannel,
+    WebhookChannel,
+    compile_recipients,
+    load_recipients,
+)
+from scheduler import PendingAlert
+
+RECIPIENTS = {
+    "groups": {
+        "on-call": [
+            {"channel": "twilio", "address": "+15555550100"},
+            {"channel": "webhook", "address": "https://hooks.example.com/alerts"},
+        ],
+        "facilities": [{"channel": "smtp", "address": "facilities@example.com"}],
+    },
+    "default": ["on-call"],
+    "types": {"airquality": ["facilities"]},
+    "sensors": {"arduino_1": ["on-call", "facilities"]},
+}
+ON_CALL_SMS = Recipient("twilio", "+15555550100")
+FACILITIES = Recipient("smtp", "facilities@example.com")
+
+
+def alert(sensor_name: str, sensor_type: SensorTypes) -> PendingAlert:
+    reading = SimpleNamespace(
+        sensor_name=sensor_name,
+        sensor_config=SensorConfig(sensor_type),
+        recent_average=90.0,
+    )
+    return PendingAlert(reading, NotificationType.TOO_HIGH_AVERAGE)  # type: ignore
+
+
+class RecordingChannel(Channel):
+    """Fails its first `failures` sends, then records messages, tracking how many are in flight at once."""
+
+    def __init__(self, failures: int = 0, retryable: bool = True):
+        self.failures = failures
+        self.retryable = retryable
+        self.sent: list = []
+        self.in_flight = self.most_in_flight = 0
+
+    async def send(self, client, address, body):
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if self.failures:
+            self.failures -= 1
+            raise DeliveryError("unavailable", retryable=self.retryable)
+        self.sent.append((address, body))
+
+
+def test_alerts_are_routed_by_sensor_then_type_then_default():
+    recipients = compile_recipients(RECIPIENTS)
+    alerts = [
+        alert("arduino_1", SensorTypes.TEMPERATURE),
+        alert("kitchen", SensorTypes.AIRQUALITY),
+        alert("notecard", SensorTypes.TEMPERATURE),
+    ]
+    routed = recipients.route(alerts)
+    assert routed[FACILITIES] == alerts[:2]
+    assert routed[ON_CALL_SMS] == [alerts[0], alerts[2]]
+    assert len(recipients.lookup(SensorTypes.TEMPERATURE, "arduino_1")) == 3
+
+
+@pytest.mark.parametrize(
+    "recipients",
+    [
+        {"default": ["missing"]},
+        {"groups": {"on-call": [{"channel": "twilio"}]}},
+        {"groups": {}, "types": {"pressure": []}},
+        {"groups": []},
+        {"sensors": None},
+        {"default": "on-call", "groups": {"on-call": []}},
+    ],
+)
+def test_invalid_recipients(recipients):
+    with pytest.raises(ValueError):
+        compile_recipients(recipients)
+
+
+def test_messages_are_sent_concurrently_with_bounded_parallelism():
+    channel = RecordingChannel()
+    deliverer = Deliverer(channels={"twilio": channel}, concurrency=3)
+    messages = {Recipient("twilio", str(i)): f"alert {i}" for i in range(10)}
+    assert all(asyncio.run(deliverer.deliver(messages)).values())
+    assert sorted(channel.sent) == sorted((r.address, b) for r, b in messages.items())
+    assert channel.most_in_flight == 3
+
+
+def test_retryable_failures_are_retried_with_backoff():
+    flaky, broken = RecordingChannel(failures=2), RecordingChannel(
+        failures=1, retryable=False
+    )
+    deliverer = Deliverer(
+        channels={"twilio": flaky, "webhook": broken}, attempts=3, backoff=0.001
+    )
+    results = asyncio.run(
+        deliverer.deliver(
+            {
+                ON_CALL_SMS: "alert",
+                Recipient("webhook", "https://hooks.example.com"): "alert",
+                Recipient("pager", "42"): "alert",
+            }
+        )
+    )
+    assert list(results.values()) == [True, False, False]
+    assert flaky.sent == [(ON_CALL_SMS.address, "alert")]
+    assert broken.sent == []
+
+
+def test_http_channels_share_the_pooled_client(monkeypatch):
+    monkeypatch.setenv("TWILIO_ACCOUNT_SID", "AC1")
+    monkeypatch.setenv("TWILIO_AUTH_TOKEN", "secret")
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(429 if len(requests) == 1 else 201)
+
+    async def deliver():
+        deliverer = Deliverer(
+            channels={
+                "twilio": TwilioChannel("+15555550199"),
+                "webhook": WebhookChannel(),
+            },
+            concurrency=1,
+            backoff=0.001,
+        )
+        deliverer._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        results = await deliverer.deliver(
+            {
+                ON_CALL_SMS: "too hot",
+                Recipient("webhook", "https://hooks.example.com/alerts"): "too hot",
+            }
+        )
+        await deliverer.aclose()
+        return results
+
+    assert all(asyncio.run(deliver()).values())
+    # the first request was rate limited and retried
+    assert len(requests) == 3
+    sms = next(r for r in requests if r.url.host == "api.twilio.com")
+    assert sms.url.path == "/2010-04-01/Accounts/AC1/Messages.json"
+    assert (
+        sms.headers["authorization"]
+        == "Basic " + base64.b64encode(b"AC1:secret").decode()
+    )
+    assert b"To=%2B15555550100" in sms.content and b"Body=too+hot" in sms.content
+    hook = next(r for r in requests if r.url.host == "hooks.example.com")
+    assert json.loads(hook.content) == {"body": "too hot"}
+
+
+@pytest.mark.parametrize(
+    "failure, retried",
+    [
+        (httpx.Response(429), True),
+        (httpx.ConnectError("refused"), True),
+        (httpx.Response(503), False),
+        (httpx.ReadTimeout("timed out"), False),
+    ],
+)
+def test_sms_is_only_retried_if_it_certainly_wasnt_sent(monkeypatch, failure, retried):
+    monkeypatch.setenv("TWILIO_ACCOUNT_SID", "AC1")
+    monkeypatch.setenv("TWILIO_AUTH_TOKEN", "secret")
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url.host)
+        if len(requests) > 2:
+            return httpx.Response(201)
+        if isinstance(failure, Exception):
+            raise failure
+        return failure
+
+    async def deliver():
+        deliverer = Deliverer(
+            channels={"twilio": TwilioChannel(), "webhook": WebhookChannel()},
+            concurrency=1,
+            backoff=0.001,
+        )
+        deliverer._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        results = await deliverer.deliver(
+            {
+                ON_CALL_SMS: "too hot",
+                Recipient("webhook", "https://hooks.example.com/alerts"): "too hot",
+            }
+        )
+        await deliverer.aclose()
+        return results
+
+    results = asyncio.run(deliver())
+    assert results[ON_CALL_SMS] is retried
+    # webhooks are retried after any failure, so are delivered at least once
+    assert all(results.values()) if retried else sum(results.values()) == 1
+    assert requests.count("api.twilio.com") == (2 if retried else 1)
+
+
+def test_empty_groups_mute_a_sensor():
+    recipients = compile_recipients(
+        {**RECIPIENTS, "sensors": {"arduino_1": []}, "types": {"airquality": []}}
+    )
+    assert recipients.lookup(SensorTypes.TEMPERATURE, "arduino_1") == []
+    assert recipients.lookup(SensorTypes.AIRQUALITY, "kitchen") == []
+    assert recipients.lookup(SensorTypes.TEMPERATURE, "notecard") == [
+        ON_CALL_SMS,
+        Recipient("webhook", "https://hooks.example.com/alerts"),
+    ]
+    assert recipients.route([alert("arduino_1", SensorTypes.TEMPERATURE)]) == {}
+
+
+def test_digest_is_delivered_to_each_recipient(monkeypatch):
+    channels = {"twilio": RecordingChannel(), "smtp": RecordingChannel()}
+    monkeypatch.setattr(m, "recipients", compile_recipients(RECIPIENTS))
+    monkeypatch.setattr(
+        m, "deliverer", Deliverer(channels={**channels, "webhook": RecordingChannel()})
+    )
+    alerts = [alert("kitchen", SensorTypes.AIRQUALITY)]
+    assert asyncio.run(m.Notifications.deliver_digest(alerts)) == 1
+    assert channels["smtp"].sent == [
+        (FACILITIES.address, m.Notifications.construct_digest(alerts))
+    ]
+    assert channels["twilio"].sent == []
+
+
+@pytest.mark.parametrize("contents", ["{not json", json.dumps({"groups": []}), "[]"])
+def test_invalid_recipients_file_alerts_the_default_number(
+    monkeypatch, tmp_path, caplog, contents
+):
+    path = tmp_path / "recipients.json"
+    path.write_text(contents)
+    monkeypatch.setattr(
+        m, "recipients", m.LazyResource(lambda: load_recipients(str(path)))
+    )
+    channels = {"twilio": RecordingChannel(), "smtp": RecordingChannel()}
+    monkeypatch.setattr(m, "deliverer", Deliverer(channels=channels))
+    alerts = [alert("kitchen", SensorTypes.AIRQUALITY)]
+    assert asyncio.run(m.Notifications.deliver_digest(alerts)) == 1
+    assert channels["twilio"].sent == [
+        (m.TWILIO_TO, m.Notifications.construct_digest(alerts))
+    ]
+    assert "is invalid" in caplog.text
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+from dispatch import BackgroundDispatcher
+
+
+def test_jobs_run_inline_when_not_started():
+    done = []
+    asyncio.run(BackgroundDispatcher().submit("storage", done.append, 1))
+    assert done == [1]
+
+
+def test_stop_drains_queued_jobs():
+    done = []
+    release = threading.Event()
+
+    def slow_job(i):
+        release.wait(1)
+        done.append(i)
+
+    async def run():
+        dispatcher = BackgroundDispatcher(workers={"storage": 1}, queue_size=2)
+        await dispatcher.start()
+        for i in range(3):
+            await dispatcher.submit("storage", slow_job, i)
+        assert dispatcher.queue_depth("storage") <= 2
+        release.set()
+        await dispatcher.stop()
+        assert not dispatcher.running
+
+    asyncio.run(run())
+    assert done == [0, 1, 2]
+
+
+def test_failing_job_does_not_stop_worker():
+    done = []
+
+    async def run():
+        dispatcher = BackgroundDispatcher(workers={"notifications": 1})
+        await dispatcher.start()
+        await dispatcher.submit("notifications", lambda: 1 / 0)
+        await dispatcher.submit("notifications", done.append, "sent")
+        await dispatcher.stop()
+
+    asyncio.run(run())
+    assert done == ["sent"]
@@ -0,0 +1,118 @@
+import asyncio
+import random
+import threading
+import time
+
+import pytest  # type: ignore
+
+import constants as c
+import model as model
+from storage import FETCH_LIMIT, FetchResponse, MemoryStore, match_query
+from evaluation import evaluate_batch
+from rules import compile_rules
+from trends import Trend
+
+# turns on the low thresholds, which are off by default
+LOW_THRESHOLDS = compile_rules(
+    {"types": {"temperature": {"low_average": 40, "low_single_reading": 35}}}
+).by_type
+
+
+def make_reading(sensor_type, temp, average) -> model.ParsedReading:
+    return model.ParsedReading(
+        datetime=1665021239,
+        event="f3ec6e7b-382b-472b-ad13-c52d7327cf76",
+        best_lat=45.5728875,
+        best_long=-122.66610937499999,
+        sensor_name="arduino1",
+        sensor_config=c.SensorConfig(sensor_type),
+        sensor_reading=temp,
+        recent_average=average,
+    )
+
+
+@pytest.mark.parametrize("recent", [True, False])
+def test_batch_matches_single_reading_logic(monkeypatch, recent):
+    monkeypatch.setattr(model, "_if_recent_reading", lambda: recent)
+    rng = random.Random(7)
+    readings = [
+        make_reading(
+            rng.choice(list(c.SensorTypes)), rng.uniform(0, 120), rng.uniform(0, 120)
+        )
+        for _ in range(2000)
+    ] + [make_reading(c.SensorTypes(1), 2000000000000000000, -5600000000)]
+    for r in readings[::2]:
+        r.sensor_config = LOW_THRESHOLDS[r.sensor_config.sensor_type]
+    for r in readings[::3]:
+        r.trend = Trend(
+            mean=rng.uniform(0, 120),
+            deviation=rng.uniform(0, 10),
+            slope=0.0,
+            rise=rng.uniform(-20, 20),
+            count=rng.randint(1, 5),
+        )
+    for r in readings[::5]:
+        r.outlier = True
+
+    notification_event = model.Notifications(queued_notifications=[])
+    expected = [notification_event._evaluate_for_notify_logic(r) for r in readings]
+    assert evaluate_batch(readings, lambda: recent) == expected
+
+
+def test_recent_reading_checked_once_per_batch():
+    calls = []
+    # every reading increased by more than single_increase_change over its average
+    readings = [make_reading(c.SensorTypes(1), 50, 30) for _ in range(10)]
+    results = evaluate_batch(readings, lambda: calls.append(1) or True)
+    assert calls == [1]
+    assert all(r[1] == c.NotificationType.RAPID_INCREASE for r in results)
+
+
+def test_non_numeric_readings_raise_type_error():
+    with pytest.raises(TypeError):
+        evaluate_batch([make_reading(c.SensorTypes(1), "alex", 45)], lambda: False)
+
+
+def test_recent_reading_is_checked_off_the_event_loop(monkeypatch):
+    threads = []
+    monkeypatch.setattr(
+        model,
+        "_if_recent_reading",
+        lambda: threads.append(threading.current_thread()) or True,
+    )
+    notifications = model.Notifications(queued_notifications=[])
+    # no reading increased fast enough to need the check
+    asyncio.run(
+        notifications.evaluate_batch_async([make_reading(c.SensorTypes(1), 50, 49)])
+    )
+    assert threads == [] and notifications.get_notifications() == []
+
+    readings = [make_reading(c.SensorTypes(1), 50, 30) for _ in range(3)]
+    assert asyncio.run(notifications.evaluate_batch_async(readings)) == 3
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
+    assert all(
+        n == c.NotificationType.RAPID_INCREASE
+        for _, n in notifications.get_notifications()
+    )
+
+
+class LimitFirstStore(MemoryStore):
+    """Pages like a deta Base, which applies the limit before the query, so pages can be empty."""
+
+    def fetch(self, query=None, *, limit=FETCH_LIMIT, last=None):
+        page = super().fetch(limit=limit, last=last)
+        items = [item for item in page.items if match_query(item, query)]
+        return FetchResponse(items=items, last=page.last)
+
+
+@pytest.mark.parametrize("recent", [False, True])
+def test_recent_reading_past_the_first_page(monkeypatch, recent):
+    store = LimitFirstStore("recent_readings")
+    now = time.time()
+    old = now - c.AlertTiming.AVERAGE_ALERT_WINDOW - 60
+    store.put_many(
+        [{"key": f"a{i:05}", "datetime": old} for i in range(FETCH_LIMIT + 5)]
+    )
+    store.put({"datetime": now if recent else old}, "b")
+    monkeypatch.setattr(model, "recent_readings_db", store)
+    assert model._if_recent_reading() is recent
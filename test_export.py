@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+
+import pytest  # type: ignore
+from fastapi.testclient import TestClient
+
+import export
+import main
+import model as m
+from constants import SensorTypes
+from storage import MemoryStore
+
+
+@pytest.fixture
+def readings(monkeypatch) -> MemoryStore:
+    store = MemoryStore("therm-all-readings")
+    store.put_many(
+        [
+            {
+                "datetime": 1000 + i,
+                "event": f"event-{i}",
+                "best_lat": 45.5,
+                "best_long": -122.6,
+                "sensor_name": f"arduino_{i % 2}",
+                "sensor_type": SensorTypes(1 + i % 2),
+                "sensor_reading": float(i),
+                "recent_average": float(i),
+            }
+            for i in range(25)
+        ]
+    )
+    monkeypatch.setattr(m, "all_readings_db", store)
+    return store
+
+
+def test_scan_follows_pagination_with_filters_in_the_query(readings):
+    query = export.export_query(sensor_name="arduino_0", start=1004, end=1020)
+    rows = list(readings.scan(query, page_size=3))
+    assert [r["datetime"] for r in sorted(rows, key=lambda r: r["datetime"])] == list(
+        range(1004, 1020, 2)
+    )
+    # 8 matching rows in pages of 3
+    assert readings.calls["fetch"] == 3
+
+
+def test_scan_is_lazy(readings):
+    rows = readings.scan(page_size=10)
+    next(rows)
+    assert readings.calls["fetch"] == 1
+
+
+def test_csv_export(readings):
+    response = TestClient(main.app).get(
+        "/export/", params={"sensor_type": 2, "start": 1010}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert tuple(rows[0]) == export.EXPORT_FIELDS
+    assert sorted(int(r["datetime"]) for r in rows) == list(range(1011, 1025, 2))
+
+
+def test_ndjson_export(readings):
+    response = TestClient(main.app).get(
+        "/export/", params={"format": "ndjson", "sensor_name": "arduino_1", "end": 1004}
+    )
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(r["event"] for r in rows) == ["event-1", "event-3"]
+
+
+def test_unknown_format(readings):
+    assert TestClient(main.app).get("/export/?format=xml").status_code == 400
@@ -0,0 +1,168 @@
+import json
+import random
+
+import pytest  # type: ignore
+from fastapi.testclient import TestClient
+
+import main
+import model as m
+from constants import NotificationType, SensorConfig, SensorTypes
+from geo import GeoIndex, Region, distance_km
+from rules import SensorRules, compile_rules
+
+TEMPERATURE, HUMIDITY = SensorTypes.TEMPERATURE, SensorTypes.HUMIDITY
+
+
+def random_index(rng: random.Random, sensors: int) -> GeoIndex:
+    index = GeoIndex(cell_degrees=1.0)
+    for i in range(sensors):
+        index.update(
+            f"sensor_{i}",
+            rng.choice([TEMPERATURE, HUMIDITY]),
+            rng.uniform(-90, 90),
+            rng.uniform(-180, 180),
+            rng.uniform(0, 100),
+            i,
+        )
+    return index
+
+
+@pytest.mark.parametrize(
+    "lat, long, radius_km",
+    [(45.5, -122.6, 500), (10, 179.5, 800), (-88, 30, 900), (0, 0, 20000)],
+)
+def test_radius_queries_match_a_full_scan(lat, long, radius_km):
+    index = random_index(random.Random(3), 5000)
+    expected = sorted(
+        p.sensor_name
+        for p in index.positions.values()
+        if distance_km(lat, long, p.best_lat, p.best_long) <= radius_km
+        and p.sensor_type == TEMPERATURE
+    )
+    found = index.within_radius(lat, long, radius_km, TEMPERATURE)
+    assert sorted(p.sensor_name for p, _ in found) == expected
+    assert [d for _, d in found] == sorted(d for _, d in found)
+
+
+@pytest.mark.parametrize(
+    "box", [(40, -125, 50, -115), (-20, 170, 20, -170), (-90, -180, 90, 180)]
+)
+def test_box_queries_match_a_full_scan(box):
+    index = random_index(random.Random(5), 5000)
+    region = Region(box=box)
+    expected = sorted(
+        name
+        for name, p in index.positions.items()
+        if region.contains(p.best_lat, p.best_long)
+    )
+    assert sorted(p.sensor_name for p in index.within_box(*box)) == expected
+    if box[1] > box[3]:
+        assert all(abs(p.best_long) >= 170 for p in index.within_box(*box))
+
+
+def test_latest_position_wins():
+    index = GeoIndex()
+    assert index.update("van", TEMPERATURE, 45.5, -122.6, 70, 2)
+    # an older reading doesn't move the sensor back
+    assert not index.update("van", TEMPERATURE, 10, 10, 60, 1)
+    assert index.update("van", TEMPERATURE, 47.6, -122.3, 72, 3)
+    assert index.within_radius(45.5, -122.6, 10) == []
+    assert [p.sensor_reading for p in index.within_box(47, -123, 48, -122)] == [72]
+    assert sum(len(members) for members in index.cells.values()) == 1
+    assert not index.update("lost", TEMPERATURE, 91, 0, 70, 4)
+
+
+@pytest.mark.parametrize(
+    "region",
+    [
+        {"name": "a", "sensor_type": "temperature"},
+        {"name": "a", "sensor_type": "temperature", "box": [50, 0, 40, 10]},
+        {"name": "a", "sensor_type": "temperature", "box": [0, 0, 10]},
+        {"name": "a", "sensor_type": "temperature", "center": [0, 0]},
+        {"name": "a", "sensor_type": "temperature", "center": [0, 0], "depth": 1},
+        {"sensor_type": "temperature", "center": [0, 0], "radius_km": 1},
+    ],
+)
+def test_invalid_region_rules(region):
+    with pytest.raises(ValueError):
+        compile_rules({"regions": [region]})
+
+
+def test_regions_are_alerted_on_their_average(monkeypatch, tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(
+        json.dumps(
+            {
+                "regions": [
+                    {
+                        "name": "warehouse",
+                        "sensor_type": "temperature",
+                        "box": [45.5, -122.7, 45.6, -122.6],
+                        "average": 75,
+                    },
+                    {
+                        "name": "depot",
+                        "sensor_type": "humidity",
+                        "center": [45.55, -122.65],
+                        "radius_km": 5,
+                    },
+                ]
+            }
+        )
+    )
+    monkeypatch.setattr(m, "sensor_rules", SensorRules(str(path)))
+    monkeypatch.setattr(m, "geo_index", GeoIndex())
+    m.geo_index.update("shelf_1", TEMPERATURE, 45.55, -122.65, 70, 1)
+    m.geo_index.update("shelf_2", TEMPERATURE, 45.56, -122.64, 84, 2)
+    reading = m.ParsedReading(
+        datetime=2,
+        event="e",
+        best_lat=45.56,
+        best_long=-122.64,
+        sensor_name="shelf_2",
+        sensor_reading=84,
+        recent_average=84,
+        sensor_config=SensorConfig(TEMPERATURE),
+    )
+    region_readings, notifications = m.evaluate_regions([reading])
+    # the humidity region has no humidity reading in the event
+    assert [r.sensor_name for r in region_readings] == ["region:warehouse"]
+    assert region_readings[0].recent_average == 77
+    assert notifications == [(region_readings[0], NotificationType.TOO_HIGH_AVERAGE)]
+
+
+def test_location_endpoints(monkeypatch):
+    monkeypatch.setattr(m, "geo_index", GeoIndex())
+    m.geo_index.update("near", TEMPERATURE, 45.55, -122.65, 70, 1)
+    m.geo_index.update("far", TEMPERATURE, 45.7, -122.65, 80, 1)
+    m.geo_index.update("damp", HUMIDITY, 45.56, -122.65, 40, 1)
+    client = TestClient(main.app)
+
+    nearby = client.get(
+        "/sensors/nearby/", params={"lat": 45.55, "long": -122.65, "radius_km": 5}
+    ).json()
+    assert [s["sensor_name"] for s in nearby["sensors"]] == ["near", "damp"]
+    assert nearby["sensors"][1]["distance_km"] == pytest.approx(1.112, abs=0.001)
+    assert nearby["summary"] == {
+        "temperature": {"count": 1, "mean": 70, "min": 70, "max": 70},
+        "humidity": {"count": 1, "mean": 40, "min": 40, "max": 40},
+    }
+
+    within = client.get(
+        "/sensors/within/",
+        params={
+            "south": 45.5,
+            "west": -123,
+            "north": 46,
+            "east": -122,
+            "sensor_type": TEMPERATURE.value,
+        },
+    ).json()
+    assert within["summary"] == {
+        "temperature": {"count": 2, "mean": 75, "min": 70, "max": 80}
+    }
+
+    invalid = client.get(
+        "/sensors/nearby/", params={"lat": 95, "long": 0, "radius_km": 5}
+    )
+    assert invalid.status_code == 400
@@ -0,0 +1,38 @@
+from constants import SensorTypes
+from latest import LatestReadingIndex
+from storage import SqliteStore
+from writer import BatchWriter
+
+
+def reading(sensor_name, sensor_type, datetime, sensor_reading) -> dict:
+    return {
+        "datetime": datetime,
+        "sensor_name": sensor_name,
+        "sensor_type": sensor_type,
+        "sensor_reading": sensor_reading,
+    }
+
+
+def test_keeps_newest_reading_per_sensor_and_type():
+    index = LatestReadingIndex()
+    index.update(reading("arduino_1", SensorTypes.TEMPERATURE, 20, 70))
+    index.update(reading("arduino_2", SensorTypes.TEMPERATURE, 30, 75))
+    # late arriving older reading doesn't replace the newer one
+    index.update(reading("arduino_1", SensorTypes.TEMPERATURE, 10, 60))
+    assert index.for_sensor("arduino_1")["sensor_reading"] == 70
+    assert index.for_type(SensorTypes.TEMPERATURE)["sensor_name"] == "arduino_2"
+    assert index.for_type(SensorTypes.HUMIDITY) is None
+
+
+def test_records_are_persisted_and_reloaded(tmp_path):
+    store = SqliteStore("latest_readings", path=str(tmp_path / "test.db"))
+    writer = BatchWriter(flush_interval=3600)
+    index = LatestReadingIndex(store=store, writer=writer)
+    index.update(reading("notecard", SensorTypes.HUMIDITY, 10, 30))
+    index.update(reading("notecard", SensorTypes.HUMIDITY, 20, 40))
+    assert index.persist() == 2
+    assert writer.close()
+
+    reloaded = LatestReadingIndex(store=store)
+    assert reloaded.for_sensor("notecard")["sensor_reading"] == 40
+    assert reloaded.for_type(SensorTypes.HUMIDITY)["datetime"] == 20
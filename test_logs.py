@@ -0,0 +1,33 @@
+import logging
+import threading
+
+import logs
+
+
+def test_debug_records_are_sampled_per_call_site():
+    sampler = logs.SamplingFilter(every=10)
+
+    def record(lineno, level=logging.DEBUG):
+        return logging.LogRecord("root", level, "main.py", lineno, "msg", (), None)
+
+    assert sum(sampler.filter(record(1)) for _ in range(100)) == 10
+    assert sampler.filter(record(2))
+    assert all(sampler.filter(record(1, logging.ERROR)) for _ in range(5))
+
+
+def test_records_are_formatted_and_written_by_the_listener(tmp_path):
+    class Reading:
+        formatted_on = None
+
+        def __repr__(self):
+            Reading.formatted_on = threading.current_thread()
+            return "reading"
+
+    path = tmp_path / "test.log"
+    logs.configure_logging(str(path), "DEBUG")
+    try:
+        logging.error("stored %r", Reading())
+    finally:
+        logs.stop_logging()
+    assert "stored reading" in path.read_text()
+    assert Reading.formatted_on is not threading.current_thread()
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest  # type: ignore
+from fastapi.testclient import TestClient
+
+import main
+import model as m
+from aggregator import SensorWindowAggregator
+from latest import LatestReadingIndex
+from storage import MemoryStore
+from writer import BatchWriter
+
+
+@pytest.fixture
+def stores(monkeypatch):
+    monkeypatch.setattr(m, "all_readings_db", MemoryStore("therm-all-readings"))
+    monkeypatch.setattr(m, "recent_readings_db", MemoryStore("recent_readings"))
+    monkeypatch.setattr(m, "db_writer", BatchWriter())
+    monkeypatch.setattr(
+        m,
+        "latest_readings",
+        LatestReadingIndex(store=MemoryStore("latest_readings"), writer=m.db_writer),
+    )
+    monkeypatch.setattr(m, "recent_window", SensorWindowAggregator())
+    return m.all_readings_db, m.recent_readings_db
+
+
+@pytest.fixture
+def testevent() -> m.SensorLogEvent:
+    readings1 = m.SensorLogReading(
+        sensor_name="arduino_1", sensor_reading=10, sensor_type=m.SensorTypes(1)
+    )
+    readings2 = m.SensorLogReading(
+        sensor_name="notecard", sensor_reading=10, sensor_type=m.SensorTypes(1)
+    )
+    readings3 = m.SensorLogReading(
+        sensor_name="notecard2", sensor_reading=10, sensor_type=m.SensorTypes(1)
+    )
+    return m.SensorLogEvent(
+        datetime=1665021239,
+        event="f3ec6e7b-382b-472b-ad13-c52d7327cf76",
+        best_lat=45.5728875,
+        best_long=-122.66610937499999,
+        readings=[readings1, readings2, readings3],
+    )
+
+
+def test_event_is_stored(stores, testevent):
+    notification_event, parsed_readings = asyncio.run(main.process_event(testevent))
+    main.store_readings(parsed_readings)
+    m.db_writer.flush()
+    assert notification_event.get_notifications() == []
+    for store in stores:
+        assert sorted(i["sensor_name"] for i in store.fetch().items) == [
+            "arduino_1",
+            "notecard",
+            "notecard2",
+        ]
+
+
+def test_webhook_is_acknowledged(stores, testevent):
+    client = TestClient(main.app)
+    response = client.post("/", data=testevent.json())
+    assert response.status_code == 202
+    assert response.json() == {"event": testevent.event, "status": "accepted"}
+    invalid = client.post("/", data=b"{not json")
+    assert invalid.status_code == 422
+    assert invalid.json()["detail"][0]["loc"] == ["body", 1]
+
+
+@pytest.mark.parametrize("body", [b"5\n", b"[1, 2]", b'[{"event": "e"}, null]'])
+def test_bulk_reports_records_that_are_not_objects(stores, body):
+    response = TestClient(main.app).post("/bulk/", data=body)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["events"] == 0 and result["error_count"] == body.count(b",") + 1
+    assert result["errors"][-1]["event"] is None
+
+
+def test_import_has_no_side_effects():
+    # no secrets are set and the storage backend can't be opened, so this fails if anything is created on import
+    env = dict(os.environ, STORAGE_BACKEND="unavailable")
+    env.pop("TWILIO_ACCOUNT_SID", None)
+    env.pop("TWILIO_AUTH_TOKEN", None)
+    code = (
+        "import main, model as m; main.app; "
+        "assert not any(r.created for r in "
+        "(m.TWILIO_CLIENT_IDS, m.recipients, m.all_readings_db, m.recent_readings_db, m.latest_readings_db, m.shared_state))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(main.__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
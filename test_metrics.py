@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+import constants as c
+import main
+import metrics
+import model as m
+from storage import InstrumentedStore, MemoryStore
+from test_evaluation import make_reading
+from test_main import stores  # noqa: F401
+from writer import BatchWriter
+
+
+def sample(name: str, **labels) -> float:
+    return metrics.registry.get_sample_value(name, labels) or 0.0
+
+
+def test_store_calls_and_fetched_items_are_counted():
+    store = InstrumentedStore(MemoryStore("metrics-test"))
+    store.put_many([{"datetime": i} for i in range(3)])
+    store.fetch(limit=2)
+    labels = {"store": "metrics-test"}
+    assert sample("hottoddy_storage_seconds_count", call="put_many", **labels) == 1
+    assert sample("hottoddy_storage_items_total", call="put_many", **labels) == 3
+    assert sample("hottoddy_storage_fetch_items_sum", **labels) == 2
+    # attributes of the wrapped store pass through
+    assert store.calls == {"put_many": 1, "fetch": 1}
+
+
+def test_webhook_stages_are_exposed_on_metrics_route(stores):
+    before = sample("hottoddy_stage_seconds_count", stage=metrics.VALIDATION)
+    client = TestClient(main.app)
+    event = {
+        "datetime": 1665021239,
+        "event": "metrics-test",
+        "best_lat": 45.5728875,
+        "best_long": -122.66610937499999,
+        "readings": [
+            {"sensor_name": "arduino_1", "sensor_reading": 10, "sensor_type": 1}
+        ],
+    }
+    assert client.post("/", json=event).status_code == 202
+    assert client.post("/", json={"event": "no readings"}).status_code == 422
+    assert (
+        sample("hottoddy_stage_seconds_count", stage=metrics.VALIDATION) == before + 2
+    )
+
+    # inserts are timed as the buffered readings are written
+    m.db_writer.flush()
+    body = client.get("/metrics").text
+    for stage in (
+        metrics.PARSE_EVENT,
+        metrics.AVERAGE,
+        metrics.INSERT,
+        metrics.EVALUATE,
+    ):
+        assert f'hottoddy_stage_seconds_count{{stage="{stage}"}}' in body
+
+
+def test_insert_stage_times_the_batch_write():
+    class SlowStore(MemoryStore):
+        def put_many(self, items, *, expire_in=None):
+            time.sleep(0.02)
+            return super().put_many(items, expire_in=expire_in)
+
+    count = sample("hottoddy_stage_seconds_count", stage=metrics.INSERT)
+    total = sample("hottoddy_stage_seconds_sum", stage=metrics.INSERT)
+    writer = BatchWriter(batch_size=100)
+    writer.put(SlowStore("metrics-slow"), {"datetime": 1})
+    writer.close()
+    assert sample("hottoddy_stage_seconds_count", stage=metrics.INSERT) == count + 1
+    assert sample("hottoddy_stage_seconds_sum", stage=metrics.INSERT) >= total + 0.02
+
+
+def test_evaluate_stage_is_observed_once_per_batch(monkeypatch):
+    monkeypatch.setattr(m, "_if_recent_reading", lambda: True)
+    notifications = m.Notifications(queued_notifications=[])
+    before = sample("hottoddy_stage_seconds_count", stage=metrics.EVALUATE)
+    # the readings rose fast enough that the recent reading check is needed, so they're evaluated twice
+    readings = [make_reading(c.SensorTypes(1), 50, 30) for _ in range(3)]
+    assert asyncio.run(notifications.evaluate_batch_async(readings)) == 3
+    assert sample("hottoddy_stage_seconds_count", stage=metrics.EVALUATE) == before + 1
@@ -1,15 +1,12 @@
 import logging as test_logging
 
 import pytest  # type: ignore
-from deta import Deta  # type: ignore
+from pydantic import ValidationError
 
-from decouple import config  # type: ignore
 import constants as c
 import model as model
-
-DETA_KEY = config("DETA_KEY")
-deta = Deta(DETA_KEY)  # type: ignore
-
+from aggregator import SensorWindowAggregator
+from storage import open_store
 
 test_logging.basicConfig(
     filename="tests.log", encoding="utf-8", level=test_logging.DEBUG
@@ -42,7 +39,9 @@ def example_temperature_event() -> model.SensorLogEvent:
     return readings
 
 
-def test_event_parsing_2(example_temperature_event):
+def test_event_parsing_2(monkeypatch, example_temperature_event):
+    # averages come from an empty in-memory window rather than whichever store is configured
+    monkeypatch.setattr(model, "recent_window", SensorWindowAggregator())
     parsed_response = example_temperature_event.parse_event()
     assert all(isinstance(i, model.ParsedReading) for i in parsed_response)
     for i in range(len(parsed_response)):
@@ -155,9 +154,32 @@ def test_temperature_exception_handling(example_temperature_reading):
     [(90, 45)],
 )
 def test_database_error_handling(example_temperature_reading):
-    test_db = deta.Base("test_db")
+    test_db = open_store("test_db", backend="memory")
     db_res = example_temperature_reading.insert_parsed_reading_into_db(test_db)
     assert db_res == True
     res = test_db.fetch()
     for i in res.items:
         test_db.delete(i["key"])
+
+
+def test_decode_builds_exactly_typed_events_without_validation(monkeypatch):
+    monkeypatch.setattr(model, "recent_window", SensorWindowAggregator())
+    body = b'{"datetime": 1665021239, "event": "e", "best_lat": 45, "best_long": -122.6, "readings": [{"sensor_name": "arduino_1", "sensor_reading": 10, "sensor_type": 2}]}'
+    event = model.SensorLogEvent.decode(body)
+    reading = event.readings[0]
+    assert isinstance(reading, model.ReadingRecord)
+    assert (reading.sensor_reading, reading.sensor_type) == (10.0, c.SensorTypes(2))
+    assert event.best_lat == 45.0
+    assert event.parse_event()[0].sensor_config.sensor_type == c.SensorTypes(2)
+
+
+def test_decode_falls_back_to_pydantic():
+    coerced = model.SensorLogEvent.decode(
+        b'{"datetime": "1665021239", "event": "e", "best_lat": 45, "best_long": -122.6, "readings": [{"sensor_name": "arduino_1", "sensor_reading": "10", "sensor_type": 1}]}'
+    )
+    assert isinstance(coerced.readings[0], model.SensorLogReading)
+    assert coerced.datetime == 1665021239
+    with pytest.raises(ValidationError):
+        model.SensorLogEvent.decode(
+            b'{"datetime": 1665021239, "event": "e", "best_lat": 45, "best_long": -122.6, "readings": [{"sensor_name": "arduino_1", "sensor_reading": 10, "sensor_type": 9}]}'
+        )
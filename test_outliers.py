@@ -0,0 +1,90 @@
+import random
+
+import numpy as np
+import pytest  # type: ignore
+
+import constants as c
+import model as model
+from aggregator import SensorWindowAggregator
+from outliers import HampelFilter, IndexableSkiplist, SlidingMedian
+
+
+def test_skiplist_keeps_values_sorted():
+    rng = random.Random(3)
+    skiplist, values = IndexableSkiplist(), []
+    for _ in range(1000):
+        if values and rng.random() < 0.4:
+            value = values.pop(rng.randrange(len(values)))
+            skiplist.remove(value)
+        else:
+            value = float(rng.randint(0, 50))
+            values.append(value)
+            skiplist.insert(value)
+    assert [skiplist[i] for i in range(len(skiplist))] == sorted(values)
+    with pytest.raises(KeyError):
+        skiplist.remove(51.0)
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 16])
+def test_sliding_median_and_mad_match_numpy(size):
+    rng = random.Random(size)
+    window, values = SlidingMedian(size), []
+    for _ in range(300):
+        value = rng.choice([rng.uniform(0, 100), float(rng.randint(0, 3))])
+        window.add(value)
+        values.append(value)
+        recent = np.array(values[-size:])
+        median = np.median(recent)
+        assert window.median() == pytest.approx(median)
+        assert window.mad() == pytest.approx(np.median(np.abs(recent - median)))
+
+
+def test_spike_is_flagged_and_replaced_by_the_median():
+    hampel = HampelFilter(window_size=7, deviations=3, min_readings=5)
+    for value in [70.0, 71.0, 70.5, 69.5, 70.0]:
+        assert hampel.check("arduino_1", value, 15) == (False, value)
+    assert hampel.check("arduino_1", 150.0, 15) == (True, 70.0)
+    # a change smaller than min_change is kept however steady the sensor was
+    assert hampel.check("arduino_1", 80.0, 15) == (False, 80.0)
+    # a lasting change stops being flagged once it's half the window
+    results = [hampel.check("arduino_1", 120.0, 15)[0] for _ in range(4)]
+    assert results[0] and not results[-1]
+
+
+def test_non_finite_readings_are_kept_out_of_the_window():
+    hampel = HampelFilter(window_size=5, deviations=3, min_readings=3)
+    values = [70.0, float("nan"), 71.0, float("inf"), 70.5, float("-inf"), 69.5]
+    for value in values * 4:
+        outlier, reading = hampel.check("arduino_1", value, 15)
+        assert not outlier and (reading == value or reading != reading)
+    window = hampel.windows["arduino_1"]
+    assert list(window.values) == [69.5, 70.0, 71.0, 70.5, 69.5]
+    assert [window.ordered[i] for i in range(5)] == sorted(window.values)
+    assert hampel.check("arduino_1", 150.0, 15) == (True, 70.0)
+    with pytest.raises(ValueError):
+        window.add(float("nan"))
+    assert len(window.values) == len(window.ordered) == 5
+
+
+def test_outliers_are_left_out_of_averages_and_single_reading_alerts(monkeypatch):
+    monkeypatch.setattr(model, "recent_outliers", HampelFilter())
+    monkeypatch.setattr(model, "recent_window", SensorWindowAggregator())
+    notifications = model.Notifications(queued_notifications=[])
+    for t, value in enumerate([70, 71, 70, 69, 70, 150]):
+        event = model.SensorLogEvent.parse_obj(
+            {
+                "datetime": 1665021239 + t,
+                "event": str(t),
+                "best_lat": 45.5,
+                "best_long": -122.6,
+                "readings": [
+                    {"sensor_name": "spiky", "sensor_reading": value, "sensor_type": 1}
+                ],
+            }
+        )
+        reading = event.parse_event()[0]
+    assert reading.outlier
+    assert reading.recent_average < 80
+    assert (
+        notifications._evaluate_for_notify_logic(reading)[1] == c.NotificationType.NOOP
+    )
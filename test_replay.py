@@ -0,0 +1,113 @@
+import asyncio
+import multiprocessing
+import os
+
+import httpx
+import orjson
+import pytest  # type: ignore
+from fastapi.testclient import TestClient
+
+import main
+import model as m
+import replay
+from capture import CaptureWriter, read_capture
+from test_benchmark import stand_ins  # noqa: F401
+
+
+def test_capture_round_trip(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    writer = CaptureWriter(path)
+    writer.record(b'{"event": "a"}', arrived=10.0)
+    writer.close()
+    # appending keeps the existing records and writes the header once
+    writer = CaptureWriter(path)
+    writer.record(b"{not json", arrived=11.5)
+    writer.close()
+    assert list(read_capture(path)) == [(10.0, b'{"event": "a"}'), (11.5, b"{not json")]
+
+    # a record cut short ends the capture
+    with open(path, "ab") as f:
+        f.write(b"\x00" * 5)
+    assert len(list(read_capture(path))) == 2
+
+    (tmp_path / "other.bin").write_bytes(b"not a capture")
+    with pytest.raises(ValueError):
+        list(read_capture(str(tmp_path / "other.bin")))
+
+
+def capture_from_process(path: str, worker: int, started):
+    writer = CaptureWriter(path)
+    started.wait()
+    for i in range(200):
+        writer.record(b"%d:%d:" % (worker, i) + b"x" * 5000, arrived=float(i))
+    writer.close()
+
+
+def test_workers_share_a_capture_file(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    context = multiprocessing.get_context("fork")
+    started = context.Barrier(3)
+    processes = [
+        context.Process(target=capture_from_process, args=(path, worker, started))
+        for worker in range(3)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    bodies = [body for _, body in read_capture(path)]
+    assert len(bodies) == 600
+    assert all(body.endswith(b"x" * 5000) for body in bodies)
+    for worker in range(3):
+        mine = [b for b in bodies if b.startswith(b"%d:" % worker)]
+        assert [int(b.split(b":")[1]) for b in mine] == list(range(200))
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".tmp")]
+
+
+def test_webhook_bodies_are_captured(monkeypatch, tmp_path, stand_ins):
+    writer = CaptureWriter(str(tmp_path / "capture.bin"))
+    monkeypatch.setattr(m, "traffic_capture", writer)
+    event = replay.benchmark.generate_events(sensors=2, readings_per_event=2, events=1)
+    client = TestClient(main.app)
+    assert client.post("/", data=orjson.dumps(event[0])).status_code == 202
+    assert client.post("/", data=b"{not json").status_code == 422
+    writer.close()
+    bodies = [body for _, body in read_capture(writer.path)]
+    assert bodies == [orjson.dumps(event[0]), b"{not json"]
+
+
+@pytest.fixture
+def records(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    assert replay.synthesize(path, 5, 3, events=40, per_second=400) == 40
+    captured = list(read_capture(path))
+    # one invalid body, which counts as an error
+    return captured[:20] + [(captured[19][0], b"{not json")] + captured[20:]
+
+
+@pytest.mark.parametrize("rate", [0.0, 1.0])
+def test_replay_in_process(records, rate, stand_ins):
+    result = asyncio.run(replay.replay_in_process(records, rate, concurrency=4))
+    assert result.events == 41
+    assert result.errors == 1 and result.error_rate == pytest.approx(1 / 41, abs=1e-4)
+    assert result.p50_ms <= result.p90_ms <= result.p99_ms <= result.max_ms
+    assert (result.offered_per_second is None) == (rate == 0)
+    assert m.all_readings_db.fetch(limit=1000).count == 120
+
+
+def test_replay_over_http(records, stand_ins):
+
+    async def run():
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=main.app), base_url="http://replay"
+        ) as client:
+            return await replay.replay(
+                records, replay.http_sender(client, "/"), rate=0, concurrency=4
+            )
+
+    result = asyncio.run(run())
+    assert result.events == 41 and result.errors == 1
+    # valid bodies get new event ids so a server that has seen them doesn't drop them, invalid ones are kept
+    fresh = replay.with_fresh_ids(records, "-again")
+    assert orjson.loads(fresh[0][1])["event"].endswith("-again")
+    assert fresh[20] == records[20]
@@ -0,0 +1,70 @@
+import pytest  # type: ignore
+
+from rollups import RollupIndex
+
+DAY = 86400
+# a Monday at 00:00 UTC
+START = 1665360000
+
+
+@pytest.fixture
+def rollups() -> RollupIndex:
+    rollups = RollupIndex()
+    # one reading a minute for a week, hour h of the week reads h
+    for minute in range(7 * 24 * 60):
+        rollups.add("arduino_1", START + minute * 60, minute // 60)
+    return rollups
+
+
+def test_hourly_max_uses_hour_rollups(rollups):
+    resolution, buckets = rollups.query("arduino_1", START, START + 7 * DAY, 3600)
+    assert resolution == 3600
+    assert len(buckets) == 7 * 24
+    assert buckets[5] == {
+        "start": START + 5 * 3600,
+        "count": 60,
+        "min": 5.0,
+        "max": 5.0,
+        "mean": 5.0,
+    }
+
+
+def test_whole_range_uses_coarsest_rollup(rollups):
+    resolution, buckets = rollups.query("arduino_1", START, START + 7 * DAY)
+    assert resolution == DAY
+    assert buckets[0]["count"] == 7 * 24 * 60
+    assert buckets[0]["max"] == 7 * 24 - 1
+
+
+def test_unaligned_range_falls_back_to_finer_rollups(rollups):
+    # minute rollups are kept for the last two days
+    day_6 = START + 6 * DAY
+    resolution, buckets = rollups.query("arduino_1", day_6 + 90 * 60, day_6 + 3 * 3600)
+    assert resolution == 60
+    assert buckets[0]["count"] == 90
+    assert buckets[0]["min"] == 6 * 24 + 1
+
+
+def test_expired_minutes_fall_back_to_hours():
+    rollups = RollupIndex(retention={60: 60, 3600: 48})
+    for minute in range(24 * 60):
+        rollups.add("notecard", START + minute * 60, 1)
+    resolution, buckets = rollups.query("notecard", START, START + 2 * 3600, 60)
+    assert resolution == 3600
+    assert [b["count"] for b in buckets] == [60, 60]
+
+
+def test_invalid_range(rollups):
+    with pytest.raises(ValueError):
+        rollups.query("arduino_1", START, START)
+
+
+def test_ranges_past_retention_only_read_retained_buckets(rollups):
+    # would be billions of minute buckets if the range weren't clipped to the ring
+    far = START + 60 * 10**9
+    resolution, buckets = rollups.query("arduino_1", START + 5 * DAY, far, 60)
+    assert resolution == 60
+    assert len(buckets) == 2 * 24 * 60
+    assert rollups.query("arduino_1", far, far + 60, 60) == (60, [])
+    week = rollups.query("arduino_1", START, START + 7 * DAY, 3600)
+    assert rollups.query("arduino_1", START, far, 3600) == week
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+import pytest  # type: ignore
+
+import main
+import model as m
+from constants import DEFAULT_THRESHOLDS, NotificationType, SensorTypes
+from evaluation import evaluate_batch
+from rules import SensorRules, compile_rules
+from test_evaluation import make_reading
+
+RULES = {
+    "types": {"temperature": {"single_reading": 85}},
+    "sensors": [
+        {"sensor_name": "arduino_1", "sensor_type": "temperature", "average": 75}
+    ],
+}
+
+
+def test_overrides_apply_on_top_of_type_thresholds():
+    table = compile_rules(RULES)
+    temperature = table.lookup(SensorTypes.TEMPERATURE, "notecard")
+    assert temperature.thresholds["single_reading"] == 85
+    assert temperature.thresholds["average"] == 80
+    arduino = table.lookup(SensorTypes.TEMPERATURE, "arduino_1")
+    assert dict(arduino.thresholds) == dict(
+        DEFAULT_THRESHOLDS[SensorTypes.TEMPERATURE], single_reading=85, average=75
+    )
+    # the override is per (sensor_type, sensor_name)
+    assert table.lookup(SensorTypes.HUMIDITY, "arduino_1") is table.lookup(
+        SensorTypes.HUMIDITY, "notecard"
+    )
+
+
+@pytest.mark.parametrize(
+    "rules",
+    [
+        {"types": {"pressure": {}}},
+        {"types": {"temperature": {"lowest": 1}}},
+        {"types": {"temperature": {"average": "hot"}}},
+        {"sensors": [{"sensor_name": "arduino_1"}]},
+        {"types": []},
+        {"sensors": None},
+        {"sensors": {"sensor_name": "arduino_1"}},
+        {"regions": "warehouse"},
+    ],
+)
+def test_invalid_rules(rules):
+    with pytest.raises(ValueError):
+        compile_rules(rules)
+
+
+def test_reloads_when_the_file_changes(tmp_path):
+    path = tmp_path / "rules.json"
+    rules = SensorRules(str(path))
+    assert (
+        rules.lookup(SensorTypes.TEMPERATURE, "arduino_1").thresholds["average"] == 80
+    )
+
+    path.write_text(json.dumps(RULES))
+    assert rules.reload_if_changed()
+    config = rules.lookup(SensorTypes.TEMPERATURE, "arduino_1")
+    assert config.thresholds["average"] == 75
+    assert not rules.reload_if_changed()
+
+    path.write_text("{not json")
+    os.utime(path, ns=(0, 0))
+    assert not rules.reload_if_changed()
+    assert rules.lookup(SensorTypes.TEMPERATURE, "arduino_1") is config
+
+    # valid JSON that isn't shaped like rules is invalid too
+    for invalid in ({"types": []}, {"sensors": None}, []):
+        path.write_text(json.dumps(invalid))
+        os.utime(path, ns=(len(str(invalid)), len(str(invalid))))
+        assert not rules.reload_if_changed()
+        assert rules.lookup(SensorTypes.TEMPERATURE, "arduino_1") is config
+
+
+def test_reload_loop_survives_a_failed_reload(monkeypatch):
+    reloads = []
+
+    def reload_if_changed():
+        reloads.append(None)
+        if len(reloads) == 1:
+            raise RuntimeError("disk went away")
+        if len(reloads) == 3:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(m.sensor_rules, "reload_if_changed", reload_if_changed)
+    monkeypatch.setattr(main, "RulesConfig", SimpleNamespace(RELOAD_INTERVAL=0))
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(main.reload_rules_periodically())
+    assert len(reloads) == 3
+
+
+def test_batch_uses_per_sensor_thresholds():
+    table = compile_rules(RULES)
+    readings = [make_reading(SensorTypes.TEMPERATURE, 70, 77) for _ in range(2)]
+    readings[0].sensor_config = table.lookup(SensorTypes.TEMPERATURE, "arduino_1")
+    assert [t for _, t in evaluate_batch(readings, lambda: False)] == [
+        NotificationType.TOO_HIGH_AVERAGE,
+        NotificationType.NOOP,
+    ]
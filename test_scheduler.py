@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest  # type: ignore
+
+from constants import NotificationType
+from scheduler import NotificationScheduler
+
+
+@pytest.fixture
+def scheduler() -> NotificationScheduler:
+    return NotificationScheduler(cooldown=100, digest_interval=10)
+
+
+def event(*readings):
+    """Returns the parsed readings and notifications of an event from (sensor_name, NotificationType) pairs."""
+    parsed = [SimpleNamespace(sensor_name=name) for name, _ in readings]
+    return parsed, [(r, t) for r, (_, t) in zip(parsed, readings)]
+
+
+def test_repeats_are_suppressed_within_cooldown(scheduler):
+    for now in (0, 50, 99):
+        scheduler.observe(
+            *event(("arduino_1", NotificationType.TOO_HIGH_AVERAGE)), now=now
+        )
+    assert len(scheduler.flush(now=100)) == 1
+    scheduler.observe(*event(("arduino_1", NotificationType.TOO_HIGH_AVERAGE)), now=100)
+    assert len(scheduler.flush(now=200)) == 1
+
+
+def test_alerts_are_merged_into_one_digest_per_interval(scheduler):
+    scheduler.observe(*event(("arduino_1", NotificationType.TOO_HIGH_SINGLE)), now=0)
+    assert len(scheduler.flush(now=0)) == 1
+    scheduler.observe(*event(("arduino_2", NotificationType.TOO_HIGH_SINGLE)), now=1)
+    scheduler.observe(*event(("notecard", NotificationType.TOO_HIGH_AVERAGE)), now=2)
+    assert scheduler.flush(now=5) == []
+    assert [a.reading.sensor_name for a in scheduler.flush(now=10)] == [
+        "arduino_2",
+        "notecard",
+    ]
+
+
+def test_recovery_is_sent_when_condition_clears(scheduler):
+    scheduler.observe(*event(("arduino_1", NotificationType.TOO_HIGH_AVERAGE)), now=0)
+    scheduler.observe(*event(("arduino_1", NotificationType.NOOP)), now=1)
+    alerts = scheduler.flush(now=20)
+    assert [a.recovered for a in alerts] == [False, True]
+    assert not scheduler.active
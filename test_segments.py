@@ -0,0 +1,109 @@
+import multiprocessing
+
+import numpy as np
+import pytest  # type: ignore
+
+from segments import RECORD_DTYPE, SegmentStore, import_store
+from storage import SqliteStore
+
+
+def reading(sensor_name, datetime, sensor_reading=70.0) -> dict:
+    return {
+        "datetime": datetime,
+        "sensor_name": sensor_name,
+        "sensor_reading": sensor_reading,
+        "recent_average": sensor_reading - 1,
+        "sensor_type": 1,
+    }
+
+
+@pytest.fixture
+def segments(tmp_path) -> SegmentStore:
+    segments = SegmentStore(str(tmp_path / "segments"))
+    yield segments
+    segments.close()
+
+
+def test_range_scan_is_a_view_of_the_file(segments):
+    segments.append(reading("arduino/1", t) for t in range(0, 100, 10))
+    segments.append([reading("arduino/1", 100)])
+    records = segments.scan("arduino/1", 20, 50)
+    assert records["datetime"].tolist() == [20, 30, 40, 50]
+    assert not records.flags.owndata
+    assert segments.sensors() == ["arduino/1"]
+
+
+def test_out_of_order_appends_are_still_scanned_in_order(segments):
+    segments.append(reading("notecard", t) for t in (30, 10, 20))
+    assert segments.scan("notecard", 15)["datetime"].tolist() == [20, 30]
+    segments.compact("notecard")
+    assert not segments.scan("notecard", 15).flags.owndata
+
+
+def test_replay_merges_sensors_by_time(segments):
+    segments.append([reading("a", 1), reading("b", 2), reading("a", 3)])
+    assert [(n, int(r["datetime"])) for n, r in segments.replay()] == [
+        ("a", 1),
+        ("b", 2),
+        ("a", 3),
+    ]
+
+
+def test_import_from_store(segments, tmp_path):
+    store = SqliteStore("therm-all-readings", path=str(tmp_path / "test.db"))
+    store.put_many([reading(f"sensor_{i % 3}", i, i) for i in range(50)])
+    assert import_store(segments, store) == 50
+    records = segments.scan("sensor_1")
+    assert np.array_equal(records["datetime"], np.arange(1, 50, 3))
+    assert np.array_equal(records["sensor_reading"], np.arange(1, 50, 3))
+
+
+def test_stores_sharing_a_directory_keep_each_others_records(segments):
+    # as two workers would, with a compaction by one of them in between
+    other = SegmentStore(segments.root)
+    segments.append([reading("a", 1), reading("a", 3)])
+    other.append([reading("a", 2)])
+    segments.compact("a")
+    other.append([reading("a", 4)])
+    segments.append([reading("a", 5)])
+    assert segments.scan("a")["datetime"].tolist() == [1, 2, 3, 4, 5]
+    other.close()
+
+
+def append_from_process(root: str, offset: int, started):
+    segments = SegmentStore(root)
+    segments.append([reading("shared", offset)])
+    # both processes have written to the segment before either carries on
+    started.wait()
+    for t in range(offset + 2, 200, 2):
+        segments.append([reading("shared", t)])
+    segments.close()
+
+
+def test_appends_from_several_processes_are_all_kept(segments):
+    context = multiprocessing.get_context("fork")
+    started = context.Barrier(2)
+    processes = [
+        context.Process(
+            target=append_from_process, args=(segments.root, offset, started)
+        )
+        for offset in (0, 1)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert segments.scan("shared")["datetime"].tolist() == list(range(200))
+
+
+def test_partial_record_left_by_a_crash_is_truncated(segments):
+    segments.append([reading("a", 1)])
+    with open(segments.path("a"), "ab") as f:
+        f.write(b"\x01" * (RECORD_DTYPE.itemsize - 3))
+    # appended to after a restart
+    restarted = SegmentStore(segments.root)
+    restarted.append([reading("a", 2, 71.0)])
+    restarted.close()
+    records = segments.scan("a")
+    assert records["datetime"].tolist() == [1, 2]
+    assert records["sensor_reading"].tolist() == [70.0, 71.0]
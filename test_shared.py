@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+
+import pytest  # type: ignore
+
+import model as m
+from aggregator import SensorWindowAggregator
+from constants import NotificationType
+from scheduler import NotificationScheduler
+from shared import MemorySharedState, SharedState, SqliteSharedState
+from test_scheduler import event
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def state(request, tmp_path) -> SharedState:
+    if request.param == "sqlite":
+        return SqliteSharedState(path=str(tmp_path / "state.db"))
+    return MemorySharedState()
+
+
+def test_flags(state):
+    assert state.get_flag("armed", True)
+    assert state.toggle_flag("armed", True) is False
+    assert state.toggle_flag("armed", True) is True
+    state.set_flag("armed", False)
+    assert not state.get_flag("armed", True)
+    assert state.claim("windows_warmed", now=0, ttl=100)
+    assert not state.claim("windows_warmed", now=50, ttl=100)
+    # a claim expires, e.g. for the workers started after a restart
+    assert state.claim("windows_warmed", now=100, ttl=100)
+
+
+def test_windows(state):
+    # expired readings are purged by the clock, so the window is set in the future
+    now = time.time() + 1000
+    state.add_readings([("arduino_1", now + 10, 1.0), ("arduino_1", now + 20, 3.0)])
+    assert state.window("arduino_1", now=now) == (4.0, 2)
+    assert state.window("arduino_1", now=now + 10) == (3.0, 1)
+    assert state.window("notecard", now=now) == (0.0, 0)
+    assert state.has_readings(now=now + 10)
+    assert not state.has_readings(now=now + 20)
+
+
+def test_alerts(state):
+    assert state.claim_alert("arduino_1", 5, now=0, cooldown=100)
+    assert not state.claim_alert("arduino_1", 5, now=50, cooldown=100)
+    assert state.claim_alert("arduino_1", 1, now=50, cooldown=100)
+    assert state.claim_alert("arduino_1", 5, now=100, cooldown=100)
+    assert state.clear_alerts("arduino_1", keep=[1]) == [5]
+    assert state.active_alerts() == {("arduino_1", 1): 50}
+
+
+def test_workers_sharing_a_file_agree(tmp_path):
+    path = str(tmp_path / "state.db")
+    worker_1, worker_2 = SqliteSharedState(path), SqliteSharedState(path)
+
+    worker_1.toggle_flag("armed", True)
+    assert not worker_2.get_flag("armed", True)
+
+    window_1 = SensorWindowAggregator(state=worker_1)
+    window_2 = SensorWindowAggregator(state=worker_2)
+    window_1.add("arduino_1", 10.0)
+    assert window_2.recent_average("arduino_1", 20.0) == 15.0
+
+    schedulers = [NotificationScheduler(state=s) for s in (worker_1, worker_2)]
+    for now, scheduler in enumerate(schedulers):
+        scheduler.observe(
+            *event(("arduino_1", NotificationType.TOO_HIGH_AVERAGE)), now=now
+        )
+    assert [len(s.flush(now=10)) for s in schedulers] == [1, 0]
+
+
+def test_windows_are_warmed_after_a_restart_only_if_empty(tmp_path):
+    path = str(tmp_path / "state.db")
+    cached = [
+        {"datetime": time.time(), "sensor_name": "arduino_1", "sensor_reading": 10.0}
+    ]
+
+    def start_worker() -> SensorWindowAggregator:
+        window = SensorWindowAggregator(
+            loader=lambda: cached, state=SqliteSharedState(path)
+        )
+        window.warm()
+        return window
+
+    assert start_worker().recent_average("arduino_1", 20.0) == 15.0
+    state = SqliteSharedState(path)
+    # restarted after the claim expired, but the windows kept by the state already hold the cached reading
+    with state._connection() as conn:
+        conn.execute("UPDATE claims SET claimed_at = 0")
+    assert start_worker().recent_average("arduino_1", 20.0) == 15.0
+
+    # every reading expired while the workers were stopped
+    with state._connection() as conn:
+        conn.execute("UPDATE windows SET expires_at = 0")
+        conn.execute("UPDATE claims SET claimed_at = 0")
+    assert start_worker().recent_average("arduino_1", 20.0) == 15.0
+
+
+def test_blocking_state_is_used_off_the_event_loop(monkeypatch, tmp_path):
+    state = SqliteSharedState(path=str(tmp_path / "state.db"))
+    monkeypatch.setattr(m, "shared_state", state)
+    threads = []
+
+    def get_flag(name, default):
+        threads.append(threading.current_thread())
+        return default
+
+    monkeypatch.setattr(state, "get_flag", get_flag)
+    assert asyncio.run(m.run_with_shared_state(m.is_armed))
+    monkeypatch.setattr(m, "shared_state", MemorySharedState())
+    monkeypatch.setattr(m.shared_state, "get_flag", get_flag)
+    assert asyncio.run(m.run_with_shared_state(m.is_armed))
+    assert threads[0] is not threading.main_thread()
+    assert threads[1] is threading.main_thread()
@@ -0,0 +1,60 @@
+import time
+
+import pytest  # type: ignore
+
+from constants import SensorTypes
+from storage import MemoryStore, ReadingStore, SqliteStore
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def store(request, tmp_path) -> ReadingStore:
+    if request.param == "sqlite":
+        store = SqliteStore("therm-all-readings", path=str(tmp_path / "test.db"))
+    else:
+        store = MemoryStore("therm-all-readings")
+    store.put_many(
+        [
+            {
+                "datetime": i,
+                "sensor_name": f"arduino_{i % 3}",
+                "sensor_type": SensorTypes(1 + i % 2),
+                "sensor_reading": i * 1.5,
+            }
+            for i in range(10)
+        ]
+    )
+    return store
+
+
+def test_fetch_with_deta_style_queries(store):
+    assert store.fetch({"sensor_type": 1}).count == 5
+    res = store.fetch({"sensor_name": "arduino_1", "datetime?gte": 4})
+    assert sorted(i["datetime"] for i in res.items) == [4, 7]
+    res = store.fetch([{"sensor_name": "arduino_1"}, {"datetime?lt": 2}])
+    assert sorted(i["datetime"] for i in res.items) == [0, 1, 4, 7]
+
+
+def test_fetch_follows_pagination(store):
+    res = store.fetch(limit=4)
+    items = res.items
+    while res.last:
+        res = store.fetch(limit=4, last=res.last)
+        items += res.items
+    assert sorted(i["datetime"] for i in items) == list(range(10))
+
+
+def test_memory_store_counts_round_trips():
+    store = MemoryStore("recent_readings")
+    store.put_many([{"sensor_name": "arduino_1"}] * 3, expire_in=360)
+    store.fetch({"sensor_name": "arduino_1"})
+    assert store.calls == {"put_many": 1, "fetch": 1}
+
+
+def test_expired_items_are_hidden_and_purged(tmp_path):
+    cache = SqliteStore("recent_readings", path=str(tmp_path / "test.db"))
+    item = cache.put({"sensor_name": "arduino_1", "sensor_reading": 70}, expire_in=1)
+    assert "__expires" in cache.fetch().items[0]
+    time.sleep(1.1)
+    assert cache.fetch().count == 0
+    assert cache.get(item["key"]) is None
+    assert cache.purge_expired() == 1
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest  # type: ignore
+
+import constants as c
+import model as model
+from aggregator import SensorWindowAggregator
+from outliers import HampelFilter
+from trends import TrendTracker
+
+
+@pytest.fixture
+def trends() -> TrendTracker:
+    return TrendTracker(window_seconds=100, alpha=0.5, max_readings=5)
+
+
+def test_mean_and_deviation_are_of_the_readings_before(trends):
+    assert trends.update("arduino_1", 0, 10.0).count == 1
+    trend = trends.update("arduino_1", 10, 20.0)
+    assert (trend.mean, trend.deviation) == (10.0, 0.0)
+    trend = trends.update("arduino_1", 20, 20.0)
+    assert trend.mean == 15.0
+    assert trend.deviation == pytest.approx(5.0)
+
+
+def test_slope_is_fitted_over_the_window(trends):
+    times = np.arange(1665021239, 1665021239 + 400, 20.0)
+    for t in times:
+        trend = trends.update("arduino_1", t, 0.5 * (t - times[0]) + 3)
+    assert trend.slope == pytest.approx(0.5)
+    assert trend.rise == pytest.approx(50.0)
+    # bounded by max_readings as well as the window
+    assert trend.count == len(trends.sensors["arduino_1"].entries) == 5
+
+
+def test_statistics_restart_after_the_sensor_is_silent(trends):
+    trends.update("arduino_1", 0, 10.0)
+    trends.update("arduino_1", 50, 30.0)
+    trend = trends.update("arduino_1", 500, 90.0)
+    assert (trend.mean, trend.count, trend.slope) == (90.0, 1, 0.0)
+
+
+def test_parsed_readings_raise_rate_of_change_notifications(monkeypatch):
+    monkeypatch.setattr(model, "recent_trends", TrendTracker())
+    monkeypatch.setattr(model, "recent_window", SensorWindowAggregator())
+    # a drop this sudden would otherwise be flagged as an outlier
+    monkeypatch.setattr(model, "recent_outliers", HampelFilter(min_readings=100))
+    monkeypatch.setattr(model, "_if_recent_reading", lambda: False)
+    notifications = model.Notifications(queued_notifications=[])
+
+    def reading(t, value):
+        event = model.SensorLogEvent.parse_obj(
+            {
+                "datetime": t,
+                "event": str(t),
+                "best_lat": 45.5,
+                "best_long": -122.6,
+                "readings": [
+                    {
+                        "sensor_name": "arduino_1",
+                        "sensor_reading": value,
+                        "sensor_type": 1,
+                    }
+                ],
+            }
+        )
+        parsed = event.parse_event()[0]
+        # keeps the recent average from hiding the trend rules behind RAPID_INCREASE
+        parsed.recent_average = value
+        return notifications._evaluate_for_notify_logic(parsed)[1]
+
+    assert [reading(t, 50 + t / 20) for t in range(0, 300, 60)][-1] == (
+        c.NotificationType.RAPID_INCREASE_AVERAGE
+    )
+    assert reading(400, 30) == c.NotificationType.RAPID_DECREASE
@@ -0,0 +1,100 @@
+import json
+
+import pytest  # type: ignore
+
+from writer import BatchWriter
+
+
+class FlakyBase:
+    """Stand-in for a Deta Base that fails the first `failures` put_many calls."""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls: list[tuple[list, int]] = []
+
+    def put_many(self, items, expire_in=None):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError
+        self.calls.append((list(items), expire_in))
+
+
+@pytest.fixture
+def writer() -> BatchWriter:
+    # long interval so only explicit flushes and full batches write
+    writer = BatchWriter(batch_size=3, flush_interval=3600, dead_letter_path="")
+    yield writer
+    writer.close()
+
+
+def test_batches_by_database_and_expiration(writer):
+    all_readings, recent_readings = FlakyBase(), FlakyBase()
+    for i in range(4):
+        writer.put(all_readings, {"sensor_reading": i})
+        writer.put(recent_readings, {"sensor_reading": i}, expire_in=360)
+    assert writer.flush()
+    assert writer.queue_depth == 0
+    assert [len(c[0]) for c in all_readings.calls] == [3, 1]
+    assert all(c[1] == 360 for c in recent_readings.calls)
+
+
+def test_failed_batches_are_retried(writer):
+    database = FlakyBase(failures=1)
+    writer.put(database, {"sensor_reading": 1})
+    assert not writer.flush()
+    assert writer.queue_depth == 1
+    assert writer.close()
+    assert database.calls == [([{"sensor_reading": 1}], 0)]
+
+
+def test_failing_database_does_not_block_others(tmp_path):
+    path = tmp_path / "dead.ndjson"
+    # batches never fill up, so only the explicit flushes write
+    writer = BatchWriter(
+        batch_size=100,
+        flush_interval=3600,
+        max_attempts=3,
+        backoff=0,
+        dead_letter_path=str(path),
+    )
+    rejected, good = FlakyBase(failures=10**6), FlakyBase()
+    rejected.name = "rejected"
+    writer.put(rejected, {"sensor_reading": -1})
+    for i in range(10):
+        writer.put(good, {"sensor_reading": i})
+    assert not writer.flush()
+    assert sum(len(items) for items, _ in good.calls) == 10
+    assert writer.queue_depth == 1
+    # given up on after max_attempts and dead lettered
+    assert not writer.flush()
+    assert writer.flush()
+    assert writer.queue_depth == 0
+    assert [json.loads(line) for line in path.read_text().splitlines()] == [
+        {"database": "rejected", "expire_in": 0, "item": {"sensor_reading": -1}}
+    ]
+    writer.close()
+
+
+def test_failed_batches_back_off_and_buffer_is_capped(tmp_path):
+    path = tmp_path / "dead.ndjson"
+    writer = BatchWriter(
+        batch_size=2,
+        flush_interval=3600,
+        max_buffered=4,
+        backoff=3600,
+        dead_letter_path=str(path),
+    )
+    database = FlakyBase(failures=10**6)
+    writer.put(database, {"sensor_reading": 0})
+    assert not writer.flush()
+    # not retried until the backoff has passed
+    assert not writer.flush()
+    assert database.failures == 10**6 - 1
+    for i in range(1, 6):
+        writer.put(database, {"sensor_reading": i})
+    # the oldest batches were dead lettered to stay under max_buffered
+    assert writer.queue_depth <= 4
+    assert len(path.read_text().splitlines()) + writer.queue_depth == 6
+    assert not writer.close()
+    assert writer.queue_depth == 0
+    assert len(path.read_text().splitlines()) == 6
@@ -0,0 +1,124 @@
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Tuple
+
+from constants import TREND_SMOOTHING, CacheConfig, TrendConfig
+
+
+@dataclass(frozen=True, slots=True)
+class Trend:
+    """Statistics of a sensor's readings as of a new reading.
+
+    mean and deviation are the exponentially weighted mean and standard deviation of the readings before it,
+    the baseline the reading is compared against. slope is the least squares slope in units per second of the
+    readings in the window including it, rise is the slope over the whole window and count is the number of
+    readings in the window including it.
+    """
+
+    mean: float
+    deviation: float
+    slope: float
+    rise: float
+    count: int
+
+
+@dataclass
+class SensorTrend:
+    """Incremental statistics of a single sensor, updated in O(1) per reading and held in bounded memory.
+    The regression keeps running sums over the readings in the window, with times relative to origin so the
+    sums stay small enough to subtract without losing precision.
+    """
+
+    entries: Deque[Tuple[float, float]] = field(default_factory=deque)
+    origin: float = 0.0
+    sum_t: float = 0.0
+    sum_y: float = 0.0
+    sum_tt: float = 0.0
+    sum_ty: float = 0.0
+    mean: float = 0.0
+    variance: float = 0.0
+
+    def _add(self, t: float, y: float, sign: int):
+        self.sum_t += sign * t
+        self.sum_y += sign * y
+        self.sum_tt += sign * t * t
+        self.sum_ty += sign * t * y
+
+    def _rebase(self, origin: float):
+        # recomputes the sums from the window, which also resets accumulated floating point drift
+        self.entries = deque((t + self.origin - origin, y) for t, y in self.entries)
+        self.origin = origin
+        self.sum_t = self.sum_y = self.sum_tt = self.sum_ty = 0.0
+        for t, y in self.entries:
+            self._add(t, y, 1)
+
+    def update(
+        self, t: float, y: float, alpha: float, window_seconds: float, max_readings: int
+    ) -> Trend:
+        newest = t if not self.entries else max(t, self.entries[-1][0] + self.origin)
+        while self.entries and (
+            self.entries[0][0] + self.origin <= newest - window_seconds
+            or len(self.entries) >= max_readings
+        ):
+            self._add(*self.entries.popleft(), -1)
+        if not self.entries:
+            # the sensor was silent for longer than the window, so its old baseline no longer applies
+            self.origin, self.mean, self.variance = t, y, 0.0
+            self.sum_t = self.sum_y = self.sum_tt = self.sum_ty = 0.0
+        elif self.entries[0][0] > window_seconds:
+            self._rebase(self.entries[0][0] + self.origin)
+
+        mean, deviation = self.mean, self.variance**0.5
+        diff = y - self.mean
+        increment = alpha * diff
+        self.mean += increment
+        self.variance = (1 - alpha) * (self.variance + diff * increment)
+
+        self.entries.append((t - self.origin, y))
+        self._add(t - self.origin, y, 1)
+        count = len(self.entries)
+        denominator = count * self.sum_tt - self.sum_t**2
+        slope = (
+            (count * self.sum_ty - self.sum_t * self.sum_y) / denominator
+            if count > 1 and denominator > 0
+            else 0.0
+        )
+        return Trend(mean, deviation, slope, slope * window_seconds, count)
+
+
+@dataclass
+class TrendTracker:
+    """Per sensor exponentially weighted mean and variance and rolling regression slope, replacing scans over
+    a sensor's past averages for the rate of change rules of Notifications.
+
+    Readings are timed by their event datetime and should arrive in about time order, as webhook events and
+    sorted bulk batches do. Trends are kept per process, so with several workers each sees its own readings.
+
+    Args:
+        window_seconds (int): Seconds of readings the slope is fitted over. Defaults to CacheConfig.EXPIRATION_TIME.
+        alpha (float): Weight of each new reading in the mean and variance. Defaults to TREND_SMOOTHING.
+        max_readings (int): Most readings kept per sensor for the slope. Defaults to TrendConfig.MAX_READINGS.
+    """
+
+    window_seconds: int = CacheConfig.EXPIRATION_TIME.value
+    alpha: float = TREND_SMOOTHING
+    max_readings: int = TrendConfig.MAX_READINGS.value
+    sensors: Dict[str, SensorTrend] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def update(self, sensor_name: str, t: float, sensor_reading: float) -> Trend:
+        """Adds a reading to its sensor's statistics.
+
+        Args:
+            sensor_name (str): Name of sensor as specified in the reading field of the event
+            t (float): Unix time of the reading
+            sensor_reading (float): Sensor Reading passed in from Notebook event
+
+        Returns:
+            Trend: The sensor's statistics as of this reading
+        """
+        with self._lock:
+            return self.sensors.setdefault(sensor_name, SensorTrend()).update(
+                t, sensor_reading, self.alpha, self.window_seconds, self.max_readings
+            )
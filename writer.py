@@ -0,0 +1,231 @@
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from decouple import config  # type: ignore
+
+import metrics
+from constants import WRITER_BACKOFF, WriterConfig
+
+# NDJSON file of items that couldn't be written, disabled when empty
+DEAD_LETTER_PATH = config("DEAD_LETTER_PATH", default="dead-letters.ndjson")
+
+
+@dataclass
+class PendingBatch:
+    """Items waiting to be written to a single database with a single expiration."""
+
+    database: Any
+    expire_in: int
+    items: List[dict] = field(default_factory=list)
+    attempts: int = 0
+    # time.monotonic() before which a failed batch isn't retried
+    retry_at: float = 0.0
+
+
+class BatchWriter:
+    """Write-behind buffer for database inserts. Items are grouped per database and written with put_many
+    once a batch reaches batch_size or every flush_interval seconds, from a background thread so that
+    ingest doesn't wait on storage round trips.
+
+    A failed batch is retried on its own with exponential backoff while the other batches are written, so one
+    failing database doesn't hold up the rest. After max_attempts tries, or when more than max_buffered items
+    are waiting, the oldest batches are appended to the dead letter file instead, and so is anything left
+    unwritten on close.
+
+    Args:
+        batch_size (int, optional): Items per put_many call. Defaults to WriterConfig.BATCH_SIZE.
+        flush_interval (float, optional): Max seconds an item is buffered. Defaults to WriterConfig.FLUSH_INTERVAL.
+        max_attempts (int, optional): Tries per batch. Defaults to WriterConfig.MAX_ATTEMPTS.
+        max_buffered (int, optional): Most items waiting to be written. Defaults to WriterConfig.MAX_BUFFERED.
+        backoff (float, optional): Seconds before the first retry, doubling after each. Defaults to WRITER_BACKOFF.
+        dead_letter_path (str, optional): NDJSON file for items that weren't written. Defaults to DEAD_LETTER_PATH.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = WriterConfig.BATCH_SIZE.value,
+        flush_interval: float = WriterConfig.FLUSH_INTERVAL.value,
+        max_attempts: int = WriterConfig.MAX_ATTEMPTS.value,
+        max_buffered: int = WriterConfig.MAX_BUFFERED.value,
+        backoff: float = WRITER_BACKOFF,
+        dead_letter_path: str = DEAD_LETTER_PATH,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.max_buffered = max_buffered
+        self.backoff = backoff
+        self.dead_letter_path = dead_letter_path
+        self._buffers: Dict[Tuple[int, int], PendingBatch] = {}
+        self._ready: Deque[PendingBatch] = deque()
+        self._depth = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dead_letter_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of items buffered or awaiting retry."""
+        return self._depth
+
+    def put(self, database, item: dict, expire_in: int = 0):
+        """Buffers an item to be inserted into database. Returns immediately.
+
+        Args:
+            database: Deta database to insert into
+            item (dict): Item to be stored, as returned by ParsedReading.parse_for_db_save()
+            expire_in (int, optional): Number of seconds before result is purged. Defaults to 0.
+        """
+        self.start()
+        key = (id(database), expire_in)
+        overflow = []
+        with self._lock:
+            batch = self._buffers.get(key)
+            if batch is None:
+                batch = self._buffers[key] = PendingBatch(database, expire_in)
+            batch.items.append(item)
+            self._depth += 1
+            if len(batch.items) >= self.batch_size:
+                self._ready.append(self._buffers.pop(key))
+                self._wake.set()
+            # storage is failing and batches are piling up, so the oldest make way
+            while self._depth > self.max_buffered and self._ready:
+                dropped = self._ready.popleft()
+                self._depth -= len(dropped.items)
+                overflow.append(dropped)
+        for dropped in overflow:
+            self._dead_letter(
+                dropped, "more than %s items buffered" % self.max_buffered
+            )
+
+    def flush(self, retry_now: bool = False) -> bool:
+        """Writes every buffered item. A failed batch stays queued until its backoff has passed, and the batches
+        after it are still written.
+
+        Args:
+            retry_now (bool, optional): Retry failed batches even if their backoff hasn't passed. Defaults to False.
+
+        Returns:
+            bool: True if nothing is left to write
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._ready.extend(self._buffers.values())
+                self._buffers.clear()
+                pending = list(self._ready)
+                self._ready.clear()
+            now = time.monotonic()
+            waiting = []
+            for batch in pending:
+                if batch.retry_at > now and not retry_now:
+                    waiting.append(batch)
+                    continue
+                try:
+                    # the write itself is the webhook's insert stage, ingest only buffers the items
+                    with metrics.stage(metrics.INSERT):
+                        batch.database.put_many(batch.items, expire_in=batch.expire_in)
+                    logging.debug(
+                        "inserted batch of %s readings into %s",
+                        len(batch.items),
+                        batch.database,
+                    )
+                except Exception:
+                    batch.attempts += 1
+                    logging.exception(
+                        "failed to insert batch of %s readings into %s, attempt %s",
+                        len(batch.items),
+                        batch.database,
+                        batch.attempts,
+                    )
+                    if batch.attempts < self.max_attempts:
+                        batch.retry_at = now + self.backoff * 2 ** (batch.attempts - 1)
+                        waiting.append(batch)
+                        continue
+                    self._dead_letter(batch, "%s failed attempts" % batch.attempts)
+                with self._lock:
+                    self._depth -= len(batch.items)
+            with self._lock:
+                # batches that are waiting to be retried stay ahead of those queued since
+                self._ready.extendleft(reversed(waiting))
+            return not waiting
+
+    def start(self):
+        """Starts the background flush thread if it isn't already running."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="batch-writer", daemon=True
+            )
+            self._thread.start()
+        atexit.register(self.close)
+
+    def close(self, attempts: int = WriterConfig.SHUTDOWN_ATTEMPTS.value) -> bool:
+        """Stops the background thread and flushes what is left, retrying up to attempts times. Items that still
+        aren't written go to the dead letter file.
+
+        Returns:
+            bool: True if every buffered item was written
+        """
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for _ in range(attempts):
+            if self.flush(retry_now=True):
+                return True
+        with self._lock:
+            pending = list(self._ready)
+            self._ready.clear()
+            self._depth = 0
+        for batch in pending:
+            self._dead_letter(batch, "unwritten on close")
+        return False
+
+    def _dead_letter(self, batch: PendingBatch, reason: str):
+        database = getattr(batch.database, "name", repr(batch.database))
+        logging.error(
+            "gave up on batch of %s readings for %s, %s, dead lettered to %r",
+            len(batch.items),
+            database,
+            reason,
+            self.dead_letter_path,
+        )
+        if not self.dead_letter_path:
+            return
+        try:
+            with self._dead_letter_lock, open(self.dead_letter_path, "a") as f:
+                for item in batch.items:
+                    f.write(
+                        json.dumps(
+                            {
+                                "database": database,
+                                "expire_in": batch.expire_in,
+                                "item": item,
+                            },
+                            default=str,
+                        )
+                        + "\n"
+                    )
+        except OSError:
+            logging.exception("couldn't write to %s", self.dead_letter_path)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if not self._stopped.is_set():
+                self.flush()